@@ -0,0 +1,245 @@
+### Multi-device manager  -every RN2903 attached to the host, one worker per radio
+
+'''
+##        Opens every matching serial port (serial.tools.list_ports.comports()) and runs an
+##        independent asyncio worker per radio, each with its own driver (rn2903.py) and
+##        transmit queue (txqueue.py), so every radio is paced by its own airtime.
+##
+##        SCHC Packets are submitted to one shared queue. A worker takes the next packet as
+##        soon as its radio is done with the previous one: the fastest radios send more,
+##        none sits idle while packets are waiting. The queue is ordered by the priority
+##        given to submit() (high, normal, low of txqueue.py), then by submission order: a
+##        packet sent again keeps its place. A packet longer than the MTU is fragmented
+##        (schc_frag.py) by the worker that takes it, a fragmentation session stays on one
+##        radio since the SCHC ACKs come back to that device.
+##
+##        A packet the radio does not transmit (mac_err, invalid_data_len...) goes back
+##        in the shared queue for any radio, up to 'attempts' times. A radio that stops
+##        answering or is unplugged (I/O error, timeout) leaves the pool, its packet goes
+##        back in the queue. Any other error is the packet's own: its future gets the
+##        exception and the radio goes on. submit() already refuses packets that can never
+##        be sent (too long to fragment, longer than the dwell time or the budget).
+##
+##        Usage:
+##
+##              manager = DeviceManager(setup=set_dr)
+##              await manager.start()
+##              answers = await asyncio.gather(*[manager.submit(1, p) for p in packets])
+##              for line in manager.report():  print(line)
+##              await manager.close()
+##
+#'''
+
+## Import statements
+
+import asyncio
+import time
+
+import serial.tools.list_ports
+
+from rn2903 import connect, txok, rx
+from txqueue import TxQueue, high, normal, region, airtimefile, frame_airtime
+from devsession import StateCache
+from schc_frag import AckOnErrorSender, mtus, fport
+from schc_aggr import dport, aport
+
+vids = (0x04d8,)        # Microchip: MCP2200 USB-UART of the RN2903 boards, LoRa Mote
+attempts = 8            # sends of a packet before giving up
+lost = (IOError, asyncio.TimeoutError)          # errors of the radio, not of the packet
+
+
+# Serial ports with an RN2903: Microchip USB VID, or CDC-ACM devices. 'match' picks the
+# ports whose device name contains it instead
+
+def rn2903_ports(match=None):
+    ports = []
+    for p in serial.tools.list_ports.comports():
+        if match is not None:
+            if match in p.device:
+                ports.append(p.device)
+        elif p.vid in vids or 'ACM' in p.device:
+            ports.append(p.device)
+    return sorted(ports)
+
+
+class Device(object):
+
+    def __init__(self, port, radio, queue):
+        self.port = port
+        self.radio = radio
+        self.queue = queue                  # TxQueue of the radio
+        self.pacing = None                  # queue.run() task
+        self.worker = None
+        self.packets = 0                    # SCHC Packets delivered
+        self.bytes = 0
+        self.failed = 0
+        self.start = time.monotonic()
+        self.error = None                   # why the radio left the pool
+
+    # Payload bytes per second since the radio joined the pool
+
+    def throughput(self, now=None):
+        now = time.monotonic() if now is None else now
+        return self.bytes/max(now - self.start, 1e-9)
+
+
+class DeviceManager(object):
+
+    def __init__(self, ports=None, dr=3, region=region, budget=None, setup=None, log=None,
+                 connect=connect):
+        self.ports = rn2903_ports() if ports is None else list(ports)
+        self.dr = dr
+        self.region = region
+        self.budget = budget
+        self.mtu = mtus[dr]
+        self.setup = setup                  # coroutine run on every radio once connected
+        self.log = StateCache(airtimefile) if log is None else log      # pacing, by EUI
+        self.connect = connect              # coroutine opening the driver of a port
+        self.devices = []
+        self.work = None                    # shared asyncio.PriorityQueue of (priority, seq,
+                                            #  port, data, confirmed, future, sends)
+        self.seq = 0
+
+    # Connect every port at once, ports that fail are left out
+
+    async def start(self):
+        self.work = asyncio.PriorityQueue()
+        opened = await asyncio.gather(*[self.open(port) for port in self.ports],
+                                      return_exceptions=True)
+        for port, dev in zip(self.ports, opened):
+            if isinstance(dev, Exception):
+                print("RN2903 on " + port + " left out: " + repr(dev))
+                continue
+            dev.pacing = asyncio.ensure_future(dev.queue.run())
+            dev.worker = asyncio.ensure_future(self.serve(dev))
+            self.devices.append(dev)
+        if not self.devices:
+            raise IOError("no RN2903 could be opened")
+        return self.devices
+
+    async def open(self, port):
+        radio = await self.connect(port)
+        try:
+            if self.setup is not None:
+                await self.setup(radio)
+            eui = await radio.hweui()
+        except Exception:
+            radio.close()
+            raise
+        queue = TxQueue(radio, self.dr, self.region, self.budget, log=self.log, key=eui)
+        return Device(port, radio, queue)
+
+    # Queue a SCHC Packet on FPort 'port' for any radio, returns the answer of the module
+    # (status, downlink FPort, data)
+
+    def submit(self, port, data, confirmed=False, priority=normal):
+        data = bytes(data)
+        self.check(port, data)
+        future = asyncio.get_event_loop().create_future()
+        self.work.put_nowait((priority, self.seq, port, data, confirmed, future, 0))
+        self.seq += 1
+        return future
+
+    # ValueError if the packet can never be sent, fragmented or not
+
+    def check(self, port, data):
+        if len(data) > self.mtu:
+            AckOnErrorSender(self.framed(port, data), self.mtu)     # too long for 4 windows
+            data = data[:self.mtu]                                  # longest fragment
+        frame_airtime(len(data), self.dr, self.region, self.budget)
+
+    # Packet as fragmented: with FPort Rule IDs its FPort goes first
+
+    def framed(self, port, data):
+        if port not in (dport, aport):
+            return bytes(bytearray([port])) + data
+        return data
+
+    async def join(self):
+        await self.work.join()
+
+    ## Workers
+
+    async def serve(self, dev):
+        while True:
+            priority, seq, port, data, confirmed, future, sends = item = await self.work.get()
+            try:
+                answer = await self.deliver(dev, port, data, confirmed, priority)
+            except asyncio.CancelledError:
+                self.work.put_nowait(item)
+                self.work.task_done()
+                raise
+            except lost as exc:
+                dev.error = exc
+                self.work.put_nowait(item)      # another radio sends it
+                self.work.task_done()
+                self.leave(dev)
+                return
+            except Exception as exc:
+                self.work.task_done()
+                dev.failed += 1
+                future.set_exception(exc)       # the packet's error, the radio goes on
+                continue
+            self.work.task_done()
+            if answer[0] in (txok, rx):
+                dev.packets += 1
+                dev.bytes += len(data)
+                future.set_result(answer)
+            elif sends + 1 >= attempts:
+                dev.failed += 1
+                future.set_result(answer)
+            else:
+                self.work.put_nowait(item[:-1] + (sends + 1,))
+
+    # One SCHC Packet through the radio of 'dev', fragmented if longer than the MTU
+
+    async def deliver(self, dev, port, data, confirmed, priority=normal):
+        if len(data) <= self.mtu:
+            return await dev.queue.send(port, data, confirmed, priority)
+        frag = AckOnErrorSender(self.framed(port, data), self.mtu)
+        fragments = frag.fragments()
+        while not (frag.done or frag.aborted):
+            if not fragments:
+                fragments.append(frag.ack_request())
+            status, rxport, rxdata = await dev.queue.send(fport, fragments.pop(0), False, high)
+            if status == rx and rxport == fport:
+                fragments.extend(frag.on_ack(rxdata))   # SCHC ACK
+        return (txok if frag.done else 'frag_abort'), None, None
+
+    # A radio out of the pool (dev.error set). With no radio left the waiting packets fail
+
+    def leave(self, dev):
+        dev.pacing.cancel()
+        dev.radio.close()
+        print("RN2903 on " + dev.port + " left the pool: " + repr(dev.error))
+        if any(d.error is None for d in self.devices):
+            return
+        while not self.work.empty():
+            future = self.work.get_nowait()[5]
+            self.work.task_done()
+            if not future.done():
+                future.set_exception(IOError("no RN2903 left"))
+
+    ## Statistics
+
+    def report(self):
+        now = time.monotonic()
+        lines = []
+        for dev in self.devices:
+            name = dev.port + (": " if dev.error is None else " (left): ")
+            lines.append(name + str(dev.packets) + " packets, " + str(dev.bytes)
+                         + " bytes, " + str(round(dev.throughput(now), 1)) + " B/s, airtime "
+                         + str(round(dev.queue.airtime, 3)) + " s, " + str(dev.failed)
+                         + " failed")
+        total = sum(dev.throughput(now) for dev in self.devices)
+        alive = sum(1 for dev in self.devices if dev.error is None)
+        lines.append("total: " + str(round(total, 1)) + " B/s on " + str(alive) + " radios")
+        return lines
+
+    async def close(self):
+        for dev in self.devices:
+            dev.worker.cancel()
+            dev.pacing.cancel()
+        await asyncio.gather(*[dev.worker for dev in self.devices], return_exceptions=True)
+        for dev in self.devices:
+            dev.radio.close()
@@ -0,0 +1,168 @@
+### Cached RN2903 state  -only the settings that differ are sent at start-up
+
+'''
+##        The RN2903 keeps its keys, addresses and channels in EEPROM after 'mac save', so
+##        most start-ups have nothing to change there. The data rate, power index, ADR and
+##        retransmission settings are not saved: they are back to their defaults after every
+##        reset, and ADR changes the data rate and power while the module runs. A Session
+##        holds the desired profile of the module, as the 'mac set' parameters and values:
+##
+##              profile = ordic([('dr', '3')])
+##              profile.update(abp(devaddr, nwkskey, appskey))
+##              profile.update(subband(2))
+##
+##        The last known state of every module is kept in a local JSON file, by hardware
+##        EUI. At start-up the module is asked its EUI, the profile is compared with the
+##        cached state and only the 'mac set' commands that differ are sent, then one
+##        'mac save' if a saved setting changed. A module not in the cache is queried once
+##        ('mac get' of every parameter of the profile). The 'volatile' parameters are never
+##        cached: every start-up queries them ('mac get dr'...) and sets the ones that
+##        differ. With nothing to change a start-up is 'sys get hweui', the 'mac get' of the
+##        volatile parameters of the profile and 'mac get status' (join status, also lost
+##        at every reset).
+##
+##        Keys can not be read back from the module: they are cached as SHA-256 digests,
+##        never in clear, and always set on a module seen for the first time. The cache is
+##        written after 'mac save' only, so it never holds settings the module could have
+##        lost; when a 'mac set' fails the module is dropped from the cache.
+##
+##        Usage, also as the 'setup' of devmanager.DeviceManager:
+##
+##              session = Session(profile, join='abp')
+##              sent = await session.open(radio)
+##
+#'''
+
+## Import statements
+
+import hashlib
+import json
+import os
+from collections import OrderedDict as ordic
+
+from rn2903 import okay, invalid
+
+cachefile = os.path.join(os.path.expanduser('~'), '.rn2903-state.json')
+secret = ('nwkskey', 'appskey', 'appkey')       # write-only parameters
+volatile = ('dr', 'pwridx', 'adr', 'retx', 'rxdelay1', 'ar', 'rx2')    # not kept by 'mac save'
+joined = 1                                      # join bit of 'mac get status'
+
+
+## Profiles
+
+def abp(devaddr, nwkskey, appskey):
+    return ordic([('devaddr', devaddr), ('nwkskey', nwkskey), ('appskey', appskey)])
+
+
+def otaa(deveui, appeui, appkey):
+    return ordic([('deveui', deveui), ('appeui', appeui), ('appkey', appkey)])
+
+
+# US915 sub-band n (1..8): its 8 125 kHz channels and its 500 kHz channel on, all others off
+
+def subband(n):
+    on = set(range(8*(n - 1), 8*n)) | set([64 + n - 1])
+    return ordic([('ch status ' + str(ch), 'on' if ch in on else 'off') for ch in range(72)])
+
+
+# Cached form of a value: lower case, SHA-256 digest for keys
+
+def digest(name, value):
+    value = str(value).lower()
+    if name in secret:
+        return hashlib.sha256(value.encode('ascii')).hexdigest()
+    return value
+
+
+## State file
+
+class StateCache(object):
+
+    def __init__(self, path=cachefile):
+        self.path = path
+        try:
+            with open(path) as f:
+                self.states = json.load(f)      # hardware EUI -> {parameter: value}
+        except (IOError, ValueError):
+            self.states = {}
+
+    def get(self, eui):
+        state = self.states.get(eui)
+        return None if state is None else dict(state)
+
+    def put(self, eui, state):
+        self.states[eui] = state
+        self.write()
+
+    def drop(self, eui):
+        if self.states.pop(eui, None) is not None:
+            self.write()
+
+    # Whole file rewritten, replaced at once
+
+    def write(self):
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.states, f, indent=1, sort_keys=True)
+        os.replace(tmp, self.path)
+
+
+class Session(object):
+
+    def __init__(self, profile, join=None, cache=None):
+        self.profile = ordic(profile)
+        self.join = join                        # 'abp', 'otaa' or None (no join)
+        self.cache = StateCache() if cache is None else cache
+
+    # Bring the module to the profile, returns the 'mac set' commands sent
+
+    async def open(self, radio):
+        eui = await radio.hweui()
+        state = self.cache.get(eui)
+        queried = state is None
+        if queried:
+            state = await self.query(radio, self.profile)
+        else:
+            state.update(await self.query(radio, [n for n in self.profile if n in volatile]))
+        sent = []
+        for name, value in self.profile.items():
+            if state.get(name) == digest(name, value):
+                continue
+            cmd = 'mac set ' + name + ' ' + str(value)
+            answer, _ = await radio.command(cmd)
+            if answer != okay:
+                self.cache.drop(eui)
+                raise ValueError(cmd + ": " + answer)
+            state[name] = digest(name, value)
+            sent.append(cmd)
+        saved = [cmd for cmd in sent if cmd.split()[2] not in volatile]
+        if saved:
+            answer, _ = await radio.command('mac save')
+            if answer != okay:
+                self.cache.drop(eui)
+                raise IOError("mac save: " + answer)
+        if saved or queried:
+            self.cache.put(eui, dict((k, v) for k, v in state.items() if k not in volatile))
+        if self.join is not None:
+            await self.joined(radio)
+        return sent
+
+    # 'mac get' of every readable parameter of 'names'
+
+    async def query(self, radio, names):
+        state = {}
+        for name in names:
+            if name in secret:
+                continue
+            value, _ = await radio.command('mac get ' + name)
+            if value != invalid:
+                state[name] = digest(name, value)
+        return state
+
+    async def joined(self, radio):
+        status, _ = await radio.command('mac get status')
+        if int(status, 16) & joined:
+            return
+        first, last = await radio.command('mac join ' + self.join)
+        if last != 'accepted':
+            raise IOError("mac join " + self.join + ": " + str(last or first))
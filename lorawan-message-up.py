@@ -24,6 +24,24 @@
 ##        The maximum size for the packets is dependent on the LoRaWAN protocol's Data Rate,
 ##        which is variable. The maximum size will be explicitly established here.
 ##
+##        SCHC Packets longer than that are sent as SCHC Fragments (ACK-on-Error, see
+##        schc_frag.py) on the fragmentation FPort. SCHC ACKs come back as 'mac_rx' downlinks
+##        on that FPort and only the missing tiles are sent again.
+##
+##        Several SCHC Packets ('schcqueue', see runstack.py) are aggregated into as few
+##        frames as the MTU allows (see schc_aggr.py). A frame is sent again until a
+##        module reports it transmitted ('mac_tx_ok' or a downlink).
+##
+##        Every RN2903 attached to the host is used (devmanager.py): one worker per radio,
+##        the frames go to whichever radio is free. The modules are driven through rn2903.py
+##        (asyncio, no fixed delays) and every radio has the transmit queue of txqueue.py,
+##        paced by time-on-air and the regional limits. Packets sent as SCHC Fragments go
+##        first: their fragmentation sessions are the longest, they start while the short
+##        frames share the other radios.
+##
+##        The settings of the modules (data rate...) are only sent when they differ from the
+##        last known state of the module, cached in a local file (devsession.py).
+##
 ##        SCHC is a compression and fragnentation mechanism for IPv6 packets [RFC 8200] over
 ##        Low Power Wide Area Network (LPWAN) [RFC 8376] technologies. It is currently under
 ##        development by the Internet Engineering Task Force (IETF).
@@ -37,16 +55,21 @@
 
 ## Import statements
 
-import time
 #import sys as system
-import serial, time
-import serial.tools
-import serial.tools.list_ports
+from binascii import unhexlify
 
-from bitstring import Bits as bits, BitArray as bar, BitStream as bst, ConstBitStream as conbst
+import asyncio
 
+from bitstring import Bits as bits
 
-comports = [comport.device for comport in serial.tools.list_ports.comports()]
+from schc_frag import mtus
+from schc_aggr import aggregate
+from devmanager import DeviceManager, rn2903_ports
+from txqueue import high, normal
+from devsession import Session, ordic
+
+
+comports = rn2903_ports()       # every RN2903 attached, see devmanager.py
 print(comports)
 
 complen = len(comports)
@@ -68,19 +91,12 @@ for x in comports:
 #'''
 ##############
 
-targetcomport = comports[complen-1]
-
-print("Target comport: " + targetcomport)
-
+if not complen:
+    print("Device not connected")
+    raise SystemExit(0)
 
-## Serial interface
+print("Target comports: " + ", ".join(comports))
 
-ser = serial.Serial(
-	port = targetcomport,
-	baudrate = 57600,
-	timeout = 3,
-        write_timeout = 3
-        )
 
 ## Correct hex format
 
@@ -88,125 +104,63 @@ pad = bits(len(schcP)%8)      # padding bits  -   lora need an integer number of
 
 loradata = ( schcP + pad ).hex
 
+try:
+    schcqueue           # SCHC Packets to send, from runstack.py
+except NameError:
+    schcqueue = [unhexlify(loradata)]
+
 ## Defaults
 
-txtype = 'cnf '         # message requires an ACK from server
-portno = '1 '          # device's port number, not to confuse with channel
+txtype = True           # message requires an ACK from server (cnf)
 
-## Join gateway
+mtu = mtus[3]           # data rate is fixed to DR 3 (or 4, same MTU) below
 
-#cmd = 'mac join abp'
+budget = 30             # seconds of airtime per day and device (network fair-use policy),
+                        # kept across runs in txqueue.airtimefile. None for no limit
 
-## Input command
+## Aggregation     -SCHC Packets packed into frames up to the MTU. With FPort Rule IDs
+##                  (FPortCode, compress() returns (FPort, SCHC Packet)) every SCHC Packet
+##                  goes alone on the FPort of its Rule
 
-cmd = 'mac tx ' + txtype + portno + loradata
+if schcqueue and isinstance(schcqueue[0], tuple):
+    pending = list(schcqueue)
+else:
+    pending = aggregate(schcqueue, mtu)     # (FPort, data) frames left to send
+print(str(len(schcqueue)) + " SCHC Packets in " + str(len(pending)) + " frames")
 
+## Module settings  -'mac set' parameters, see devsession.py for keys (abp/otaa) and the
+##                   US915 sub-band (subband)
 
-#exit variables
-exit = False
+profile = ordic([('dr', '3')])
 
-## Initalize datarate fix
+## Join gateway
 
-dr = None
+join = None             # 'abp' or 'otaa' to join when the module is not joined
 
-setdr = bytes(("mac set dr 3\r\n").encode('ascii'))     # set datarate to DR = 3 (command)
-getdr = bytes(("mac get dr\r\n").encode('ascii'))       # get datarate (command)
+## Transmission
 
+session = Session(profile, join=join)
 
-## Start transmission
 
-#'''
-while not exit:
+async def transmit():
+    manager = DeviceManager(comports, dr=3, budget=budget, setup=session.open)
+    await manager.start()
     try:
-        #fix datarate
-        ser.write(getdr)
-        dr = ser.read(3).rstrip()
-        print("dr = " + dr)
-        #check datarate
-        while dr not in {"3","4"}:
-            #ser.flushInput()
-            print(ser.read(20))
-            ser.write(setdr)
-            print(ser.read(20))
-            ser.write(getdr)
-            print("in bytes = " + str(ser.in_waiting))
-            dr = ser.read(3).rstrip()
-            print("dr = " + dr)
-            time.sleep(1)
-                
-        outdataCRLF = bytes((cmd + '\r\n').encode('ascii'))
-
-        out = outdataCRLF
-
-        if ser.in_waiting > 0:
-            print('in buffer bytes: ' + str(ser.in_waiting))
-            indata = ser.read(100).rstrip()
-            print(indata)
-        if ser.out_waiting > 0:
-            print('out buffer bytes: ' + str(ser.out_waiting))
-
-        print('Sending command "' + str(cmd) + '"')
-
-        ser.write(out)
-        #print('out buffer bytes: ' + str(ser.out_waiting))
-        
-        time.sleep(0.5)     #wait first answer
-
-        #print('out buffer bytes: ' + str(ser.out_waiting))
-        wait = False
-        printwait = True
-        
-        while ser.in_waiting > 0 or wait:
-            while wait:
-                if printwait:
-                    print("Waiting for response...")
-                    printwait = False
-                try:
-                    if ser.in_waiting > 0:
-                        printwait = True
-                        break
-                except KeyboardInterrupt:
-                    break
-            time.sleep(0.1)
-            print('in buffer bytes: ' + str(ser.in_waiting))
-            indata = ser.read(100).rstrip()
-            print(indata)
-            wait = False
-            #time.sleep(3)
-
-            if ("busy" in indata) or (indata == "ok"):
-                wait = True
-            
-            #print('out buffer bytes: ' + str(ser.out_waiting))
-
-##        indata = ser.read(100).rstrip()
-##        print(indata)
-
-
-
-    except KeyboardInterrupt:
-        loop = False
-        exit = True
-        print("\nLoop stopped\n")
+        # frames longer than the MTU are fragmented by the radio that takes them, first
+        answers = await asyncio.gather(*[
+            manager.submit(port, data, txtype, high if len(data) > mtu else normal)
+            for port, data in pending])
+        for (port, data), answer in zip(pending, answers):
+            print("FPort " + str(port) + ", " + str(len(data)) + " bytes: " + answer[0])
+        for line in manager.report():
+            print(line)
+    finally:
+        await manager.close()
+
+
+try:
+    asyncio.run(transmit())
+except KeyboardInterrupt:
+    print("\nLoop stopped\n")
 
-#'''
 print("Ending Program")
-'''
-#'''
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
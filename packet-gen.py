@@ -20,8 +20,8 @@
 ##        The maximum size for the packets is dependent on the LoRaWAN protocol's Data Rate,
 ##        which is variable. The maximum size will be explicitly established here.
 ##
-##        This SCHC implementation only considers compression/decompression. Fragmentation will
-##        not be supported, therefore the maximum packet size limitation.
+##        SCHC Packets longer than the LoRaWAN MTU are sent as SCHC Fragments, ACK-on-Error
+##        mode (see schc_frag.py), and reassembled at the gateway (see schc_reasm.py).
 ##
 ##        
 ##            -Code by Nicolás Maturana
@@ -91,12 +91,12 @@ sa  = sourceAddress = bits(ba(128))             # 128 bits, value = random
 da  = destinationAddress = bits(ba(128))        # 128 bits, value = random
 pd  = payload       = bits(ba(pds * 8))         # bits, value = random
 
-print "v: ",v, v.length
-print "tc: ",tc, tc.length
-print "fl: ",fl, fl.length
-print "pl: ",pl, pl.int, pl.length
-print "sa: ",sa, sa.length
-print "da: ",da, da.length
+print("v: ", v, v.length)
+print("tc: ", tc, tc.length)
+print("fl: ", fl, fl.length)
+print("pl: ", pl, pl.int, pl.length)
+print("sa: ", sa, sa.length)
+print("da: ", da, da.length)
 
 
 #######
@@ -118,16 +118,16 @@ hdr = header    = v + tc + fl + pl + nh + hl + sa + da
 pfds = packetFields = [v, tc, fl, pl, nh, hl, sa, da, pd]
 ip6 = ipv6Packet    = bits(v + tc + fl + pl + nh + hl + sa + da + pd)
 bs  = bitSize       = ip6.length
-print ip6;''' print ip6.bin; '''
-print bs, bs/8
+print(ip6);''' print(ip6.bin); '''
+print(bs, bs//8)
 
 # Visual format
 
 k = 32
 lines = [None]*bs
-print "bs = ",bs
-print len(lines)
-print "\n"
+print("bs = ", bs)
+print(len(lines))
+print("\n")
 
 hexlines = [None]*10
 binlines = [None]*10
@@ -136,12 +136,12 @@ for i in range (0, 10):
     binlines[i] = ip6[(i)*k:(i+1)*k].bin
 
 for i in range (0, 10):
-    print hexlines[i]
+    print(hexlines[i])
     
-print "\n"
+print("\n")
 
 for i in range (0, 10):
-    print binlines[i]
+    print(binlines[i])
 
 
 
@@ -9,6 +9,8 @@ import sys as system
 import serial, time
 import serial.tools
 import serial.tools.list_ports
+import asyncio
+from rn2903 import connect
 #from cominit import cominit
 
 comports = [comport.device for comport in serial.tools.list_ports.comports()]
@@ -36,12 +38,9 @@ targetcomport = comports[complen-1]
 
 print("Target comport: " + targetcomport)
 
-ser = serial.Serial(
-	port = targetcomport,
-	baudrate = 57600,
-	timeout = 3,
-        write_timeout = 3
-        )
+aio = asyncio.new_event_loop()         # one loop for every command of the session
+asyncio.set_event_loop(aio)
+radio = aio.run_until_complete(connect(targetcomport))   # rn2903.py, answers by CRLF line
 
 ##  Command list -initialization
 
@@ -53,13 +52,13 @@ try:
 except NameError:
     while True:
             try:
-                init=input("Inicializar? 1=sí / 0=no\n")
+                init=int(input("Inicializar? 1=sí / 0=no\n"))
                 if init not in {0, 1, True, False}:
                     print("init debe pertenecer a {0, 1, True, False}")
                     continue
                 else:
                     break
-            except NameError:
+            except ValueError:
                 print("init debe pertenecer a {0, 1, True, False}")
                 continue
 
@@ -67,7 +66,7 @@ if init in {0, 1, True, False}:
     if init in {1, True}:
         #try:
         print("init= " + str(init) + "\nInicializando...")
-        execfile("cominit.py")
+        exec(open("cominit.py").read())
         #except NameError:
     else:
         print("init= " + str(init) + "\nContinuando sin inicializar.")
@@ -92,8 +91,6 @@ incomplete = False
 loop = False
 exit = False
 
-response2group = ("mac tx", "mac join")
-
 ## Comenzar rutina de comandos
 
 while not exit:
@@ -121,13 +118,13 @@ while not exit:
                 loop = True
                 break
             elif aux == 'print':
-                var = raw_input("Input variable to print\n")
+                var = input("Input variable to print\n")
                 if var == '':
                     continue
                 print(var + " = "); print(eval(var))
                 continue
             elif aux == 'exec':
-                var = raw_input("Input expression to execute\n")
+                var = input("Input expression to execute\n")
                 if var == '':
                     continue
                 exec(var)
@@ -138,13 +135,13 @@ while not exit:
                 if str(cmd) == 'None' or str(cmd) == '':
                     continue
                 elif cmd == 'print':
-                    var = raw_input("Input variable to print\n")
+                    var = input("Input variable to print\n")
                     if var == '':
                         continue
                     print(var + " = "); print(eval(var))
                     continue
                 elif cmd == 'exec':
-                    var = raw_input("Input expression to execute\n")
+                    var = input("Input expression to execute\n")
                     if var == '':
                         continue
                     exec(var)
@@ -188,67 +185,27 @@ while not exit:
         pass
 
     try:
-        outdataCRLF = bytes((cmd + '\r\n').encode('ascii'))
-
-        out = outdataCRLF
-
-        if ser.in_waiting > 0:
-            print('in buffer bytes: ' + str(ser.in_waiting))
-            indata = ser.read(100).rstrip()
-            print(indata)
-        if ser.out_waiting > 0:
-            print('out buffer bytes: ' + str(ser.out_waiting))
+        while radio.unsolicited:
+            print(radio.unsolicited.popleft())      # late answers
 
         print('Sending command "' + str(cmd) + '"')
-        ser.write(out)
-
-        #print('out buffer bytes: ' + str(ser.out_waiting))
-        
-        time.sleep(0.8)     #wait first answer
-
-        #print('out buffer bytes: ' + str(ser.out_waiting))
-        wait = False
-        printwait = True
-        incomplete = True
-        while ser.in_waiting > 0 or wait:
-            incomplete = False
-            tries = 0
-            while wait:
-                try:
-                    if printwait:
-                        print("Waiting for response...")
-                        printwait = False
-                    if ser.in_waiting > 0:
-                        break
-                    time.sleep(1)
-                    tries += 1
-                    if tries >= 20:
-                        print("Timeout: No response")
-                        break
-                except KeyboardInterrupt:
-                    break
-            time.sleep(0.1)
-            print('in buffer bytes: ' + str(ser.in_waiting))
-            indata = ser.read(ser.in_waiting).rstrip()
-            print(indata)
-            wait = False
-            printwait = True
-
-            response = any( cmd.startswith(z) for z in response2group )
-            if ("busy" in indata) or (indata == "ok" and response):
-                wait = True
-            
-            #print('out buffer bytes: ' + str(ser.out_waiting))
-
-##        indata = ser.read(100).rstrip()
-##        print(indata)
-
-
+        incomplete = False
+        try:
+            # every answer of the command: 'ok' then mac_tx_ok / accepted... when there
+            # is a second one, returns as soon as the module has answered
+            first, last = aio.run_until_complete(radio.command(cmd))
+            print(first)
+            if last is not None:
+                print(last)
+        except asyncio.TimeoutError:
+            print("Timeout: No response")
+            incomplete = True
 
     except KeyboardInterrupt:
         loop = False
         print("\nLoop stopped\n")
 
+radio.close()
 print("Ending Program")
 '''
 #'''
@@ -0,0 +1,247 @@
+### RN2903 driver checks  -simulated module, no serial port needed
+
+'''
+##        Runs the asyncio driver (rn2903.py) against a simulated RN2903: the answers of
+##        the module are fed to the driver as the serial port would, possibly several lines
+##        in one read or one line over several reads. The multi-device manager (devmanager.py)
+##        runs on several simulated modules, one of them unplugged while sending. The cached
+##        start-up (devsession.py) runs on a module that loses its data rate at every reset.
+##
+##        Usage:   python rn2903-check.py
+##
+#'''
+
+## Import statements
+
+import asyncio
+import os
+import tempfile
+import time
+
+from rn2903 import RN2903, okay, txok, rx, invalid
+from txqueue import TxQueue, airtime, day, high
+from devsession import StateCache, Session, abp, ordic
+from devmanager import DeviceManager
+
+## Simulated module
+
+# Transport of a simulated module: every command written gets the chunks returned by
+# 'answers' (a function of the command), one data_received call per chunk. A chunk None
+# unplugs the module
+
+class FakeTransport(object):
+
+    def __init__(self, radio, answers):
+        self.radio = radio
+        self.answers = answers
+        self.written = []
+        self.closed = False
+        radio.connection_made(self)
+
+    def write(self, data):
+        cmd = data.decode('ascii').rstrip('\r\n')
+        self.written.append(cmd)
+        loop = asyncio.get_event_loop()
+        for chunk in self.answers(cmd):
+            if chunk is None:
+                loop.call_soon(self.close)
+            else:
+                loop.call_soon(self.radio.data_received, chunk)
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.radio.connection_lost(None)
+
+
+def module(cmd):
+    if cmd.startswith('mac tx'):
+        if cmd.split()[3] == '20':
+            return [b'ok\r\nmac_rx 20 c0\r\n']          # both answers in one read
+        if cmd.split()[3] == '7':
+            return [b'ok\r\nmac_rx 7 zz\r\n']           # downlink that is not hex
+        return [b'ok\r\nmac_tx_ok\r\n']
+    if cmd == 'mac get dr':
+        return [b'3', b'\r', b'\n']                     # one answer over several reads
+    if cmd == 'sys get hweui':
+        return [b'0004A30B001C0530\r\n']
+    return [b'invalid_param\r\n']
+
+
+def unplugged(cmd):
+    if cmd.startswith('mac tx'):
+        return [b'ok\r\n', None]
+    return module(cmd)
+
+
+# Module with MAC settings: 'mac set' / 'mac get' of 'settings', reset() puts the data rate
+# back to its default as the RN2903 does ('mac save' does not keep it)
+
+class Settings(object):
+
+    def __init__(self):
+        self.settings = {'dr': '0', 'devaddr': '00000000'}
+        self.commands = []
+
+    def reset(self):
+        self.settings['dr'] = '0'
+
+    def __call__(self, cmd):
+        self.commands.append(cmd)
+        words = cmd.split()
+        if cmd.startswith('mac get ') and words[2] in self.settings:
+            return [self.settings[words[2]].encode('ascii') + b'\r\n']
+        if cmd.startswith('mac set '):
+            self.settings[words[2]] = words[3]
+            return [b'ok\r\n']
+        if cmd == 'mac save':
+            return [b'ok\r\n']
+        return module(cmd)
+
+
+def fake_radio(answers=module):
+    radio = RN2903()
+    FakeTransport(radio, answers)
+    return radio
+
+
+## Checks
+
+def check_driver():
+    async def run():
+        radio = fake_radio()
+        t = time.time()
+        assert await radio.tx(1, b'\x01\x02') == (txok, None, None)
+        assert await radio.tx(20, b'\x01') == (rx, 20, b'\xc0')
+        assert await radio.command('mac get dr') == ('3', None)
+        assert await radio.command('foo') == (invalid, None)
+        assert await radio.command('mac tx uncnf 1 00', txwait=0.5) == (okay, txok)
+        assert time.time() - t < 0.5, "an answer waited for a timeout"
+        assert not radio.unsolicited
+        radio.close()
+    asyncio.run(run())
+    print("rn2903: answers in one read, one answer over several reads  ok")
+
+
+# Pacing state written by one TxQueue is the starting point of the next one (next run)
+
+def check_txqueue_log():
+    async def run(path):
+        budget = 2*airtime(10, 3)
+        first = TxQueue(fake_radio(), dr=3, budget=budget, log=StateCache(path), key='eui')
+        pacing = asyncio.ensure_future(first.run())
+        for k in range(2):
+            assert (await first.send(1, b'x'*10))[0] == txok
+        pacing.cancel()
+        later = TxQueue(fake_radio(), dr=3, budget=budget, log=StateCache(path), key='eui')
+        assert list(later.spent) == list(first.spent)
+        assert later.delay(airtime(10, 3), time.time()) > day - 60, "budget not carried over"
+        other = TxQueue(fake_radio(), dr=3, budget=budget, log=StateCache(path), key='other')
+        assert other.delay(airtime(10, 3), time.time()) == 0
+
+    asyncio.run(run(os.path.join(tempfile.mkdtemp(), 'airtime.json')))
+    print("txqueue: daily airtime budget carried over from one run to the next  ok")
+
+
+# Every start-up queries the data rate, a module back at its default data rate gets it set
+# again without a 'mac save'; the keys and the address are only set once. The EUI is asked
+# once per radio, also when the Session is the setup of the manager
+
+def check_session():
+    async def connect(port):
+        return fake_radio(settings)
+
+    async def run():
+        path = os.path.join(tempfile.mkdtemp(), 'state.json')
+        profile = ordic([('dr', '3')])
+        profile.update(abp('26011bda', 'aa'*16, 'bb'*16))
+        radio = fake_radio(settings)
+        sent = await Session(profile, cache=StateCache(path)).open(radio)
+        assert len(sent) == 4 and 'mac save' in settings.commands
+        assert 'dr' not in StateCache(path).get('0004a30b001c0530')
+        settings.reset()
+        settings.commands = []
+        radio.close()
+        radio = fake_radio(settings)
+        assert await Session(profile, cache=StateCache(path)).open(radio) == ['mac set dr 3']
+        assert settings.commands == ['sys get hweui', 'mac get dr', 'mac set dr 3']
+        settings.commands = []
+        assert await Session(profile, cache=StateCache(path)).open(radio) == []
+        assert settings.commands == ['mac get dr']
+        radio.close()
+
+        settings.commands = []
+        log = StateCache(os.path.join(tempfile.mkdtemp(), 'airtime.json'))
+        session = Session(profile, cache=StateCache(path))
+        manager = DeviceManager(['one'], dr=3, log=log, setup=session.open, connect=connect)
+        await manager.start()
+        assert settings.commands == ['sys get hweui', 'mac get dr']
+        await manager.close()
+    settings = Settings()
+    asyncio.run(run())
+    print("devsession: data rate queried at every start-up, set again after a reset  ok")
+
+
+# A radio unplugged leaves the pool, its packet goes to another one. A packet error (a
+# downlink the driver can not read) fails that packet only, too long a packet fails at once
+
+def check_manager():
+    async def connect(port):
+        return fake_radio(unplugged if port == 'unplugged' else module)
+
+    async def run():
+        log = StateCache(os.path.join(tempfile.mkdtemp(), 'airtime.json'))
+        manager = DeviceManager(['good', 'unplugged'], dr=3, log=log, connect=connect)
+        await manager.start()
+        answers = await asyncio.gather(*[manager.submit(1, b'x'*10) for k in range(4)])
+        assert all(a[0] == txok for a in answers)
+        good, gone = manager.devices
+        assert good.error is None and gone.error is not None
+        try:
+            await manager.submit(7, b'x')
+            assert False, "downlink error not raised"
+        except ValueError:
+            pass
+        try:
+            manager.submit(1, b'x'*3000)
+            assert False, "packet too long to fragment accepted"
+        except ValueError:
+            pass
+        assert (await manager.submit(1, b'x'*10))[0] == txok
+        assert good.error is None and good.packets == 5 and good.failed == 1
+        await manager.close()
+    asyncio.run(run())
+    print("devmanager: unplugged radio leaves the pool, packet errors do not  ok")
+
+
+# Packets leave the shared queue by priority, then in the order they were submitted
+
+def check_priority():
+    radios = []
+
+    async def connect(port):
+        radios.append(fake_radio())
+        return radios[-1]
+
+    async def run():
+        log = StateCache(os.path.join(tempfile.mkdtemp(), 'airtime.json'))
+        manager = DeviceManager(['one'], dr=3, log=log, connect=connect)
+        await manager.start()
+        futures = [manager.submit(1, bytearray([k])*10) for k in range(3)]
+        futures.append(manager.submit(1, b'\x09'*10, priority=high))
+        await asyncio.gather(*futures)
+        sent = [cmd.split()[4][:2] for cmd in radios[0].transport.written
+                if cmd.startswith('mac tx')]
+        assert sent == ['09', '00', '01', '02'], sent
+        await manager.close()
+    asyncio.run(run())
+    print("devmanager: shared queue by priority, then in order  ok")
+
+
+if __name__ == '__main__':
+
+    check_driver()
+    check_txqueue_log()
+    check_session()
+    check_manager()
+    check_priority()
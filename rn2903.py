@@ -0,0 +1,204 @@
+### Asyncio driver for the Microchip RN2903 LoRaWAN module
+
+'''
+##        The RN2903 answers every command with a line ending in CRLF. Some commands have a
+##        second answer once the radio is done with them:
+##
+##              mac tx      ->  ok  ->  mac_tx_ok | mac_rx <port> <data> | mac_err | ...
+##              mac join    ->  ok  ->  accepted | denied
+##              radio tx    ->  ok  ->  radio_tx_ok | radio_err
+##              radio rx    ->  ok  ->  radio_rx <data> | radio_err
+##
+##        A first answer other than 'ok' (busy, invalid_param, no_free_ch, not_joined...)
+##        ends the command. The driver frames the bytes received into lines and completes
+##        the future of the answer awaited, so the next command is written the moment the
+##        last answer of the previous one is in: no sleeps, no polling of in_waiting.
+##
+##        One command at a time (the module has no command queue): command() holds a lock
+##        until its last answer. A line nobody waits for (late answer after a timeout) is
+##        kept in 'unsolicited' instead of being taken as the answer of the next command.
+##
+##        Usage:
+##
+##              radio = await connect('/dev/ttyACM0')
+##              dr, _ = await radio.command('mac get dr')
+##              status, port, data = await radio.tx(1, schcbytes)
+##              eui = await radio.hweui()
+##
+##        The serial port goes through pyserial-asyncio when installed, else pyserial is
+##        read from the event loop (loop.add_reader, POSIX only). Python 3 only.
+##
+#'''
+
+## Import statements
+
+import asyncio
+from binascii import hexlify, unhexlify
+from collections import deque
+
+import serial
+
+## Answers
+
+okay = 'ok'
+busy = 'busy'
+invalid = 'invalid_param'
+txok = 'mac_tx_ok'
+rx = 'mac_rx'
+macerr = 'mac_err'
+
+second = ('mac tx', 'mac join', 'radio tx', 'radio rx')    # 'ok' then a second answer
+
+baudrate = 57600
+timeout = 3             # seconds, first answer
+txtimeout = 120         # seconds, second answer (confirmed uplinks are retransmitted)
+crlf = b'\r\n'
+
+
+class RN2903(asyncio.Protocol):
+
+    def __init__(self):
+        self.transport = None
+        self.buffer = bytearray()
+        self.waiter = None              # future of the next line
+        self.lines = deque()            # answers of the command in flight, not awaited yet
+        self.active = False             # a command is in flight
+        self.lock = asyncio.Lock()
+        self.unsolicited = deque(maxlen=64)
+        self.closed = None
+        self.eui = None                 # hardware EUI, once asked
+
+    ## Protocol
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.closed = asyncio.get_event_loop().create_future()
+
+    def data_received(self, data):
+        self.buffer += data
+        n = self.buffer.find(crlf)
+        while n >= 0:
+            line = bytes(self.buffer[:n]).decode('ascii', 'replace')
+            del self.buffer[:n + 2]
+            self.line_received(line)
+            n = self.buffer.find(crlf)
+
+    def line_received(self, line):
+        if self.waiter is not None and not self.waiter.done():
+            self.waiter.set_result(line)
+        elif self.active:
+            self.lines.append(line)     # came with the previous one, same read
+        else:
+            self.unsolicited.append(line)
+
+    def connection_lost(self, exc):
+        if self.waiter is not None and not self.waiter.done():
+            self.waiter.set_exception(exc or ConnectionError("RN2903 disconnected"))
+        if self.closed is not None and not self.closed.done():
+            self.closed.set_result(exc)
+
+    ## Commands
+
+    # Next line from the module, asyncio.TimeoutError after 'wait' seconds
+
+    async def answer(self, wait):
+        if self.lines:
+            return self.lines.popleft()
+        if self.closed is not None and self.closed.done():        # lost between answers
+            raise self.closed.result() or ConnectionError("RN2903 disconnected")
+        self.waiter = asyncio.get_event_loop().create_future()
+        try:
+            return await asyncio.wait_for(self.waiter, wait)
+        finally:
+            self.waiter = None
+
+    # Send a command, returns its answers (first, second), second None when there is none
+
+    async def command(self, cmd, wait=timeout, txwait=txtimeout):
+        async with self.lock:
+            self.active = True
+            try:
+                self.transport.write(cmd.encode('ascii') + crlf)
+                first = await self.answer(wait)
+                if first != okay or not cmd.startswith(second):
+                    return first, None
+                return first, await self.answer(txwait)
+            finally:
+                self.active = False
+                self.unsolicited.extend(self.lines)
+                self.lines.clear()
+
+    # Uplink on FPort 'port', returns (status, downlink FPort, downlink data). status is
+    # the second answer (mac_tx_ok, mac_rx, mac_err...), or the first one if not 'ok'
+
+    async def tx(self, port, data, confirmed=False):
+        cmd = 'mac tx ' + ('cnf ' if confirmed else 'uncnf ') + str(port) + ' '
+        first, last = await self.command(cmd + hexlify(data).decode('ascii'))
+        if last is None:
+            return first, None, None
+        if last.startswith(rx + ' '):
+            fields = last.split()
+            return rx, int(fields[1]), unhexlify(fields[2]) if len(fields) > 2 else b''
+        return last, None, None
+
+    # Hardware EUI of the module, lower case. Asked once: the setup (devsession.py) and
+    # the manager both key their state on it
+
+    async def hweui(self):
+        if self.eui is None:
+            eui, _ = await self.command('sys get hweui')
+            self.eui = eui.lower()
+        return self.eui
+
+    def close(self):
+        if self.transport is not None:
+            self.transport.close()
+
+
+## Serial port
+
+class SerialTransport(asyncio.Transport):
+
+    # pyserial port read from the event loop, non-blocking reads
+
+    def __init__(self, ser, protocol, loop):
+        super(SerialTransport, self).__init__()
+        self.ser = ser
+        self.protocol = protocol
+        self.loop = loop
+        loop.add_reader(ser.fileno(), self.readable)
+        protocol.connection_made(self)
+
+    def readable(self):
+        try:
+            data = self.ser.read(self.ser.in_waiting or 1)
+        except serial.SerialException as exc:
+            self.close(exc)
+            return
+        if data:
+            self.protocol.data_received(data)
+
+    def write(self, data):
+        self.ser.write(data)
+
+    def close(self, exc=None):
+        if self.ser.is_open:
+            self.loop.remove_reader(self.ser.fileno())
+            self.ser.close()
+            self.protocol.connection_lost(exc)
+
+
+async def connect(port, baud=baudrate):
+    loop = asyncio.get_event_loop()
+    try:
+        import serial_asyncio
+    except ImportError:
+        serial_asyncio = None
+    if serial_asyncio is not None:
+        transport, radio = await serial_asyncio.create_serial_connection(
+            loop, RN2903, port, baudrate=baud)
+        return radio
+    ser = serial.Serial(port=port, baudrate=baud, timeout=0, write_timeout=timeout)
+    radio = RN2903()
+    SerialTransport(ser, radio, loop)
+    return radio
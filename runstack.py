@@ -1,21 +1,39 @@
 ### SCHC over LoRaWAN runstack
 
+## Import statements
 
-## Run IPv6 packet generator
+from bitstring import Bits as bits
 
-execfile("packet-gen.py")
+from schc_comp import Compressor
 
-print("IPv6 packet successfully created")
 
-## Run SCHC compressor
+aggn = 4        # SCHC Packets aggregated per LoRaWAN frame, at most
 
-execfile("schc_comp.py")
+compressor = Compressor()       # Rules, index and codecs built once for every packet
 
-print("SCHC compression successfully completed. SCHC Packet created.")
+schcqueue = []
+
+for k in range(aggn):
+
+    ## Run IPv6 packet generator
+
+    exec(open("packet-gen.py", encoding="utf-8-sig").read())
+
+    print("IPv6 packet successfully created")
+
+    ## SCHC compression
+
+    schcbytes = compressor.compress(ip6.bytes)
+    schcP = SCHCPacket = bits(bytes=schcbytes)
+
+    print("Rule ID = " + str(compressor.rid))
+    print("SCHC compression successfully completed. SCHC Packet created.")
+
+    schcqueue.append(schcbytes)
 
 ## Run device sender script
 
-execfile("lorawan-message-up.py")
+exec(open("lorawan-message-up.py", encoding="utf-8-sig").read())
 
 
 
@@ -0,0 +1,262 @@
+### SCHC compressor/decompressor benchmarks
+
+'''
+##        Times the SCHC library (schc_comp.py / schc_decomp.py) on synthetic packets.
+##
+##        Usage:   python schc-bench.py [rules] [packets]
+##
+##              -  rules    number of Rules in the context (default 500)
+##              -  packets  number of packets per measurement (default 2000)
+##
+#'''
+
+## Import statements
+
+import os
+import sys
+import struct
+import timeit
+
+from schc_rules import build_rules, field_description, hfid, hfl, htv, hmo, hcda
+from schc_rules import dsa, dda, udp, us, var, NH, SA, fn
+from schc_checksum import udp_checksum
+from schc_comp import Compressor
+from schc_decomp import Decompressor
+from schc_coap import build
+
+## Synthetic context
+
+# Rules 0-3 are the default ones. Every extra Rule is a rule-1-like device context for
+# ICMPv6 traffic where the source address is fully known (equal / not-sent), one Rule per
+# device. ICMPv6 keeps the default Rules 1 and 2 from matching first.
+
+icmp = 58
+
+
+def device_rules(n):
+    rules = build_rules()
+    for k in range(len(rules), n):
+        rules.append([field_description(hfid[i], hfl[i], htv[i], hmo[i], hcda[i])
+                      for i in range(fn)])
+        rules[k][NH].update(TV= icmp)
+        rules[k][SA].update(TV= dsa + k, MO='equal', CDA='not-s')
+    return rules
+
+
+# Every extra Rule knows a /64 (or longer) source prefix and sends the interface ID LSBs
+
+def prefix_rules(n):
+    rules = build_rules()
+    for k in range(len(rules), n):
+        x = 64 + 8*(k % 3)
+        rules.append([field_description(hfid[i], hfl[i], htv[i], hmo[i], hcda[i])
+                      for i in range(fn)])
+        rules[k][NH].update(TV= icmp)
+        rules[k][SA].update(TV= (dsa >> 64) + k << (x - 64), MO='MSB(%d)' % x, CDA='LSB')
+    return rules
+
+
+# Rule 1 + a CoAP POST to /temp/<sensor> with a 2-byte token: message ID LSBs, token and
+# path segment sent
+
+def coap_rules():
+    rules = build_rules()
+    rules.append(build_rules()[1] + [
+        field_description("cver", 2, 1, 'equal', 'not-s'),
+        field_description("ctype", 2, [0, 1], 'mmap', 'index'),
+        field_description("ctkl", 4, 2, 'equal', 'not-s'),
+        field_description("ccode", 8, 2, 'equal', 'not-s'),
+        field_description("cmid", 16, 0x12, 'MSB(8)', 'LSB'),
+        field_description("ctok", var, b'', 'ignore', 'val-s'),
+        field_description("uri-path", var, b'temp', 'equal', 'not-s', fp=1),
+        field_description("uri-path", var, b'', 'ignore', 'val-s', fp=2),
+        field_description("content-format", var, [b'', b'\x3c'], 'mmap', 'index')])
+    return rules
+
+
+def coap_message(mid, sensor, payload):
+    values = {("cver", 1): 1, ("ctype", 1): 0, ("ctkl", 1): 2, ("ccode", 1): 2,
+              ("cmid", 1): mid, ("ctok", 1): os.urandom(2), ("uri-path", 1): b'temp',
+              ("uri-path", 2): sensor, ("content-format", 1): b'\x3c'}
+    return build(values) + b'\xff' + payload
+
+
+# UDP packets carry a valid UDP header (CoAP ports) in their payload, followed by 'data'
+# when given (pl must then be us + len(data))
+
+def ipv6_packet(pl=40, nh=udp, hl=200, sa=dsa, da=dda, v=6, tc=0, fl=0, data=None):
+    hdr = struct.pack('>IHBB', (v << 28) | (tc << 20) | fl, pl, nh, hl)
+    payload = os.urandom(pl) if data is None else bytes(us) + data
+    if nh == udp and pl >= us:
+        udph = struct.pack('>HHH', 5683, 5683, pl)
+        c = udp_checksum(sa, da, udph, payload[us:])
+        payload = udph + struct.pack('>H', c) + payload[us:]
+    return hdr + sa.to_bytes(16, 'big') + da.to_bytes(16, 'big') + payload
+
+
+def run(label, func, packets, number):
+    t = timeit.timeit(lambda: [func(p) for p in packets], number=number)
+    per = t / (number * len(packets)) * 1e6
+    print("%-40s %10.2f us/packet" % (label, per))
+    return per
+
+
+def run_batch(label, func, packets):
+    per = timeit.timeit(lambda: func(packets), number=1) / len(packets) * 1e6
+    print("%-40s %10.2f us/packet" % (label, per))
+    return per
+
+
+## Benchmarks
+
+def bench_select(rn, npk):
+    rules = device_rules(rn)
+    scan = Compressor(rules, index=False)
+    indexed = Compressor(rules)
+
+    # worst case for the scan: packets from the last devices of the context
+    packets = [ipv6_packet(nh=icmp, sa=dsa + rn - 1 - (k % 10)) for k in range(npk)]
+    fvs = [scan.parse(p) for p in packets]
+
+    for f in fvs:
+        assert scan.select(f)[0] == indexed.select(f)[0]
+
+    print("Rule selection, %d Rules" % rn)
+    ts = run("  linear scan", scan.select, fvs, 1)
+    ti = run("  RuleIndex", indexed.select, fvs, 1)
+    print("  speedup x%.1f\n" % (ts / ti))
+
+
+def bench_prefix(rn, npk):
+    rules = prefix_rules(rn)
+    scan = Compressor(rules, index=False)
+    indexed = Compressor(rules)
+
+    packets = [ipv6_packet(nh=icmp, sa=(dsa >> 64) + rn - 1 - (k % 10) << 64 | k)
+               for k in range(npk)]
+    fvs = [scan.parse(p) for p in packets]
+
+    for f in fvs:
+        assert scan.select(f)[0] == indexed.select(f)[0]
+
+    print("MSB(x) Rule selection, %d prefixes" % rn)
+    ts = run("  linear scan", scan.select, fvs, 1)
+    ti = run("  prefix trie", indexed.select, fvs, 1)
+    print("  speedup x%.1f\n" % (ts / ti))
+
+
+def bench_codegen(npk):
+    packets = [ipv6_packet(hl=1 + k % 200, sa=dsa + k) for k in range(npk)]     # Rule 2
+
+    interp, compiled = Compressor(codegen=False), Compressor()
+    schc = [compiled.compress(p) for p in packets]
+    assert schc == [interp.compress(p) for p in packets]
+
+    print("Compression, interpreted vs generated codecs")
+    ts = run("  interpreted", interp.compress, packets, 1)
+    tc = run("  generated", compiled.compress, packets, 1)
+    print("  speedup x%.1f\n" % (ts / tc))
+
+    interp, compiled = Decompressor(codegen=False), Decompressor()
+    assert [compiled.decompress(s) for s in schc] == packets
+
+    print("Decompression, interpreted vs generated codecs")
+    ts = run("  interpreted", interp.decompress, schc, 1)
+    tc = run("  generated", compiled.decompress, schc, 1)
+    print("  speedup x%.1f\n" % (ts / tc))
+
+
+def bench_mapping(npeers, npk):
+    # Rule 1 with thousands of known peers in the source address mapping
+    rules = build_rules()
+    rules[1][SA].update(TV= [dsa + k for k in range(npeers)])
+    compressor = Compressor(rules)
+    packets = [ipv6_packet(sa=dsa + npeers - 1 - k % 50) for k in range(npk)]
+    decompressor = Decompressor(rules)
+    assert [decompressor.decompress(compressor.compress(p)) for p in packets] == packets
+    assert compressor.compress_batch(packets) == [compressor.compress(p) for p in packets]
+
+    print("Match-mapping on %d source addresses" % npeers)
+    run("  compress", compressor.compress, packets, 1)
+    run_batch("  compress_batch", compressor.compress_batch, packets)
+    print("")
+
+
+def bench_cache(npk):
+    # typical sensor flow: same header every time, only the payload changes
+    packets = [ipv6_packet(hl=33, sa=dsa + 1) for k in range(npk)]
+
+    plain, cached = Compressor(), Compressor(cache_size=64)
+    assert [cached.compress(p) for p in packets] == [plain.compress(p) for p in packets]
+
+    print("Compression of a repeated header, without vs with cache")
+    t1 = run("  compress", plain.compress, packets, 1)
+    tc = run("  compress, cache_size=64", cached.compress, packets, 1)
+    print("  %s" % cached.cache.stats())
+    print("  speedup x%.1f\n" % (t1 / tc))
+
+    schc = [plain.compress(p) for p in packets]
+    plain, cached = Decompressor(), Decompressor(cache_size=64)
+    assert [cached.decompress(s) for s in schc] == packets
+
+    print("Decompression of a repeated header, without vs with cache")
+    t1 = run("  decompress", plain.decompress, schc, 1)
+    tc = run("  decompress, cache_size=64", cached.decompress, schc, 1)
+    print("  %s" % cached.cache.stats())
+    print("  speedup x%.1f\n" % (t1 / tc))
+
+
+def bench_batch(npk):
+    packets = [ipv6_packet(hl=1 + k % 200, sa=dsa + k) for k in range(npk)]
+    packets += [ipv6_packet() for k in range(npk)]
+
+    compressor = Compressor()
+    assert compressor.compress_batch(packets) == [compressor.compress(p) for p in packets]
+
+    print("Compression of %d packets, one by one vs compress_batch" % len(packets))
+    t1 = run("  compress", compressor.compress, packets, 1)
+    tb = run_batch("  compress_batch", compressor.compress_batch, packets)
+    print("  speedup x%.1f\n" % (t1 / tb))
+
+    schc = compressor.compress_batch(packets)
+    decompressor = Decompressor()
+    assert [bytes(p) for p in decompressor.decompress_batch(schc)] == packets
+
+    print("Decompression of %d packets, one by one vs decompress_batch" % len(schc))
+    t1 = run("  decompress", decompressor.decompress, schc, 1)
+    tb = run_batch("  decompress_batch", decompressor.decompress_batch, schc)
+    print("  speedup x%.1f\n" % (t1 / tb))
+
+
+def bench_coap(npk):
+    messages = [coap_message(0x1200 | k & 0xff, b's%d' % (k % 10), os.urandom(16))
+                for k in range(npk)]
+    packets = [ipv6_packet(pl=us + len(m), data=m) for m in messages]
+
+    udponly, layered = Compressor(), Compressor(coap_rules())
+    schc = [layered.compress(p) for p in packets]
+    decompressor = Decompressor(coap_rules())
+    assert [decompressor.decompress(s) for s in schc] == packets
+
+    print("IPv6 + UDP + CoAP, UDP Rule vs CoAP Rule")
+    print("  SCHC Packet bytes: %.1f vs %.1f (packet %.1f)" % (
+        sum(len(udponly.compress(p)) for p in packets) / float(npk),
+        sum(len(s) for s in schc) / float(npk), sum(len(p) for p in packets) / float(npk)))
+    run("  compress, UDP Rule", udponly.compress, packets, 1)
+    run("  compress, CoAP Rule", layered.compress, packets, 1)
+    run("  decompress, CoAP Rule", decompressor.decompress, schc, 1)
+    print("")
+
+
+if __name__ == '__main__':
+
+    rn = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    npk = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+
+    bench_select(rn, npk)
+    bench_prefix(rn, npk)
+    bench_codegen(npk)
+    bench_mapping(5000, npk)
+    bench_cache(npk)
+    bench_batch(npk*10)
+    bench_coap(npk)
@@ -0,0 +1,86 @@
+### SCHC Packet aggregation  -several SCHC Packets in one LoRaWAN frame
+
+'''
+##        Compressed packets are often a few bytes long, and every LoRaWAN uplink costs the
+##        MAC header, MIC and the airtime of the preamble on top of them. SCHC Packets are
+##        packed into one frame up to the MTU of the Data Rate, each one preceded by its
+##        length in bytes, and the frame is sent on the aggregation FPort:
+##
+##    +-- ... --+-- len --+--- ... ---+-- len --+--- ... ---+
+##    |  FPort  |   [8]   |SCHC Packet|   [8]   |SCHC Packet|  ...
+##    +-- ... --+---------+--- ... ---+---------+--- ... ---+
+##
+##        Every SCHC Packet keeps its own padding (compress() returns whole bytes), so the
+##        receiver splits the frame and decompresses each packet alone: compute-length
+##        still sees a packet per SCHC Packet. A frame holding a single packet is sent as
+##        is on the data FPort, without the length byte. Packets that do not fit in a frame
+##        go alone on the data FPort too, to be fragmented (see schc_frag.py).
+##
+#'''
+
+## FPorts
+
+dport = 1                       # single SCHC Packet (lorawan-message-up.py, portno)
+aport = 30                      # aggregated frame
+
+maxlen = 255                    # longest packet with a 1-byte length
+
+
+class Aggregator(object):
+
+    def __init__(self, mtu):
+        self.mtu = mtu
+        self.pending = []               # SCHC Packets of the next frame
+        self.size = 0                   # its length, delimiters included
+
+    # Add a SCHC Packet, returns the frames completed by it as (FPort, data) pairs
+
+    def add(self, packet):
+        packet = bytes(packet)
+        frames = []
+        if self.size + 1 + len(packet) > self.mtu:
+            frames = self.flush()
+        if len(packet) + 1 > self.mtu or len(packet) > maxlen:
+            frames.append((dport, packet))      # alone, fragmented if too long
+            return frames
+        self.pending.append(packet)
+        self.size += 1 + len(packet)
+        return frames
+
+    # Frame of the pending packets, [] if none
+
+    def flush(self):
+        pending = self.pending
+        self.pending = []
+        self.size = 0
+        if not pending:
+            return []
+        if len(pending) == 1:
+            return [(dport, pending[0])]
+        return [(aport, b''.join([bytes(bytearray([len(p)])) + p for p in pending]))]
+
+
+# Pack a list of SCHC Packets into frames, in order
+
+def aggregate(packets, mtu):
+    agg = Aggregator(mtu)
+    frames = []
+    for packet in packets:
+        frames.extend(agg.add(packet))
+    return frames + agg.flush()
+
+
+# SCHC Packets of an aggregated frame, as memoryview slices of it
+
+def split(frame):
+    buf = memoryview(frame)
+    packets = []
+    pos = 0
+    while pos < len(buf):
+        n = buf[pos]
+        pos += 1
+        if pos + n > len(buf):
+            raise ValueError("aggregated frame cut inside a SCHC Packet")
+        packets.append(buf[pos:pos + n])
+        pos += n
+    return packets
@@ -0,0 +1,447 @@
+### Batch SCHC compression/decompression with NumPy
+
+'''
+##        Compresses many IPv6 packets at once, for offline traces or for re-compressing
+##        downlinks at the gateway, and decompresses bursts of uplinks. Needs NumPy
+##        (optional dependency of the library, only this module imports it).
+##
+##    Compression (BatchCompressor)
+##
+##        1. The N fixed headers are loaded into a structured array with one column per
+##           header field (hfid). 128-bit addresses are kept as two uint64 words.
+##        2. Each Rule's Matching Operators (equal / ignore / mmap / MSB(x)) are evaluated as
+##           boolean masks over the whole column. Rules are tried cheapest first and the
+##           first one that applies wins, as in Compressor.select(). Rows with no Rule get
+##           the no-compression Rule.
+##        3. Packets sharing a Rule and a payload length are emitted together: Rule ID,
+##           residue fields and payload are unpacked into one bit matrix and packed back to
+##           bytes (packbits adds the zero padding bits at the end of each row).
+##
+##        The SCHC Packets are the same, byte for byte, as Compressor.compress() returns.
+##
+##    Decompression (BatchDecompressor)
+##
+##        1. SCHC Packets of the same length are grouped by the Rule ID they start with.
+##           Rule IDs are read for the whole group at once through the RuleIDCode lookup
+##           table (fixed or variable-length Rule IDs).
+##        2. For each Rule the residue sits at fixed bit positions, so every header field is
+##           rebuilt for the whole group at once: not-sent fields are broadcast from TV (as
+##           the computed payload length, the same for packets of the same length),
+##           value-sent fields are copied column-wise, index fields are gathered from a
+##           table of the TV bits and LSB fields get the TV prefix plus their residue bits.
+##        3. All packets are written into one contiguous output buffer (40-byte header +
+##           payload each, padding dropped using PL), in the order they were received.
+##
+#'''
+
+## Import statements
+
+import numpy as np
+
+from schc_rules import build_rules, compile_mappings, selection_order, index_bits, msb_length
+from schc_rules import computeCDAs, iidCDAs, iidBits, iid_value
+from schc_rules import header_size, header_fields, hfi, hfl, hfo, hs, us, ufid, udp
+from schc_rules import PL, UL, UC, ncr, dfp
+from schc_ruleid import RuleIDCode
+from schc_bits import BitReader
+
+_raw = np.dtype([('w', '>u4'), ('pl', '>u2'), ('nh', 'u1'), ('hl', 'u1'),
+                 ('sa', '>u8', (2,)), ('da', '>u8', (2,))])          # 40 bytes, as sent
+
+_udpraw = np.dtype([('sp', '>u2'), ('dp', '>u2'), ('ul', '>u2'), ('uc', '>u2')])
+
+# 'udp': the packet carries a UDP header, 'ucok': its checksum is valid
+
+hdtype = np.dtype([('v', 'u1'), ('tc', 'u1'), ('fl', 'u4'), ('pl', 'u2'), ('nh', 'u1'),
+                   ('hl', 'u1'), ('sa', 'u8', (2,)), ('da', 'u8', (2,)),
+                   ('sp', 'u2'), ('dp', 'u2'), ('ul', 'u2'), ('uc', 'u2'),
+                   ('udp', '?'), ('ucok', '?')])
+
+m64 = (1 << 64) - 1
+
+
+# Header columns of all packets. UDP checksums are only checked with checksum=True
+
+def load_headers(packets, checksum=False):
+    raw = np.frombuffer(b''.join([bytes(p[:hs]) for p in packets]), dtype=_raw)
+    hdrs = np.zeros(len(raw), dtype=hdtype)
+    hdrs['v'] = raw['w'] >> 28
+    hdrs['tc'] = (raw['w'] >> 20) & 0xff
+    hdrs['fl'] = raw['w'] & 0xfffff
+    for fid in ('pl', 'nh', 'hl', 'sa', 'da'):
+        hdrs[fid] = raw[fid]
+    lens = np.array([len(p) for p in packets])
+    hdrs['udp'] = (hdrs['nh'] == udp) & (lens >= hs + us)
+    uraw = np.frombuffer(b''.join([bytes(p[hs:hs + us]).ljust(us, b'\0') for p in packets]),
+                         dtype=_udpraw)
+    for fid in ufid:
+        hdrs[fid] = uraw[fid]
+    if checksum:
+        for L in np.unique(lens[hdrs['udp']]):
+            rows = np.flatnonzero(hdrs['udp'] & (lens == L))
+            data = np.frombuffer(b''.join([packets[i] for i in rows]), dtype=np.uint8)
+            hdrs['ucok'][rows] = _udp_checksums(data.reshape(len(rows), L)) == hdrs['uc'][rows]
+    return hdrs
+
+
+# FV == value, for one column. 128-bit columns are compared word by word
+
+def _equal(col, value):
+    if col.ndim == 1:
+        return col == value
+    return (col[:, 0] == value >> 64) & (col[:, 1] == value & m64)
+
+
+# x MSBs of FV == TV, for one column (FL bits)
+
+def _prefix(col, x, fl, tv):
+    value, mask = tv << (fl - x), ((1 << x) - 1) << (fl - x)
+    if col.ndim == 1:
+        return col & mask == value
+    return ((col[:, 0] & (mask >> 64) == value >> 64) &
+            (col[:, 1] & (mask & m64) == value & m64))
+
+
+# 64 LSBs of FV == IID, for an address column (low word)
+
+def _low64(col, iid):
+    return (col[:, 1] if col.ndim > 1 else col) == iid
+
+
+# Sortable keys for a column: the value itself, or (high word, low word) for addresses
+
+_k128 = np.dtype([('hi', 'u8'), ('lo', 'u8')])
+
+def _keys(col):
+    if col.ndim == 1:
+        return col.astype(np.uint64)
+    return np.ascontiguousarray(col, dtype=np.uint64).view(_k128).ravel()
+
+
+# mmap table as sorted keys + index of each key in TV (first occurrence, as list.index)
+
+def _sorted_table(tv, wide):
+    if wide:
+        keys = np.array([(v >> 64, v & m64) for v in tv], dtype=_k128)
+    else:
+        keys = np.array(tv, dtype=np.uint64)
+    return np.unique(keys, return_index=True)
+
+
+# mmap: (applies mask, index of FV in TV), binary search in the sorted table
+
+def _mapping(col, table):
+    keys, first = table
+    pos = np.minimum(np.searchsorted(keys, _keys(col)), len(keys) - 1)
+    return keys[pos] == _keys(col), first[pos]
+
+
+# last w bits of every value of a column, as a (N, w) matrix of 0/1
+
+def _bits(col, w):
+    words = col.astype('>u8').view(np.uint8).reshape(len(col), -1)
+    return np.unpackbits(words, axis=1)[:, words.shape[1]*8 - w:]
+
+
+# uint value of every row of a (N, w) bit matrix, w <= 63
+
+def _uint(bitmat):
+    w = bitmat.shape[1]
+    return bitmat.astype(np.int64).dot(np.int64(1) << np.arange(w - 1, -1, -1, dtype=np.int64))
+
+
+# ones' complement sum (RFC 1071) of every row of a (N, L) byte matrix, 16-bit words
+# summed in uint64 (no overflow below 2**48 bytes per row), then folded as ones_sum()
+
+def _fold(total):
+    r = total % 0xffff
+    return np.where((r == 0) & (total != 0), 0xffff, r)
+
+
+def ones_sum_rows(data):
+    if data.shape[1] & 1:
+        data = np.hstack((data, np.zeros((len(data), 1), dtype=np.uint8)))
+    return _fold(np.ascontiguousarray(data).view('>u2').sum(axis=1, dtype=np.uint64))
+
+
+# UDP checksum of every row of a (N, L) matrix of whole IPv6 + UDP packets, as
+# udp_checksum() in schc_checksum.py
+
+def _udp_checksums(data):
+    words = np.array(data[:, 8:], dtype=np.uint8)          # addresses + datagram, copy
+    c = hfo[UC]//8 - 8
+    words[:, c:c + 2] = 0                                   # checksum field left out
+    total = ones_sum_rows(words) + np.uint64(data.shape[1] - hs + udp)
+    c = ~_fold(total).astype(np.uint16)
+    return np.where(c == 0, 0xffff, c)
+
+
+# n bytes starting at bit position pr of every row of a (N, L) byte matrix
+
+def _shifted(data, pr, n):
+    b0, s = divmod(pr, 8)
+    if not s:
+        return data[:, b0:b0 + n]
+    a = data[:, b0:b0 + n + 1]
+    return ((a[:, :-1] << s) | (a[:, 1:] >> (8 - s))).astype(np.uint8)
+
+
+# bits of a Python int (any size), as a (w,) vector
+
+def _const_bits(value, w):
+    data = np.frombuffer(value.to_bytes((w + 7)//8, 'big'), dtype=np.uint8)
+    return np.unpackbits(data)[(w + 7)//8*8 - w:]
+
+
+class BatchCompressor(object):
+
+    def __init__(self, rules=None, di='up', ruleids=None, iids=None):
+        self.rules = build_rules() if rules is None else compile_mappings(rules)
+        self.di = di
+        self.iids = iids
+        self.ruleids = RuleIDCode.fixed(len(self.rules)) if ruleids is None else ruleids
+        self.tables = {}        # id(TV) -> sorted mmap table, built on first use
+        self.sizes = [header_size(rule, di) for rule in self.rules]
+        self.checksum = any(fd["CDA"]=='comp-c' for rid, rule in enumerate(self.rules)
+                            if rid != ncr for fd in rule)
+
+    # Run one Rule over all headers: mask of rows it applies to + residue columns
+
+    def match(self, rule, hdrs):
+        mask = np.ones(len(hdrs), dtype=bool)
+        if header_size(rule, self.di) > hs:
+            mask &= hdrs['udp']
+        compres = []            # (column, bits)
+        for fd in rule:
+            if fd["DI"]!="bi" and fd["DI"]!=self.di:
+                continue
+            elif fd["FP"]!=dfp:
+                continue
+            col = hdrs[fd["FID"]]
+            if fd["MO"]=='ignore':
+                if fd["CDA"]=='not-s':
+                    continue
+                elif fd["CDA"]=='val-s':
+                    compres.append((col, fd["FL"]))
+                elif fd["CDA"]=='comp-l':
+                    if fd["FID"]=='ul':
+                        mask &= col == hdrs['pl']       # UDP length = IPv6 payload length
+                elif fd["CDA"]=='comp-c':
+                    mask &= hdrs['ucok']
+                else:
+                    raise ValueError("CDA " + str(fd["CDA"]) + " not supported with ignore")
+            elif fd["MO"]=='equal':
+                mask &= _equal(col, fd["TV"])
+            elif fd["MO"]=='mmap':
+                tv = fd["TV"]
+                if id(tv) not in self.tables:
+                    self.tables[id(tv)] = (tv, _sorted_table(tv, col.ndim > 1))
+                hit, index = _mapping(col, self.tables[id(tv)][1])
+                mask &= hit
+                compres.append((index, index_bits(tv)))
+            elif msb_length(fd["MO"]) is not None:
+                x = msb_length(fd["MO"])
+                mask &= _prefix(col, x, fd["FL"], fd["TV"])
+                if fd["CDA"]=='LSB':
+                    compres.append((col, fd["FL"] - x))        # last FL - x bits
+                elif fd["CDA"] in iidCDAs:
+                    mask &= _low64(col, iid_value(fd, self.iids))
+                elif fd["CDA"]!='not-s':
+                    raise ValueError("CDA " + str(fd["CDA"]) + " not supported with MSB(x)")
+            else:
+                raise ValueError("MO " + str(fd["MO"]) + " not supported")
+        return mask, compres
+
+    # Rule ID per row, ncr where no Rule applies. Also residue columns per Rule
+
+    def select(self, hdrs):
+        rids = np.full(len(hdrs), ncr, dtype=np.int64)
+        free = np.ones(len(hdrs), dtype=bool)
+        residues = {}
+        for rid in selection_order(self.rules, self.di, self.ruleids.lengths, self.iids):
+            if not free.any():
+                break
+            mask, compres = self.match(self.rules[rid], hdrs)
+            mask &= free
+            if mask.any():
+                rids[mask] = rid
+                free &= ~mask
+                residues[rid] = compres
+        return rids, residues
+
+    def compress_batch(self, packets):
+        packets = [bytes(p) for p in packets]
+        hdrs = load_headers(packets, self.checksum)
+        rids, residues = self.select(hdrs)
+        pdlen = np.array([len(p) - hs for p in packets])
+        out = [None]*len(packets)
+
+        for rid in np.unique(rids):
+            for n in np.unique(pdlen[rids == rid]):
+                rows = np.flatnonzero((rids == rid) & (pdlen == n))
+                idbits = _const_bits(*self.ruleids.encode(rid))
+                chunks = [np.broadcast_to(idbits, (len(rows), len(idbits)))]
+                if rid == ncr:
+                    lo, hi = 0, hs + n                  # whole packet after the Rule ID
+                else:
+                    lo, hi = self.sizes[rid], hs + n        # payload after the Rule's header
+                    chunks += [_bits(col[rows], w) for col, w in residues[rid] if w]
+                data = np.frombuffer(b''.join([packets[i][lo:hi] for i in rows]), dtype=np.uint8)
+                chunks.append(np.unpackbits(data.reshape(len(rows), hi - lo), axis=1))
+                schc = np.packbits(np.hstack(chunks), axis=1)
+                for i, row in zip(rows, schc):
+                    out[i] = row.tobytes()
+        if self.ruleids.ports is not None:
+            return [(self.ruleids.ports[rid], data) for rid, data in zip(rids.tolist(), out)]
+        return out
+
+
+class BatchDecompressor(object):
+
+    def __init__(self, rules=None, di='up', ruleids=None, iids=None):
+        self.rules = build_rules() if rules is None else compile_mappings(rules)
+        self.di = di
+        self.iids = iids
+        self.ruleids = RuleIDCode.fixed(len(self.rules)) if ruleids is None else ruleids
+        self.plans = {}
+        self.idtable = None
+        if self.ruleids.table is not None:
+            self.idtable = np.array([-1 if e is None else e[0] for e in self.ruleids.table])
+
+    # Rule ID of every row of a (N, L) byte matrix
+
+    def rule_ids(self, data):
+        if self.idtable is None:
+            return np.array([self.ruleids.decode(BitReader(row.tobytes())) for row in data])
+        n = self.ruleids.maxlen
+        head = np.zeros((len(data), (n + 7)//8), dtype=np.uint8)     # zero bits past the end
+        head[:, :min(head.shape[1], data.shape[1])] = data[:, :head.shape[1]]
+        rids = self.idtable[_uint(np.unpackbits(head, axis=1)[:, :n])]
+        if (rids < 0).any():
+            raise ValueError("unknown Rule ID")
+        return rids
+
+    # Rule walk done once per Rule: header bit positions of every field and how to fill
+    # them, (position in header, bits, CDA, position in residue, TV bits / TV table)
+
+    def plan(self, rid):
+        if rid in self.plans:
+            return self.plans[rid]
+        steps = []
+        pr = self.ruleids.lengths[rid]
+        for fd in self.rules[rid]:
+            if fd["DI"]!="bi" and fd["DI"]!=self.di:
+                continue
+            elif fd["FP"]!=dfp:
+                continue
+            i = hfi[fd["FID"]]
+            if fd["CDA"]=='not-s':
+                steps.append((i, 'not-s', None, _const_bits(fd["TV"], fd["FL"])))
+            elif fd["CDA"]=='val-s':
+                steps.append((i, 'val-s', pr, None))
+                pr += fd["FL"]
+            elif fd["CDA"]=='index':
+                w = index_bits(fd["TV"])
+                table = np.array([_const_bits(v, fd["FL"]) for v in fd["TV"]])
+                steps.append((i, 'index', (pr, w), table))
+                pr += w
+            elif fd["CDA"] in iidCDAs:
+                value = fd["TV"] << iidBits | iid_value(fd, self.iids)
+                steps.append((i, 'not-s', None, _const_bits(value, fd["FL"])))
+            elif fd["CDA"] in computeCDAs:
+                steps.append((i, fd["CDA"], None, None))
+            elif fd["CDA"]=='LSB':
+                x = msb_length(fd["MO"])
+                steps.append((i, 'LSB', (pr, x), _const_bits(fd["TV"], x)))
+                pr += fd["FL"] - x
+            else:
+                raise ValueError("CDA " + str(fd["CDA"]) + " not supported")
+        size = header_size(self.rules[rid], self.di)
+        if set(step[0] for step in steps) != set(header_fields(size)):
+            raise ValueError("Rule does not rebuild every header field")
+        self.plans[rid] = steps, pr, size
+        return self.plans[rid]
+
+    # Rebuild the header bits of a group of SCHC Packets sharing Rule ID and length L
+    # (bytes). 'bitmat' holds (at least) the first 'pr' bits of every packet. Returns the
+    # (N, size*8) header bits, the UDP checksum (if computed) is left to zero
+
+    def headers(self, rid, bitmat, L):
+        if rid == ncr:
+            idlen = self.ruleids.lengths[ncr]
+            return bitmat[:, idlen:idlen + hs*8]
+        steps, pr, size = self.plan(rid)
+        hb = np.empty((len(bitmat), size*8), dtype=np.uint8)
+        for i, cda, pos, tv in steps:
+            lo, hi = hfo[i], hfo[i] + hfl[i]
+            if cda=='not-s':
+                hb[:, lo:hi] = tv                               # broadcast TV
+            elif cda=='comp-l' and i == PL:
+                pl = int(L*8 - pr)//8 + size - hs
+                hb[:, lo:hi] = _const_bits(pl, hfl[i])          # same for the group
+            elif cda in computeCDAs:
+                hb[:, lo:hi] = 0                                # UDP length/checksum, below
+            elif cda=='val-s':
+                hb[:, lo:hi] = bitmat[:, pos:pos + hfl[i]]      # copy residue bits
+            elif cda=='LSB':
+                pos, x = pos
+                hb[:, lo:lo + x] = tv                           # broadcast TV prefix
+                hb[:, lo + x:hi] = bitmat[:, pos:pos + hfl[i] - x]
+            else:
+                pos, w = pos
+                hb[:, lo:hi] = tv[_uint(bitmat[:, pos:pos + w])]    # gather TV[index]
+        for i, cda, pos, tv in steps:
+            if cda=='comp-l' and i == UL:
+                hb[:, hfo[UL]:hfo[UL] + hfl[UL]] = hb[:, hfo[PL]:hfo[PL] + hfl[PL]]
+        return hb
+
+    # 'fports': FPort of every SCHC Packet when the Rule ID is the FPort (FPortCode)
+
+    def decompress_batch(self, packets, fports=None):
+        packets = [bytes(p) for p in packets]
+        lens = np.array([len(p) for p in packets])
+        if self.ruleids.ports is not None:
+            ports = np.array([self.ruleids.rule(port) for port in fports], dtype=np.int64)
+        groups = []             # (rows, header bytes, payload position, payload lengths, data,
+                                #  UDP checksum computed)
+        pdlen = np.zeros(len(packets), dtype=np.int64)
+
+        for L in np.unique(lens):
+            rows = np.flatnonzero(lens == L)
+            data = np.frombuffer(b''.join([packets[i] for i in rows]), dtype=np.uint8)
+            data = data.reshape(len(rows), L)
+            rids = self.rule_ids(data) if self.ruleids.ports is None else ports[rows]
+            for rid in np.unique(rids):
+                sel = rids == rid
+                if rid == ncr:
+                    pr, size = self.ruleids.lengths[ncr] + hs*8, hs
+                else:
+                    steps, pr, size = self.plan(int(rid))
+                # only the compressed header is unpacked to bits, payload stays in bytes
+                bitmat = np.unpackbits(data[sel, :(pr + 7)//8], axis=1)
+                hb = self.headers(int(rid), bitmat, L)
+                pl = _uint(hb[:, hfo[PL]:hfo[PL] + hfl[PL]])
+                n = pl - (size - hs)                        # payload bytes in the SCHC Packet
+                if (pr + n*8 > L*8).any():
+                    raise ValueError("SCHC Packet shorter than its payload length")
+                pdlen[rows[sel]] = pl
+                checksum = rid != ncr and any(step[1]=='comp-c' for step in steps)
+                groups.append((rows[sel], np.packbits(hb, axis=1), pr, n, data[sel], checksum))
+
+        ## One contiguous output buffer, packets in received order
+
+        offsets = np.concatenate(([0], np.cumsum(hs + pdlen)))
+        out = np.empty(offsets[-1], dtype=np.uint8)
+        for rows, hdr, pr, pl, data, checksum in groups:
+            for n in np.unique(pl):
+                sel = pl == n
+                body = np.hstack((hdr[sel], _shifted(data[sel], pr, n)))
+                if checksum:
+                    c = _udp_checksums(body)
+                    body[:, hfo[UC]//8] = c >> 8
+                    body[:, hfo[UC]//8 + 1] = c & 0xff
+                idx = offsets[rows[sel]][:, None] + np.arange(body.shape[1])
+                out[idx] = body
+        view = memoryview(out).cast('B')
+        offsets = offsets.tolist()
+        return [view[offsets[i]:offsets[i+1]] for i in range(len(packets))]
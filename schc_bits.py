@@ -0,0 +1,185 @@
+### Bit-level helpers for the SCHC compressor/decompressor
+
+'''
+##        Plain integer/bytes replacements for the bitstring objects used by the scripts.
+##
+##        IPv6View:   read-only view over the 40-byte IPv6 fixed header of a packet, and
+##                    the UDP header after it for UDP packets. The packet is not copied,
+##                    fields are read with int.from_bytes and shifts/masks straight from
+##                    the underlying bytes.
+##
+##        BitWriter:  packs (value, bit length) chunks MSB first into a preallocated
+##                    bytearray. Used to build the SCHC Packet: Rule ID + residue + payload.
+##
+##        BitReader:  cursor over a received SCHC Packet. Returns plain ints for the Rule ID
+##                    and residue fields, and the payload as a memoryview slice when it is
+##                    byte aligned (one copy otherwise).
+##
+#'''
+
+## Import statements
+
+from struct import Struct
+
+from schc_rules import hs, us, udp
+
+_w0 = Struct('>IHBB')           # v/tc/fl word - pl - nh - hl
+_udp = Struct('>HHHH')          # sp - dp - ul - uc
+_noudp = (None,)*4
+
+
+class IPv6View(object):
+
+    __slots__ = ('buf',)
+
+    def __init__(self, packet):
+        if len(packet) < hs:
+            raise ValueError("packet shorter than the IPv6 fixed header")
+        self.buf = memoryview(packet)
+
+    # header field values as uint, in hfid order: v, tc, fl, pl, nh, hl, sa, da, then
+    # sp, dp, ul, uc (None when the packet does not carry a UDP header)
+
+    def fields(self):
+        buf = self.buf
+        w, pl, nh, hl = _w0.unpack_from(buf)
+        fvs = [w >> 28, (w >> 20) & 0xff, w & 0xfffff, pl, nh, hl,
+               int.from_bytes(buf[8:24], 'big'), int.from_bytes(buf[24:40], 'big')]
+        if nh == udp and len(buf) >= hs + us:
+            fvs.extend(_udp.unpack_from(buf, hs))
+        else:
+            fvs.extend(_noudp)
+        return fvs
+
+    @property
+    def v(self):
+        return self.buf[0] >> 4
+
+    @property
+    def tc(self):
+        return (int.from_bytes(self.buf[0:2], 'big') >> 4) & 0xff
+
+    @property
+    def fl(self):
+        return int.from_bytes(self.buf[1:4], 'big') & 0xfffff
+
+    @property
+    def pl(self):
+        return int.from_bytes(self.buf[4:6], 'big')
+
+    @property
+    def nh(self):
+        return self.buf[6]
+
+    @property
+    def hl(self):
+        return self.buf[7]
+
+    @property
+    def sa(self):
+        return int.from_bytes(self.buf[8:24], 'big')
+
+    @property
+    def da(self):
+        return int.from_bytes(self.buf[24:40], 'big')
+
+    @property
+    def payload(self):
+        return self.buf[hs:]
+
+
+class BitWriter(object):
+
+    __slots__ = ('buf', 'pos', 'acc', 'nacc')
+
+    def __init__(self, size):
+        self.buf = bytearray(size)      # bytes, must hold the whole output
+        self.pos = 0                    # bytes already flushed to buf
+        self.acc = 0                    # pending bits, less than 8 after each write
+        self.nacc = 0
+
+    def write(self, value, n):
+        if not n:
+            return
+        acc = (self.acc << n) | value
+        nacc = self.nacc + n
+        nbytes, rem = divmod(nacc, 8)
+        if nbytes:
+            pos = self.pos
+            self.buf[pos:pos+nbytes] = (acc >> rem).to_bytes(nbytes, 'big')
+            self.pos = pos + nbytes
+            acc &= (1 << rem) - 1
+        self.acc, self.nacc = acc, rem
+
+    def write_bytes(self, data):
+        if self.nacc:
+            self.write(int.from_bytes(data, 'big'), len(data)*8)
+        else:
+            pos = self.pos
+            self.buf[pos:pos+len(data)] = data      # byte aligned, plain copy
+            self.pos = pos + len(data)
+
+    @property
+    def bitlen(self):
+        return self.pos*8 + self.nacc
+
+    # written bits, zero padding bits added up to the next byte boundary
+
+    def getvalue(self):
+        out = self.buf[:self.pos]
+        if self.nacc:
+            out.append((self.acc << (8 - self.nacc)) & 0xff)
+        return bytes(out)
+
+
+class BitReader(object):
+
+    __slots__ = ('buf', 'pos', 'end')
+
+    def __init__(self, data):
+        self.buf = memoryview(data)
+        self.pos = 0                    # bits already read
+        self.end = len(self.buf)*8
+
+    def read(self, n):
+        pos = self.pos
+        end = pos + n
+        if end > self.end:
+            raise ValueError("read past the end of the SCHC Packet")
+        self.pos = end
+        a, b = pos >> 3, (end + 7) >> 3
+        if b - a == 1:
+            v = self.buf[a]
+        else:
+            v = int.from_bytes(self.buf[a:b], 'big')
+        return (v >> ((b << 3) - end)) & ((1 << n) - 1)
+
+    # next n bits without moving the cursor, zero bits past the end of the packet
+
+    def peek(self, n):
+        pos = self.pos
+        avail = self.end - pos
+        if avail >= n:
+            v = self.read(n)
+        else:
+            v = self.read(avail) << (n - avail)
+        self.pos = pos
+        return v
+
+    def skip(self, n):
+        if self.pos + n > self.end:
+            raise ValueError("read past the end of the SCHC Packet")
+        self.pos += n
+
+    def read_bytes(self, n):
+        if self.pos & 7:
+            return self.read(n*8).to_bytes(n, 'big')
+        a = self.pos >> 3
+        if a + n > len(self.buf):
+            raise ValueError("read past the end of the SCHC Packet")
+        self.pos += n*8
+        return self.buf[a:a+n]          # byte aligned, no copy
+
+    @property
+    def remaining(self):
+        return self.end - self.pos
@@ -0,0 +1,48 @@
+### Bounded LRU cache used by the SCHC compressor/decompressor
+
+'''
+##        Least-recently-used cache with a fixed maximum number of entries and hit/miss
+##        counters. Entries are kept in an OrderedDict, the oldest one is dropped when the
+##        cache is full. clear() must be called whenever the Rules change.
+##
+#'''
+
+## Import statements
+
+from collections import OrderedDict as ordic
+
+
+class LRUCache(object):
+
+    def __init__(self, size):
+        if size < 1:
+            raise ValueError("cache size must be at least 1")
+        self.size = size
+        self.entries = ordic()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        try:
+            value = self.entries[key]
+        except KeyError:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.size:
+            self.entries.popitem(last=False)        # evict least recently used
+
+    def clear(self):
+        self.entries.clear()
+
+    def stats(self):
+        return {"size": len(self.entries), "hits": self.hits, "misses": self.misses}
+
+    def __len__(self):
+        return len(self.entries)
@@ -0,0 +1,40 @@
+### Internet checksum (RFC 1071) for the compute-checksum CDA
+
+'''
+##        Ones' complement sum of 16-bit words, as used by the UDP checksum. The data is
+##        read as a single big integer straight from a memoryview (no copy, no loop in
+##        Python): as 2**16 = 1 modulo 0xffff, the ones' complement sum of the words is the
+##        integer modulo 0xffff, end-around carries included. Sums of separate parts can be
+##        added the same way as long as every part but the last starts at an even offset.
+##
+##        The vectorised version for bursts of packets is in schc_batch.py (ones_sum_rows).
+##
+#'''
+
+## Import statements
+
+from schc_rules import udp, us
+
+
+# ones' complement sum of an integer made of 16-bit words, 0xffff is the non-zero zero
+
+def fold(total):
+    r = total % 0xffff
+    return 0xffff if r == 0 and total else r
+
+
+def ones_sum(data):
+    n = int.from_bytes(memoryview(data), 'big')
+    if len(data) & 1:
+        n <<= 8                         # odd length, padded with a zero byte
+    return fold(n)
+
+
+# UDP checksum over IPv6: pseudo-header (addresses, length, next header) + UDP header +
+# payload, the checksum field itself (header bytes 6-7) is left out. 0 is sent as 0xffff
+
+def udp_checksum(sa, da, header, payload):
+    length = us + len(payload)
+    total = fold(sa) + fold(da) + length + udp + ones_sum(header[:6]) + ones_sum(payload)
+    c = ~fold(total) & 0xffff
+    return c or 0xffff
@@ -0,0 +1,280 @@
+### CoAP layer of the SCHC Rules  -CoAP header and options after the IPv6/UDP headers
+
+'''
+##        CoAP [RFC 7252] messages are the UDP payload of the application. Their fields are
+##        described in the Rules with the same Field Descriptions as the IPv6 and UDP ones,
+##        after them (see the CoAP section of schc_rules.py):
+##
+##              -  cver, ctype, ctkl, ccode, cmid: fixed-size fields (2, 2, 4, 8, 16 bits)
+##              -  ctok: token, TKL bytes. Sent without a length, the decompressor already
+##                 has TKL when it gets to it (the ctkl FD must come first)
+##              -  options: FID is the option name ('uri-path', 'content-format'...), FP is
+##                 the occurrence of the option. A path with two segments has a 'uri-path'
+##                 FD with FP 1 and another one with FP 2
+##
+##        A Rule with CoAP fields only applies to a CoAP message carrying exactly the
+##        options the Rule describes (in this direction), as the decompressor rebuilds the
+##        options from the Rule. Variable-length values in the residue (value-sent, and the
+##        LSBs of a 'MSB(x)' option, x multiple of 8) are preceded by their length in
+##        bytes on 4 bits, 4 + 8 bits, or 4 + 8 + 16 bits [RFC 8724, 7.4.2].
+##
+##        SCHC Packet of such a Rule:
+##
+##    +--- ... --+---- ... ----+---- ... ----+------------------+
+##    |  Rule ID |IPv6/UDP res.|  CoAP res.  |   CoAP payload   |
+##    +--- ... --+---- ... ----+---- ... ----+------------------+
+##
+##        The payload marker (0xFF) is not sent, the decompressor adds it back when the
+##        payload is not empty. Options are rebuilt in option number order with the
+##        delta/length encoding of RFC 7252.
+##
+##        The CoAP part is interpreted from the Field Descriptions (no generated code, no
+##        vectorised batch path); the IPv6/UDP part of the same Rule still goes through
+##        the compiled codecs.
+##
+#'''
+
+## Import statements
+
+from schc_rules import hs, us, cs, cfid, var, dfp, ncr, msb_length, msb, lsb
+from schc_rules import option_number, option_fid, split_rule, header_size
+
+marker = 0xff                   # payload marker
+
+
+## Parse  -CoAP message to field values
+
+# option delta/length nibble and its extended bytes
+
+def _extended(n, data, pos):
+    if n < 13:
+        return n, pos
+    elif n == 13:
+        return data[pos] + 13, pos + 1
+    elif n == 14:
+        return (data[pos] << 8 | data[pos + 1]) + 269, pos + 2
+    raise ValueError("reserved option nibble")
+
+
+def _nibble(n):
+    if n < 13:
+        return n, b''
+    elif n < 269:
+        return 13, bytes(bytearray([n - 13]))
+    return 14, (n - 269).to_bytes(2, 'big')
+
+
+# Field values of a CoAP message, as a dict (FID, FP) -> value, and the offset of its
+# payload. None if the data is not a well-formed CoAP message
+
+def parse(data):
+    n = len(data)
+    if n < cs:
+        return None
+    b = data[0]
+    tkl = b & 15
+    pos = cs + tkl
+    if tkl > 8 or pos > n:
+        return None
+    values = {
+        ("cver", dfp): b >> 6,
+        ("ctype", dfp): (b >> 4) & 3,
+        ("ctkl", dfp): tkl,
+        ("ccode", dfp): data[1],
+        ("cmid", dfp): data[2] << 8 | data[3],
+        ("ctok", dfp): bytes(data[cs:pos]),
+    }
+    number = 0
+    fp = 0
+    while pos < n:
+        b = data[pos]
+        if b == marker:
+            if pos + 1 == n:
+                return None             # a marker is always followed by a payload
+            return values, pos + 1
+        try:
+            delta, pos = _extended(b >> 4, data, pos + 1)
+            length, pos = _extended(b & 15, data, pos)
+        except (IndexError, ValueError):
+            return None
+        if pos + length > n:
+            return None
+        fp = fp + 1 if delta == 0 and fp else 1         # occurrence of the option
+        number += delta
+        values[(option_fid(number), fp)] = bytes(data[pos:pos + length])
+        pos += length
+    return values, n
+
+
+# CoAP header and options from field values (no payload marker)
+
+def build(values):
+    token = values.get(("ctok", dfp), b'')
+    out = bytearray(cs)
+    out[0] = values[("cver", dfp)] << 6 | values[("ctype", dfp)] << 4 | values[("ctkl", dfp)]
+    out[1] = values[("ccode", dfp)]
+    out[2:4] = values[("cmid", dfp)].to_bytes(2, 'big')
+    out += token
+    number = 0
+    for n, fp, value in sorted((option_number(fid), fp, value)
+                               for (fid, fp), value in values.items()
+                               if option_number(fid) is not None):
+        delta, dext = _nibble(n - number)
+        length, lext = _nibble(len(value))
+        out.append(delta << 4 | length)
+        out += dext + lext + value
+        number = n
+    return bytes(out)
+
+
+## Variable-length residues  -length in bytes, then the value
+
+def var_length(n):
+    if n < 15:
+        return [(n, 4)]
+    elif n < 255:
+        return [(15, 4), (n, 8)]
+    return [(15, 4), (255, 8), (n, 16)]
+
+
+def read_length(r):
+    n = r.read(4)
+    if n == 15:
+        n = r.read(8)
+        if n == 255:
+            n = r.read(16)
+    return n
+
+
+def var_sent(value):
+    return var_length(len(value)) + [(int.from_bytes(value, 'big'), len(value)*8)]
+
+
+## CoAP part of a Rule
+
+class CoAPRule(object):
+
+    def __init__(self, fds, di):
+        self.fds = [fd for fd in fds if fd["DI"]=="bi" or fd["DI"]==di]
+        keys = [(fd["FID"], fd["FP"]) for fd in self.fds]
+        if len(set(keys)) != len(keys):
+            raise ValueError("CoAP field described twice in a Rule")
+        for fid in cfid[:-1]:
+            if (fid, dfp) not in keys:
+                raise ValueError("Rule does not rebuild every CoAP header field")
+        tkl = self.fds[keys.index(("ctkl", dfp))]
+        if ("ctok", dfp) in keys:
+            if keys.index(("ctok", dfp)) < keys.index(("ctkl", dfp)):
+                raise ValueError("the CoAP token must come after its length")
+        elif tkl["MO"]!='equal' or tkl["TV"]!=0:
+            raise ValueError("Rule does not rebuild the CoAP token")
+        for fd in self.fds:
+            self.check(fd)
+        self.size = len(set(keys) | set([("ctok", dfp)]))     # field values of a message
+
+    def check(self, fd):
+        if fd["FID"] not in cfid and option_number(fd["FID"]) is None:
+            raise ValueError("unknown CoAP field " + str(fd["FID"]))
+        x = msb_length(fd["MO"])
+        if x is None:
+            return
+        if fd["FL"]==var:
+            if x % 8 or len(fd["TV"])*8 != x:
+                raise ValueError(fd["MO"] + " on a variable-length field needs x bytes of TV")
+        elif fd["CDA"]=='not-s' and x != fd["FL"]:
+            raise ValueError("not-sent with " + fd["MO"] + " leaves LSBs unknown")
+        if fd["CDA"] not in ('not-s', 'LSB'):
+            raise ValueError("CDA " + str(fd["CDA"]) + " not supported with MSB(x)")
+
+    # Compression residue of the message field values (parse), list of (value, bits)
+    # pairs, None if the Rule does not apply
+
+    def compress(self, values):
+        if len(values) != self.size:
+            return None                         # options the Rule does not describe
+        compres = []
+        for fd in self.fds:
+            fv = values.get((fd["FID"], fd["FP"]))
+            if fv is None:
+                return None                     # option not in the message
+            if fd["MO"]=='equal':
+                if fd["TV"]!=fv:
+                    return None
+            elif fd["MO"]=='ignore':
+                if fd["CDA"]=='not-s':
+                    continue
+                elif fd["CDA"]!='val-s':
+                    raise ValueError("CDA " + str(fd["CDA"]) + " not supported with ignore")
+                elif fd["FL"]!=var:
+                    compres.append((fv, fd["FL"]))
+                elif fd["FID"]=="ctok":
+                    compres.append((int.from_bytes(fv, 'big'), len(fv)*8))     # TKL bytes
+                else:
+                    compres.extend(var_sent(fv))
+            elif fd["MO"]=='mmap':
+                index = fd["TV"].lookup.get(fv)
+                if index is None:
+                    return None
+                compres.append((index, fd["TV"].bits))
+            elif msb_length(fd["MO"]) is not None:
+                x = msb_length(fd["MO"])
+                if fd["FL"]==var:
+                    if fv[:x >> 3] != fd["TV"]:
+                        return None
+                    if fd["CDA"]=='LSB':
+                        compres.extend(var_sent(fv[x >> 3:]))
+                    elif len(fv) != x >> 3:
+                        return None             # not-sent, the value is the prefix
+                else:
+                    if not msb(x, fd["FL"], fv, fd["TV"]):
+                        return None
+                    if fd["CDA"]=='LSB':
+                        n = fd["FL"] - x
+                        compres.append((lsb(n, fv), n))
+            else:
+                raise ValueError("MO " + str(fd["MO"]) + " not supported")
+        return compres
+
+    # Read the CoAP residue from a BitReader, returns the CoAP header and options
+
+    def decompress(self, r):
+        values = {}
+        for fd in self.fds:
+            cda = fd["CDA"]
+            if cda=='not-s':
+                value = fd["TV"]
+            elif cda=='val-s':
+                if fd["FL"]!=var:
+                    value = r.read(fd["FL"])
+                elif fd["FID"]=="ctok":
+                    value = bytes(r.read_bytes(values[("ctkl", dfp)]))
+                else:
+                    value = bytes(r.read_bytes(read_length(r)))
+            elif cda=='index':
+                value = fd["TV"][r.read(fd["TV"].bits)]
+            elif cda=='LSB':
+                if fd["FL"]==var:
+                    value = fd["TV"] + bytes(r.read_bytes(read_length(r)))
+                else:
+                    n = fd["FL"] - msb_length(fd["MO"])
+                    value = fd["TV"] << n | r.read(n)
+            else:
+                raise ValueError("CDA " + str(cda) + " not supported")
+            values[(fd["FID"], fd["FP"])] = value
+        return build(values)
+
+
+# CoAPRule of every Rule, None for the Rules without CoAP fields in this direction
+
+def coap_rules(rules, di):
+    out = []
+    for rid, rule in enumerate(rules):
+        fixed, coap = split_rule(rule)
+        coap = [fd for fd in coap if fd["DI"]=="bi" or fd["DI"]==di]
+        if rid == ncr or not coap:
+            out.append(None)
+            continue
+        if header_size(fixed, di) != hs + us:
+            raise ValueError("CoAP fields need the UDP header fields in the Rule")
+        out.append(CoAPRule(coap, di))
+    return out
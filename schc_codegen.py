@@ -0,0 +1,150 @@
+### SCHC Rule compiler - generated per-Rule codecs
+
+'''
+##        Turns every SCHC Rule into two specialised Python functions, one for compression
+##        and one for decompression. The Field Descriptions are read once, when the source
+##        of the functions is generated, so the generated code has no dictionary lookups
+##        and no MO/CDA string comparisons: only integer compares, shifts and masks with
+##        the bit offsets, widths and Target Values already folded in as constants.
+##
+##        Compression codec:      c(fvs) -> (residue, residue bits)  or None
+##
+##              -  fvs is the list of header field values (uint), in hfid order
+##              -  None means the Rule does not apply to the packet
+##
+##        Decompression codec:    d(res) -> header fields
+##
+##              -  res is the whole compression residue as an integer (its size is fixed
+##                 by the Rule, see header_template), split with shifts/masks
+##              -  the result is the header (IPv6, + UDP for Rules with UDP fields) as
+##                 an integer, with only the fields rebuilt from the residue. Not-sent
+##                 fields (and the MSB(x) prefix of LSB fields) are in the Rule's header
+##                 template, OR both together
+##
+##        The generated functions produce exactly the same bits as the interpreted path in
+##        schc_comp.py / schc_decomp.py, select one or the other with the 'codegen' switch
+##        of Compressor and Decompressor.
+##
+#'''
+
+## Import statements
+
+from schc_rules import hfi, hfl, hfo, hs, mapping_table, msb_length, computeCDAs
+from schc_rules import iidCDAs, iidBits, iid_value, header_size, header_fields, PL, SP, UL
+from schc_rules import applies as _applies
+
+
+def compressor_source(rule, di, iids=None):
+    ns = {}
+    lines = ["def c(fvs):"]
+    res = None          # residue expression
+    width = 0           # residue bits
+    if header_size(rule, di) > hs:
+        lines.append("    if fvs[%d] is None: return None" % SP)      # not UDP
+    for k, fd in enumerate(rule):
+        if not _applies(fd, di):
+            continue
+        i = hfi[fd["FID"]]
+        mo, cda = fd["MO"], fd["CDA"]
+        if mo=='equal':
+            lines.append("    if fvs[%d] != %d: return None" % (i, fd["TV"]))
+            continue
+        elif mo=='ignore':
+            if cda=='comp-l' and i == UL:
+                lines.append("    if fvs[%d] != fvs[%d]: return None" % (UL, PL))
+                continue
+            elif cda=='not-s' or cda in computeCDAs:
+                continue
+            elif cda=='val-s':
+                val, n = "fvs[%d]" % i, fd["FL"]
+            else:
+                raise ValueError("CDA " + str(cda) + " not supported with ignore")
+        elif mo=='mmap':
+            table = mapping_table(fd["TV"])
+            ns["m%d" % k] = table.lookup
+            lines.append("    i%d = m%d.get(fvs[%d])" % (k, k, i))
+            lines.append("    if i%d is None: return None" % k)
+            val, n = "i%d" % k, table.bits
+        elif msb_length(mo) is not None:
+            x = msb_length(mo)
+            n = fd["FL"] - x
+            lines.append("    if fvs[%d] >> %d != %d: return None" % (i, n, fd["TV"]))
+            if cda=='not-s':
+                continue
+            elif cda=='LSB':
+                val = "(fvs[%d] & %d)" % (i, (1 << n) - 1)
+            elif cda in iidCDAs:
+                lines.append("    if fvs[%d] & %d != %d: return None"
+                             % (i, (1 << iidBits) - 1, iid_value(fd, iids)))
+                continue
+            else:
+                raise ValueError("CDA " + str(cda) + " not supported with MSB(x)")
+        else:
+            raise ValueError("MO " + str(mo) + " not supported")
+        res = val if res is None else "(%s << %d | %s)" % (res, n, val)
+        width += n
+    lines.append("    return %s, %d" % (res or "0", width))
+    return "\n".join(lines) + "\n", ns
+
+
+def decompressor_source(rule, di):
+    ns = {}
+    reads = []          # (FD number, bits, index table or None), residue order
+    parts = []
+    done = set()
+    size = header_size(rule, di)
+    hbits = size*8
+    for k, fd in enumerate(rule):
+        if not _applies(fd, di):
+            continue
+        i = hfi[fd["FID"]]
+        shift = hbits - hfo[i] - hfl[i]
+        cda = fd["CDA"]
+        if cda=='not-s':
+            pass                # already in the header template
+        elif cda in computeCDAs:
+            pass                # computed by the Decompressor, see computed_fields
+        elif cda in iidCDAs:
+            pass                # IID in the header template too
+        elif cda=='val-s':
+            reads.append((k, fd["FL"], None))
+            parts.append("f%d << %d" % (k, shift))
+        elif cda=='index':
+            table = mapping_table(fd["TV"])
+            ns["t%d" % k] = table
+            reads.append((k, table.bits, "t%d" % k))
+            parts.append("f%d << %d" % (k, shift))
+        elif cda=='LSB':
+            reads.append((k, fd["FL"] - msb_length(fd["MO"]), None))
+            parts.append("f%d << %d" % (k, shift))     # prefix in the header template
+        else:
+            raise ValueError("CDA " + str(cda) + " not supported")
+        done.add(i)
+    if done != set(header_fields(size)):
+        raise ValueError("Rule does not rebuild every header field")
+
+    width = sum(w for k, w, t in reads)
+    lines = ["def d(res):"]
+    for k, w, t in reads:
+        width -= w
+        field = "(res >> %d) & %d" % (width, (1 << w) - 1) if width else "res & %d" % ((1 << w) - 1)
+        lines.append("    f%d = %s" % (k, field if t is None else "%s[%s]" % (t, field)))
+    lines.append("    return %s" % (" | ".join(parts) or "0"))
+    return "\n".join(lines) + "\n", ns
+
+
+def _build(source, ns, name):
+    exec(compile(source, "<schc rule>", "exec"), ns)
+    fn = ns[name]
+    fn.source = source
+    return fn
+
+
+def compile_compressor(rule, di, iids=None):
+    source, ns = compressor_source(rule, di, iids)
+    return _build(source, ns, "c")
+
+
+def compile_decompressor(rule, di):
+    source, ns = decompressor_source(rule, di)
+    return _build(source, ns, "d")
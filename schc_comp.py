@@ -21,8 +21,8 @@
 ##        The maximum size for the packets is dependent on the LoRaWAN protocol's Data Rate,
 ##        which is variable. The maximum size will be explicitly established here.
 ##
-##        This SCHC implementation only considers compression/decompression. Fragmentation will
-##        not be supported, therefore the maximum packet size limitation.
+##        SCHC Packets longer than the LoRaWAN MTU are sent as SCHC Fragments, ACK-on-Error
+##        mode (see schc_frag.py), and reassembled at the gateway (see schc_reasm.py).
 ##
 ##
 ##            -Code by Nicolás Maturana
@@ -145,294 +145,346 @@
 ##    *NOTE:
 ##
 ##    When no applicable Rule is found, SCHC SHOULD apply the Fragmentation scheme.
-##    As this implementation does not include Fragmentation, maximum packet size is
-##    checked for in the generator block, so that no uncompressed packet will exceed
-##    the link's maximum message size.
+##    SCHC Packets longer than the link's maximum message size are fragmented after
+##    compression (ACK-on-Error, see schc_frag.py), done in the sender script.
 ##
 ##
 
 ## Import statements
 
-from math import log, ceil
-from bitarray import bitarray as ba
-from bitstring import Bits as bits, BitArray as bar, BitStream as bst, ConstBitStream as conbst
-from collections import OrderedDict as ordic
-
-#from copy import deepcopy as dcopy     #if dict.copy() causes multi-reference
+from schc_rules import build_rules, compile_mappings, selection_order, hfi, hfl, hfo, hs, ncr, dfp
+from schc_rules import msb_length, msb, lsb, iidCDAs, iidBits, iid_value, device_iids
+from schc_rules import header_size, applies, split_rule, us, PL, NH, SA, DA, SP, UL, UC, CM
+from schc_coap import coap_rules, parse as parse_coap
+from schc_checksum import udp_checksum
+from schc_ruleid import RuleIDCode
+from schc_bits import IPv6View, BitWriter
+from schc_index import RuleIndex
+from schc_codegen import compile_compressor
+from schc_cache import LRUCache
 
 ## Communication context
 
 side = 'end-device'     # default for this implementation. Other option is 'gateway'.
-#did = DevIID           # device identifier, used for downlink compression
+deveui = None           # LoRaWAN identifiers of the device, hex strings as in 'keys' of
+devaddr = None          #  cominit.py and the answers to 'mac get deveui' / 'mac get devaddr'
+appeui = None           #  / 'mac get appeui' (mgdeve, mgdeva, mgape). None if not known
+did = device_iids(deveui, devaddr, appeui)  # device IIDs, used by DevIID/AppIID Rules
 
 if side == 'end-device':
     di = 'up'
 else:
     di = 'dw'
-        
-
-## Defaults
-
-dpl = 40
-dsa = bits('0b01')
-dsa = dsa*64
-dda = bits('0b10')*64
-
-udp = 17
-nonh = 59
-tcp = 6
-
-## Initialize rules
-
-rn = rulesNumber  = 4 
-fn = fieldsNumber = 8   # lines per Rule, 8 fields in IPv6 header
-
-rb = ruleBits = int(ceil(log(rn,2)))     # bits needed to represent Rule IDs
-
-rules = []              # empty list + .append method to avoid multi-reference
-                        # we want a list of rn=(4) lists of fn=(8) elements
-
-## Common case
-
-hfid = headerFID = ["v","tc","fl","pl","nh","hl","sa","da"]
-hfl = headerFieldLength = [4, 8, 20, 16, 8, 8, 128, 128]        # all lengths are known
-#hfp = headerFieldPosition = [1]*7                              # one occurence per field
-#hdi = headerDirection = "up"                                   # only uplink
-htv = headerTargetValue = [6, 0, 0, dpl, udp, 200, [dsa.uint], [dda.uint]]
-hmo = headerMatchingOperator = ["equal"]*3 + ["ignore"] + ["equal"]*2 + ["mmap"]*2 
-hcda = headerCompDecompAct = ["not-s"]*3 + ["val-s"] + ["not-s"]*2 + ["index"]*2
-
-#*NOTE: TVs CAN NOT be based on ANY packet-to-send field, they are fixed and must be known
-# (included in a static shared Rule) by both ends beforehand
-
-field_items = iter([
-
-        ("FID", "v"),       # identifies header field 
-        ("FL" ,  4),        # length of the field
-        ("FP" ,  1),        # position of the field occurence within the header
-        ("DI" , "up"),      # direction of communication  up/dw/bi
-        ("TV" ,  6),        # value used for comparison with FV
-        ("MO" , "ignore"),  # method of comparison
-        ("CDA", "not-s"),   # action taken if Rule is selected
-
-    ])
-
-fields = ordic(field_items)
-
-for i in range(rn):
-    rules.append([])            # add rules as (independent) lists
-    for h in range(fn):
-        rules[i].append(fields.copy())
-pass
-#print(rules)
-
-
-## Define rules
-
-#apply common case      -DI/FP are NOT modified; 
-
-count = 0        
-for x in rules:
-    print(count)
-    count +=1
-    for i in range(fn):
-        x[i]["FID"] = hfid[i]
-        x[i]["FL"] = hfl[i]
-        x[i]["TV"] = htv[i]
-        if x is rules[0]:       # rule 0 assumes fully-known context
-            print(x[i])
-            continue
-        else:
-            x[i]["MO"] = hmo[i]
-            x[i]["CDA"] = hcda[i]
-        print(x[i])
-pass
-print "\n"
-
-#easy header field indexes
-
-V  = 0
-TC = 1          
-FL = 2
-PL = 3
-NH = 4
-HL = 5
-SA = 6
-DA = 7
-
-#rule 0     *ideal* = all context is fully known
-
-#known:     v - tc - fl - pl - nh - hl - sa - da
-#fromset:
-#unknown:   
-
-rules[0][PL].update(TV= dpl , MO='equal', CDA='not-s')      # default payload size
-rules[0][NH].update(TV= nonh, MO='equal', CDA='not-s')      # not UDP
-rules[0][HL].update(TV= 200 , MO='equal', CDA='not-s')
-rules[0][SA].update(TV= dsa[0:16].uint , MO='equal', CDA='not-s')      # default source address
-rules[0][DA].update(TV= dda[0:16].uint , MO='equal', CDA='not-s')      # default destin address
-
-#rule 1     -ready == common case
-
-#known:     v - tc - fl - nh - hl 
-#fromset:   sa - da
-#unknown:   pl 
-
-#rule 2     -allow unknown addresses + unknown hop limits + known set of next headers
-
-#known:     v - tc - fl
-#fromset:   nh
-#unknown:   pl - hl - sa - da
-
-rules[2][NH].update(TV= [udp,nonh,tcp], MO='mmap',   CDA='index')
-rules[2][HL].update(TV= 200           , MO='ignore', CDA='val-s')
-rules[2][SA].update(TV= dsa[0:16].uint, MO='ignore', CDA='val-s')
-rules[2][DA].update(TV= dda[0:16].uint, MO='ignore', CDA='val-s')
-
-#rule 3     -no compression possible
-
-for x in rules[3]:
-    x["DI"] = 'dw'        # force failure
-
-    #APPLY FRAGMENTATION
-
-####
-countt = 0        
-for x in rules:
-    print(countt)
-    countt +=1
-    for i in range(fn):
-        print x[i]
-print "\n"
-
-## Select SCHC Rule
-
-rid = ruleID    = bits()         #empty, no rule selected yet
-
-###<RECEIVE PACKET P>
 
-P = packet = ip6
 
-## SCHC algorithm
-
-# Parse packet
-
-
-
-# Run through rules
-
-currule = 0
-compresvals = []        # compression residue values
-compres = bits()        # compression residue as a bit chain
-compresfds = []
-include = False
-dfp = 1
-#fpset = set()
-selrules = []           # selected rules list
-print("debugging")
-
-print "breakpoint"
-
-for x in rules:
-    for fd in x:
-        #check direction
-        if fd["DI"]!="bi" and fd["DI"]!=di:            
-            continue                            # if DI not in message direction, skip FD
-        elif fd["FP"]!=dfp:                     # else check FP
-            continue                            # if rule's FP doesn't match the field's, skip FD
-        else:                                   # else check MO
-            include = True
-            fid = fd["FID"]
-            fv = eval(fid)#[0:16]
+## SCHC Compressor
+##
+##    Rules are built once, when the Compressor is created. Each call to compress() only
+##    parses the packet, runs the Rules and returns the SCHC Packet as bytes (padding bits
+##    already added at the end, as LoRaWAN needs an integer number of bytes).
+##
+##    A single Rule is sent per packet: the one with the smallest residue among the Rules
+##    that apply (Rule order between equal sizes). Residue sizes are fixed per Rule, so
+##    Rules are tried cheapest first and the first one that applies is selected; a Rule
+##    with a 0-bit residue ends the search right away.
+##
+##    With index=True (default) the Rules are also compiled into a RuleIndex, so only the
+##    Rules whose 'equal' fields and MSB(x) prefixes match the packet are run (longest
+##    prefix match through a trie, see schc_index.py). index=False keeps the linear
+##    scan over every Rule, both select the same Rule.
+##
+##    With codegen=True (default) every Rule is compiled into its own compression function
+##    (see schc_codegen.py). codegen=False interprets the Field Descriptions with match(),
+##    the SCHC Packet is the same bit for bit.
+##
+##    With cache_size > 0 the selected Rule ID and residue are kept in an LRU cache keyed
+##    on the header bytes that can change the result (fields that are ignored and not sent
+##    by every Rule are left out of the key). A device sending the same header over and
+##    over then skips parsing and Rule selection. set_rules() clears the cache.
+##
+##    Rule IDs are fixed-size by default. 'ruleids' takes a RuleIDCode with variable-length
+##    (Huffman) Rule IDs, see schc_ruleid.py; the Decompressor must use the same one.
+##    'counts' holds how many packets were sent with every Rule ID, to build such a code,
+##    and 'rid' the Rule ID compress() sent last (after the checksum fallback).
+##
+##    Rules with UDP Field Descriptions compress the UDP header too and only apply to UDP
+##    packets. Computed UDP fields are only elided when the decompressor gets them back:
+##    the UDP length must be the IPv6 payload length, and the checksum must be valid. The
+##    checksum needs the payload, so it is checked by compress() once a Rule is selected
+##    (select() alone does not look at it); if it is wrong the packet is compressed with
+##    the best Rule that does not compute it.
+##
+##    'iids' holds the IIDs built from the LoRaWAN identifiers of the device (see
+##    device_iids in schc_rules.py), needed by Rules with DevIID/AppIID fields. The
+##    Decompressor of that device must be given the same ones.
+##
+##    Rules with CoAP fields (see schc_coap.py) compress the CoAP header and options too,
+##    in the same pass: the IPv6/UDP part of the Rule selects the candidates as above, the
+##    CoAP part runs next on the parsed message, and the payload sent is the CoAP payload.
+##    CoAP residues may depend on the message length, so the cache and the batch path are
+##    not used when the Rule set has CoAP Rules (compress_batch compresses one by one).
+
+class Compressor(object):
+
+    def __init__(self, rules=None, di=di, index=True, codegen=True, cache_size=0,
+                 ruleids=None, iids=did):
+        self.di = di
+        self.iids = iids
+        self.use_index = index
+        self.use_codegen = codegen
+        self.cache = LRUCache(cache_size) if cache_size else None
+        self.rid = None                     # Rule ID of the last packet compressed
+        self.set_rules(build_rules() if rules is None else rules, ruleids)
+
+    # Load a new Rule set: everything compiled from the Rules is rebuilt
+
+    def set_rules(self, rules, ruleids=None):
+        self.rules = compile_mappings(rules)
+        self.fixed = [split_rule(rule)[0] for rule in rules]       # IPv6/UDP FDs
+        self.coap = coap_rules(rules, self.di)
+        self.layered = any(c is not None for c in self.coap)
+        self.ruleids = RuleIDCode.fixed(len(rules)) if ruleids is None else ruleids
+        self.counts = [0]*len(rules)
+        self.order = selection_order(rules, self.di, self.ruleids.lengths, self.iids)
+        self.sizes = [header_size(rule, self.di) for rule in self.fixed]
+        self.checksums = set(rid for rid, rule in enumerate(self.fixed) if rid != ncr and
+                             any(fd["CDA"]=='comp-c' and applies(fd, self.di) for fd in rule))
+        self.index = RuleIndex(self.fixed, self.di, self.order) if self.use_index else None
+        self.codecs = None
+        if self.use_codegen:
+            self.codecs = [None if rid == ncr else compile_compressor(rule, self.di, self.iids)
+                           for rid, rule in enumerate(self.fixed)]
+        self.keyranges = self.key_ranges()
+        self.batch = None
+        if self.cache is not None:
+            self.cache.clear()
+
+    # Header byte ranges that take part in Rule selection or in the residue
+
+    def key_ranges(self):
+        used = set()
+        for rid, rule in enumerate(self.fixed):
+            if rid == ncr:
+                continue
+            for fd in rule:
+                if fd["DI"]!="bi" and fd["DI"]!=self.di:
+                    continue
+                elif fd["FP"]!=dfp:
+                    continue
+                i = hfi[fd["FID"]]
+                elided = fd["CDA"]=='not-s' or fd["CDA"]=='comp-c' or \
+                    (fd["CDA"]=='comp-l' and i == PL)
+                if fd["MO"]!='ignore' or not elided:
+                    used.update(range(hfo[i]//8, (hfo[i] + hfl[i] + 7)//8))
+                if i == UL:
+                    used.update(range(hfo[PL]//8, (hfo[PL] + hfl[PL])//8))     # UL == PL
+                if i > DA:
+                    used.update(range(hfo[NH]//8, (hfo[NH] + hfl[NH])//8))     # UDP or not
+        ranges = []
+        for b in sorted(used):
+            if ranges and ranges[-1][1] == b:
+                ranges[-1][1] = b + 1
+            else:
+                ranges.append([b, b + 1])
+        return [tuple(r) for r in ranges]
+
+    def cache_key(self, buf):
+        if len(self.keyranges) == 1:
+            a, b = self.keyranges[0]
+            return bytes(buf[a:b])
+        return b''.join([buf[a:b] for a, b in self.keyranges])
+
+    # Parse packet: header field values as uint, in hfid order. With CoAP Rules the parsed
+    # CoAP message of UDP packets follows (fvs[CM], see schc_coap.parse)
+
+    def parse(self, packet):
+        return self.fields(IPv6View(packet))
+
+    def fields(self, view):
+        fvs = view.fields()
+        if self.layered:
+            fvs.append(None if fvs[SP] is None else parse_coap(view.buf[hs + us:]))
+        return fvs
+
+    # Run a Rule over the field values. Returns the compression residue as a list of
+    # (value, bit length) pairs, or None if the Rule does not apply
+
+    def match(self, rule, fvs):
+        compres = []
+        for fd in rule:
+            #check direction
+            if fd["DI"]!="bi" and fd["DI"]!=self.di:
+                continue                        # if DI not in message direction, skip FD
+            elif fd["FP"]!=dfp:                 # else check FP
+                continue                        # if rule's FP doesn't match the field's, skip FD
+            fv = fvs[hfi[fd["FID"]]]
+            if fv is None:
+                return None                     # header not in the packet (no UDP)
             if fd["MO"]=='ignore':
                 #check CDA
                 if fd["CDA"]=='not-s':
-                    #not-sent, no compression residue   *fixed-known
-                    continue
+                    continue                    # not-sent, no compression residue
                 elif fd["CDA"]=='val-s':
-                    compresvals.append(fv.uint)
-                    compres+=fv                 # add FV to comp-residue    *impredictable
-                    compresfds.append(fid)
-                    continue                    # rule applies to FD, check next
-                else:  # fd["CDA"]=='LSB'
-                    compresvals.append(lsb(x, fv.uint))     # ( bits and int as arguments, careful )
-                    compres += fv           # add x LSBs from fv to comp-residue    *const-impr
-                    compresfds.append(fid)
-                    continue                # rule applies to FD, check next
-            elif fd["MO"]=='equal':
-                if fd["TV"]==fv.uint:
-                    #not-sent, no comp-residue      *expected
-                    continue                        # rule applies to FD, check next
-                else:
-                    compresvals = []            # rule failed, clean comp-residue
-                    compres = bits()
-                    compresfds = []
-                    include = False
-                    break                       # rule does not apply, go to next rule
-            elif fd["MO"]=='MSB(x)':
-                if msb(x, fv, fd["TV"]):                # bits and int as arguments, careful
-                    #check CDA
-                    if fd["CDA"]=='not-s':
-                        #not-sent, no comp-residue       *known, unique start
-                        continue                        # rule applies to FD, check next
-                    else:  # fd["CDA"]=='LSB'
-                        compresvals.append(lsb(x, fv.uint))  # ( bits and int as arguments, careful )
-                        compres += fv       # add x LSBs from fv to comp-residue    *com-start
-                        compresfds.append(fid)
-                        continue            # rule applies to FD, check next
+                    compres.append((fv, fd["FL"]))      # add FV to comp-residue
+                    continue
+                elif fd["CDA"]=='comp-l':
+                    if hfi[fd["FID"]] == UL and fv != fvs[PL]:
+                        return None             # UDP length must be the IPv6 payload length
+                    continue                    # elided, computed by the decompressor
+                elif fd["CDA"]=='comp-c':
+                    continue                    # elided, checked by compress()
                 else:
-                    compresvals = []            # rule failed, clean comp-residue
-                    compres = bits()
-                    compresfds = []
-                    include = False
-                    break                       # rule does not apply, go to next rule
+                    raise ValueError("CDA " + str(fd["CDA"]) + " not supported with ignore")
+            elif fd["MO"]=='equal':
+                if fd["TV"]==fv:
+                    continue                    # not-sent, no comp-residue
+                return None                     # rule does not apply, go to next rule
             elif fd["MO"]=='mmap':
-                if fv.uint in fd["TV"]:
-                    index = fd["TV"].index(fv.uint)
-                    compresvals.append(index)       # add index of TV[i] = FV to comp-residue
-                    compres += bits(uint=index, length=len(fd["TV"]).bit_length())#compres += bits(bin(index))
-                    compresfds.append(fid + " as index = " + str(index))
-                    continue                        # rule applies to FD, check next
+                index = fd["TV"].lookup.get(fv)         # MappingTable, O(1)
+                if index is not None:
+                    compres.append((index, fd["TV"].bits))      # send index
+                    continue
+                return None
+            elif msb_length(fd["MO"]) is not None:
+                x = msb_length(fd["MO"])
+                if not msb(x, fd["FL"], fv, fd["TV"]):
+                    return None                 # prefix differs, rule does not apply
+                #check CDA
+                if fd["CDA"]=='not-s':
+                    continue                    # x = FL, known value
+                elif fd["CDA"]=='LSB':
+                    n = fd["FL"] - x
+                    compres.append((lsb(n, fv), n))     # send FL - x LSBs
+                    continue
+                elif fd["CDA"] in iidCDAs:
+                    if lsb(iidBits, fv) == iid_value(fd, self.iids):
+                        continue                # IID built from L2 identifiers, elided
+                    return None
                 else:
-                    compresvals = []            # rule failed, clean comp-residue
-                    compres = bits()
-                    compresfds = []
-                    include = False
-                    break                       # rule does not apply, go to next rule
+                    raise ValueError("CDA " + str(fd["CDA"]) + " not supported with MSB(x)")
             else:
-                print("Something unexpected happened")
-                break
-    if include:
-        selrules.append(currule)                # add Rule ID to selected rules
-        rid += bits(uint=currule, length=rb)    # add rule to Rule ID bit chain
-        include = False
-    else:
-        include = True
-    currule +=1                         # prepare next rule
-
-print selrules, rid
-print compresvals, compres, compresfds
-
-
-comphdr = compheader = rid + compres
-schcP = SCHCPacket = rid + compres + pd
-
-
-
-
+                raise ValueError("MO " + str(fd["MO"]) + " not supported")
+        return compres
 
+    # Run Rule 'rid', compiled codec if available, then its CoAP part if it has one
 
+    def run(self, rid, fvs):
+        if self.codecs is None:
+            compres = self.match(self.fixed[rid], fvs)
+        else:
+            compres = self.codecs[rid](fvs)
+            compres = None if compres is None else [compres]
+        if compres is None or self.coap[rid] is None:
+            return compres
+        message = fvs[CM]
+        if message is None:
+            return None                         # not a CoAP message
+        coapres = self.coap[rid].compress(message[0])
+        return None if coapres is None else compres + coapres
+
+    # Select SCHC Rule: cheapest Rule that applies. None if no Rule applies. With
+    # checksum=False the Rules computing a checksum are left out
+
+    def select(self, fvs, checksum=True):
+        if self.index is None:
+            return self.select_scan(fvs, checksum)
+        return self.first(self.index.candidates(fvs), fvs, checksum)
+
+    def select_scan(self, fvs, checksum=True):
+        return self.first(self.order, fvs, checksum)
+
+    def first(self, rids, fvs, checksum):
+        for rid in rids:
+            if not checksum and rid in self.checksums:
+                continue
+            compres = self.run(rid, fvs)
+            if compres is not None:
+                return rid, compres
+        return None, None
+
+    # UDP checksum of the packet is the one the decompressor will compute
+
+    def checksum_ok(self, view, fvs):
+        buf = view.buf
+        return fvs[UC] == udp_checksum(fvs[SA], fvs[DA], buf[hs:hs + us], buf[hs + us:])
+
+    def compress(self, packet):
+        view = IPv6View(packet)
+        fvs = None
+        if self.cache is None or self.layered:
+            fvs = self.fields(view)
+            rid, compres = self.select(fvs)
+        else:
+            key = self.cache_key(view.buf)
+            selected = self.cache.get(key)
+            if selected is None:
+                selected = self.select(view.fields())
+                self.cache.put(key, selected)
+            rid, compres = selected
+        if rid in self.checksums:
+            if fvs is None:
+                fvs = self.fields(view)
+            if not self.checksum_ok(view, fvs):
+                rid, compres = self.select(fvs, checksum=False)
+        # the SCHC Packet is never longer than Rule ID + uncompressed packet
+        out = BitWriter((self.ruleids.maxlen + 7)//8 + len(packet))
+        if rid is None:
+            # no elligible Rule, packet is sent without compression
+            self.rid = ncr
+            self.counts[ncr] += 1
+            out.write(*self.ruleids.encode(ncr))
+            out.write_bytes(view.buf)
+            return self.frame(ncr, out.getvalue())
+        self.rid = rid
+        self.counts[rid] += 1
+        out.write(*self.ruleids.encode(rid))
+        for v, n in compres:
+            out.write(v, n)
+        if self.coap[rid] is None:
+            out.write_bytes(view.buf[self.sizes[rid]:])
+        else:
+            out.write_bytes(view.buf[hs + us + fvs[CM][1]:])       # CoAP payload
+        return self.frame(rid, out.getvalue())  # padding bits added at the end
 
+    # SCHC Packet, or (FPort, SCHC Packet) when the Rule ID is the FPort (FPortCode)
 
+    def frame(self, rid, data):
+        if self.ruleids.ports is None:
+            return data
+        return self.ruleids.ports[rid], data
 
+    # Many packets at once, vectorised with NumPy (see schc_batch.py)
 
+    def compress_batch(self, packets):
+        if self.layered:
+            return [self.compress(packet) for packet in packets]
+        if self.batch is None:
+            from schc_batch import BatchCompressor
+            self.batch = BatchCompressor(self.rules, self.di, self.ruleids, self.iids)
+        return self.batch.compress_batch(packets)
 
 
+## Script mode     -prints the Rules, then compresses the IPv6 packets given in hexadecimal:
+##                  python schc_comp.py <packet> ...   (runstack.py imports Compressor)
 
+if __name__ == '__main__':
 
+    import sys
+    from binascii import hexlify, unhexlify
 
+    compressor = Compressor(di=di, iids=did)
 
+    for count, x in enumerate(compressor.rules):
+        print(count)
+        for fd in x:
+            print(fd)
+    print("\n")
 
+    ###<RECEIVE PACKET P>
 
+    for P in sys.argv[1:]:
 
+        schcbytes = compressor.compress(unhexlify(P))
 
+        print("Rule ID = " + str(compressor.rid))
+        print("SCHC Packet = " + hexlify(schcbytes).decode('ascii'))
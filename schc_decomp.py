@@ -0,0 +1,424 @@
+﻿### SCHC Decompression for received SCHC Packets                        BLOCK [6]/[7]
+
+'''             ######## EDIT INTRO ##############################
+##        Receives IPv6 standard-header + dummy payload packets and applies SCHC Compression
+##
+##        The SCHC Packets (compressed IPv6 packets) are sent through a LoRaWAN link. In this
+##        case it is an uplink: from end-device to gateway. As a hardware requirement (RN2903),
+##        the SCHC Packets are sent in hexadecimal format.
+##
+##        SCHC is a compression and fragnentation mechanism for IPv6 packets [RFC 8200] over
+##        Low Power Wide Area Network (LPWAN) [RFC 8376] technologies. It is currently under
+##        development by the Internet Engineering Task Force (IETF).
+##
+##        This implementation considers IPv6 packets with only the standard 40-byte header plus
+##        a payload. No support for extension headers is given.
+##
+##        The system is intended for IPv6 packet transmission within a Long-Range Wide Area
+##        Network (LoRaWAN). The layer 2 protocol is LoRaWAN protocol. This design is compliant
+##        with the LoRa specification version 1.0.2.
+##
+##        The maximum size for the packets is dependent on the LoRaWAN protocol's Data Rate,
+##        which is variable. The maximum size will be explicitly established here.
+##
+##        SCHC Packets longer than the LoRaWAN MTU arrive as SCHC Fragments, ACK-on-Error
+##        mode: they are reassembled (see schc_reasm.py) before they get here.
+##
+##
+##            -Code by Nicolás Maturana
+##
+##            -October 2018
+##            -mail: nico.matu.a@gmail.com
+#'''            '''######## EDIT INTRO ##############################'''
+
+# Packet structure
+
+#               | IPv6 Packet  | = | Fixed Header [40 bytes] |   Payload   |
+#
+# Bit position                     0 1 2 3 4 5 6 7 0 1 2 3 4 5 6 7 0 1 2 3 4 5 6 7 0 1 2 3 4 5 6 7 |
+#                                  |       |               |                                       |    
+#  Field size   |  [40 bytes]  |   |  [4]  |      [8]      |                 [20]                  |
+#   [# bits]    | Fixed Header | = |Version| Traffic Class |              Flow Label               |
+#                                  |-------+---------------+-------+---------------+---------------|
+#                                  |             [16]              |      [8]      |      [8]      | 
+#                                  |         Payload Length        |  Next Header  |   Hop Limit   |
+#                                  |-------------------------------+---------------+---------------| 
+#                                  |                                                               |  
+#                                  |                             [128]                             |
+#                                  |                        Source Address                         |
+#                                  |                                                               |
+#                                  |---------------------------------------------------------------| 
+#                                  |                                                               |
+#                                  |                             [128]                             |
+#                                  |                      Destination Address                      |
+#                                  |                                                               |
+#                                  +---------------------------------------------------------------+
+
+## Resulting SCHC Packet structure
+##
+##    +--- ... --+------- ... -------+------------------+
+##    |  Rule ID |Compression Residue|  packet payload  |
+##    +--- ... --+------- ... -------+------------------+
+##    |                              |
+##    |--------Compressed Header-----|
+##
+
+## Rules concept    -   (a Rule is a list of Field Descriptions)                                                           
+##
+##      Acronyms:                 /----------------------------\
+##                                |           Rule N           |
+##      FID: Field ID            /----------------------------\|
+##      FL:  Field Length        |           Rule i           ||    Field Descriptions (FD)
+##      FP:  Field Position     /----------------------------\||              |
+##            (occurence)       |  (FID)    Rule 1           |||              |
+##      TV:  Target Value       |+-------+--+--+--+--+--+---+|||              |    *they refer to
+##      MO:  Matching Operator  ||Field 1|FL|FP|DI|TV|MO|CDA||||<-------------+     the fields of 
+##      CDA: Compression/       |+-------+--+--+--+--+--+---+|||              |     the header(s)
+##           Decompression      ||Field 2|FL|FP|DI|TV|MO|CDA||||<-------------+
+##           Action             |+-------+--+--+--+--+--+---+|||              |
+##                              ||...    |..|..|..|..|..|...||||              |
+##                              |+-------+--+--+--+--+--+---+||/              |
+##      *FV: Field Value        ||Field N|FL|FP|DI|TV|MO|CDA|||<--------------+
+##                              |+-------+--+--+--+--+--+---+|/
+##                              |                            |
+##                              \----------------------------/
+##
+
+## Matching Operator (MO)
+##
+##   /--------------------+----------------------------------------------\  +--not-sent (expected TV)
+##   |  Name              | Meaning                                      |  |
+##   |                    |                                              |  | +--not-sent (fixed-known)
+##   +--------------------+----------------------------------------------+  | |
+##   |equal               |True if FV = TV                               |>-+ +--value-sent
+##   |                    |                                              |    |       (impredictable)
+##   |ignore              |Result is always True.                        |>---+
+##   |                    |                                              |    +--send LSB ( first part      
+##   |MSB(x)              |True if the x MSBs of FV = TV in the Rule.    |       is constant, second 
+##   |                    |The x is the number of bits compared.         |      part is impredictable )
+##   |                    |                                              |      
+##   |                    | *If the FL is described as variable, the     |>-+--send LSB ( known set of
+##   |                    | length must be a multiple of its unit.       |  |     values, common start )
+##   |                    | For example, if the unit of the variable     |  |
+##   |                    | length is in bytes, x must be multiple of 8. |  +--not-sent ( known value,
+##   |                    |                                              |                unique start )
+##   |match-mapping       |True if FV = TV[i] for some index i.          |
+##   |                    |                                              |>--send index ( always a 
+##   |                    | *TV is an indexed list of values.            |         member of known set )
+##   |                    | The index is sent instead of the FV.         |
+##   \--------------------+----------------------------------------------/
+##
+
+## Compression-Decompression Actions (CDA)
+##
+##   /--------------------+-------------+----------------------------\
+##   |  Action     (!)    | Compression | Decompression              |
+##   |                    |             |                            |
+##   +--------------------+-------------+----------------------------+
+##   |not-sent            |elided       |use value stored in context |  equal / ignore / MSB(x) 
+##   |value-sent          |send         |build from received value   |  ignore / equal?
+##   |mapping-sent        |send index   |value from index on a table |  match-mapping
+##   |LSB                 |send LSB     |TV, received value          |  ignore / MSB(x)
+##   |compute-length      |elided       |compute length              |  ignore
+##   |compute-checksum    |elided       |compute UDP checksum        |  ignore
+##   |DevIID              |elided       |build IID from L2 Dev addr  |  ignore
+##   |AppIID              |elided       |build IID from L2 App addr  |  ignore
+##   \--------------------+-------------+----------------------------/
+##
+
+## Course of events:
+##      
+##    1. Communication side is identified
+##    2. Rules are initialized
+##    3. A SCHC Packet is received (from payload retriever)
+##    4. Rule IDs are read and applicable Rules are identified
+##    5. Applicable Rules are scanned for:
+##            -Direction (DI)
+##            -Field Position (FP)
+##            -Compression/Decompression Action (CDA)
+##
+##    6. Fields are reconstructed using Target Value (TV) and Compression Residue
+##    7. At all times Rule order is followed, and also FD order inside each Rule
+##    8. Any computations are left to be done after reconstruction (computed fields)
+##    9. If the special no-compression Rule is found, the leading Rule ID is removed
+##       and the remaining data corresponds to the original IPv6 packet (plus padding)
+##   10. Any padding bits that may be present are removed using the PL information
+##
+##    *NOTE:
+##
+##    SCHC Fragments (fragmentation FPort) go through the Reassembler first (see
+##    schc_reasm.py), the decompressor always gets a complete SCHC Packet.
+##
+##
+
+## Import statements
+
+from schc_rules import build_rules, compile_mappings, header_template, computed_fields
+from schc_rules import header_size, hfl, hfo, hfi, hs, us, PL, UL, UC, ncr, dfp
+from schc_rules import msb_length, computeCDAs, iidCDAs, split_rule, device_iids
+from schc_coap import coap_rules, marker
+from schc_checksum import udp_checksum
+from schc_ruleid import RuleIDCode
+from schc_bits import BitReader
+from schc_codegen import compile_decompressor
+from schc_cache import LRUCache
+from schc_aggr import split
+
+## Communication context
+
+side = 'gateway'     # default for this implementation. Other option is 'end-device'.
+deveui = None           # LoRaWAN identifiers of the device, hex strings as in 'keys' of
+devaddr = None          #  cominit.py and the answers to 'mac get deveui' / 'mac get devaddr'
+appeui = None           #  / 'mac get appeui' (mgdeve, mgdeva, mgape). None if not known
+did = device_iids(deveui, devaddr, appeui)  # device IIDs, used by DevIID/AppIID Rules
+
+if side == 'gateway':
+    di = 'up'
+else:
+    di = 'dw'
+
+
+
+## SCHC Decompressor
+##
+##    Rules are built once, when the Decompressor is created. Each call to decompress()
+##    takes the received SCHC Packet as bytes (padding included) and returns the rebuilt
+##    IPv6 packet as bytes.
+##
+##    The SCHC Packet is read with a BitReader: Rule ID and residue fields come out as
+##    plain ints and the payload is taken as one slice of the received bytes.
+##
+##    Every Rule has a header template built once: the 40-byte header with all not-sent
+##    fields already in place (kept as an integer), plus the fixed size of its residue.
+##    Per packet only the fields carried by the residue are spliced into the template.
+##
+##    With codegen=True (default) every Rule is compiled into its own decompression function
+##    (see schc_codegen.py). codegen=False interprets the Field Descriptions, the rebuilt
+##    packet is the same.
+##
+##    Rules with UDP fields rebuild the UDP header too (48-byte header template).
+##
+##    Computed fields are filled in last (see computed_fields): with compute-length the
+##    payload length is the number of whole bytes left after the residue (+ the UDP
+##    header if the Rule rebuilds it) and the UDP length is the payload length. The UDP
+##    checksum is computed over the rebuilt datagram once the payload is read.
+##
+##    With cache_size > 0 the finished header bytes are kept in an LRU cache keyed on
+##    (Rule ID, residue) - plus the payload length for compute-length Rules - so repeat
+##    senders skip the Rule entirely.
+##
+##    'ruleids' is the RuleIDCode shared with the Compressor (fixed-size Rule IDs by
+##    default), variable-length Rule IDs are resolved with its lookup table.
+##
+##    'iids' are the IIDs of the device the SCHC Packets come from (DevIID/AppIID fields),
+##    they go into the header templates. Use one Decompressor per device with such Rules.
+##
+##    Rules with CoAP fields (see schc_coap.py) rebuild the CoAP header and options from
+##    the residue that follows the IPv6/UDP one; the rest of the packet is the CoAP payload.
+##    The cache is not used for them and decompress_batch goes one packet at a time when
+##    the Rule set has CoAP Rules.
+##
+##    With FPort Rule IDs (FPortCode) the SCHC Packet has no Rule ID, decompress() is given
+##    the FPort of the frame instead. A reassembled SCHC Packet starts with its FPort:
+##    decompress(packet[1:], packet[0]).
+
+class Decompressor(object):
+
+    def __init__(self, rules=None, di=di, codegen=True, cache_size=0, ruleids=None,
+                 iids=did):
+        self.rules = build_rules() if rules is None else compile_mappings(rules)
+        self.di = di
+        self.iids = iids
+        self.ruleids = RuleIDCode.fixed(len(self.rules)) if ruleids is None else ruleids
+        self.fixed = [split_rule(rule)[0] for rule in self.rules]  # IPv6/UDP FDs
+        self.coap = coap_rules(self.rules, di)
+        self.layered = any(c is not None for c in self.coap)
+        self.templates = [None if rid == ncr else header_template(rule, di, iids)
+                          for rid, rule in enumerate(self.fixed)]
+        self.sizes = [hs if rid == ncr else header_size(rule, di)
+                      for rid, rule in enumerate(self.fixed)]
+        self.computed = [dict(computed_fields(rule, di)) for rule in self.fixed]
+        self.codecs = None
+        if codegen:
+            self.codecs = [None if rid == ncr else compile_decompressor(rule, di)
+                           for rid, rule in enumerate(self.fixed)]
+        self.cache = LRUCache(cache_size) if cache_size else None
+        self.batch = None
+
+    def decompress(self, schc, fport=None):
+        r = BitReader(schc)
+
+        ## Identify decompression Rule
+
+        if self.ruleids.ports is None:
+            decrule = self.ruleids.decode(r)    # Rule ID at the start of the SCHC Packet
+        else:
+            decrule = self.ruleids.rule(fport)  # Rule ID is the FPort of the frame
+        if self.coap[decrule] is not None:
+            return self.decompress_coap(r, decrule)
+        size = self.sizes[decrule]          # header bytes rebuilt by the Rule
+        computed = self.computed[decrule]
+
+        if decrule == ncr:
+            # no-compression Rule, the original packet follows the Rule ID
+            hdr = bytes(r.read_bytes(hs))
+        else:
+            template, width = self.templates[decrule]
+            res = r.read(width)             # whole residue at once
+            key = (decrule, res)
+            pdlen = None
+            if PL in computed:
+                pdlen = r.remaining >> 3    # whole bytes left, padding dropped
+                key = (decrule, res, pdlen)
+            hdr = None
+            if self.cache is not None:
+                hdr = self.cache.get(key)
+            if hdr is None:
+                if self.codecs is not None:
+                    hdr = template | self.codecs[decrule](res)
+                else:
+                    hdr = template | self.apply(self.fixed[decrule], res, width)
+                if computed:
+                    hdr = self.lengths(hdr, computed, size, pdlen)
+                hdr = hdr.to_bytes(size, 'big')
+                if self.cache is not None:
+                    self.cache.put(key, hdr)
+
+        ## Add payload - drop padding bits
+
+        pdlen = int.from_bytes(hdr[hfo[PL]//8:(hfo[PL] + hfl[PL])//8], 'big') - (size - hs)
+        payload = r.read_bytes(pdlen)
+        if UC in computed:
+            c = hfo[UC]//8
+            hdr = hdr[:c] + self.checksum(hdr, payload).to_bytes(2, 'big') + hdr[c + 2:]
+        return hdr + payload
+
+    # SCHC Packet of a Rule with CoAP fields: IPv6/UDP residue, CoAP residue, then the
+    # CoAP payload. The payload marker is added back when the payload is not empty
+
+    def decompress_coap(self, r, rid):
+        template, width = self.templates[rid]
+        res = r.read(width)
+        if self.codecs is not None:
+            hdr = template | self.codecs[rid](res)
+        else:
+            hdr = template | self.apply(self.fixed[rid], res, width)
+        message = self.coap[rid].decompress(r)
+        size = self.sizes[rid]
+        computed = self.computed[rid]
+        if PL in computed:
+            pdlen = r.remaining >> 3        # whole bytes left, padding dropped
+            hdr = self.lengths(hdr, computed, size, len(message) + (pdlen + 1 if pdlen else 0))
+        else:
+            hdr = self.lengths(hdr, computed, size, None)
+            pl = (hdr >> (size*8 - hfo[PL] - hfl[PL])) & ((1 << hfl[PL]) - 1)
+            pdlen = max(pl - (size - hs) - len(message) - 1, 0)
+        hdr = hdr.to_bytes(size, 'big')
+        data = message
+        if pdlen:
+            data += bytes(bytearray([marker])) + bytes(r.read_bytes(pdlen))
+        if UC in computed:
+            c = hfo[UC]//8
+            hdr = hdr[:c] + self.checksum(hdr, data).to_bytes(2, 'big') + hdr[c + 2:]
+        return hdr + data
+
+    # Computed length fields, in the header integer of a Rule ('size' bytes). 'pdlen' is
+    # the number of payload bytes after the compressed header
+
+    def lengths(self, hdr, computed, size, pdlen):
+        hbits = size*8
+        if PL in computed:
+            hdr |= (pdlen + size - hs) << (hbits - hfo[PL] - hfl[PL])
+        if UL in computed:
+            pl = (hdr >> (hbits - hfo[PL] - hfl[PL])) & ((1 << hfl[PL]) - 1)
+            hdr |= pl << (hbits - hfo[UL] - hfl[UL])
+        return hdr
+
+    # UDP checksum of the rebuilt datagram, the addresses come from the rebuilt header
+
+    def checksum(self, hdr, payload):
+        sa = int.from_bytes(hdr[8:24], 'big')
+        da = int.from_bytes(hdr[24:40], 'big')
+        return udp_checksum(sa, da, hdr[hs:hs + us], payload)
+
+    # Aggregated frame (aggregation FPort, see schc_aggr.py): the IPv6 packet of every
+    # SCHC Packet in it, in order
+
+    def decompress_frame(self, frame):
+        return [self.decompress(packet) for packet in split(frame)]
+
+    # Burst of SCHC Packets at once, vectorised with NumPy (see schc_batch.py). Returns
+    # one memoryview per packet, all slices of the same contiguous buffer
+
+    def decompress_batch(self, packets, fports=None):
+        if self.layered:
+            if fports is None:
+                fports = [None]*len(packets)
+            return [memoryview(self.decompress(packet, port))
+                    for packet, port in zip(packets, fports)]
+        if self.batch is None:
+            from schc_batch import BatchDecompressor
+            self.batch = BatchDecompressor(self.rules, self.di, self.ruleids, self.iids)
+        return self.batch.decompress_batch(packets, fports)
+
+    # Apply Rule: rebuild the header fields carried by the residue 'res' ('width' bits),
+    # returns them in place in a header integer (not-sent fields come from the template)
+
+    def apply(self, rule, res, width):
+        hbits = header_size(rule, self.di)*8
+        dechdr = 0
+        for fd in rule:
+            #check direction
+            if fd["DI"]!="bi" and fd["DI"]!=self.di:
+                continue                    # if DI not in message direction, skip FD
+            elif fd["FP"]!=dfp:             # else check FP
+                continue                    # if rule's FP doesn't match the field's, skip FD
+            hf = hfi[fd["FID"]]
+            #check CDA
+            if fd["CDA"]=='not-s':
+                continue                                # in the header template
+            elif fd["CDA"] in computeCDAs:
+                continue                                # computed after reconstruction
+            elif fd["CDA"] in iidCDAs:
+                continue                                # in the header template
+            elif fd["CDA"]=='val-s':
+                width -= fd["FL"]                       # FL number of bits
+                decfd = (res >> width) & ((1 << fd["FL"]) - 1)
+            elif fd["CDA"]=='index':
+                indlen = fd["TV"].bits                  # bits used to encode index
+                width -= indlen
+                decfd = fd["TV"][(res >> width) & ((1 << indlen) - 1)]
+            elif fd["CDA"]=='LSB':
+                declen = fd["FL"] - msb_length(fd["MO"])     # LSBs = FL - MSBs (TV length)
+                width -= declen
+                decfd = (res >> width) & ((1 << declen) - 1)     # prefix in the template
+            else:
+                raise ValueError("CDA " + str(fd["CDA"]) + " not supported")
+            dechdr |= decfd << (hbits - hfo[hf] - hfl[hf])
+        return dechdr
+
+
+## Script mode     -SCHC Packet 'loradata' (hex) comes from lorawan-message-up.py
+
+if __name__ == '__main__':
+
+    from binascii import unhexlify
+    from bitstring import Bits as bits
+
+    decompressor = Decompressor(di=di, iids=did)
+
+    ###<RECEIVE SCHC PACKET schcP>
+
+    decpacket = bits(bytes=decompressor.decompress(unhexlify(loradata)))
+
+    #debug
+
+    P = packet = ip6
+
+    ## Verify
+
+    print("Decompressed packet = original packet???")
+
+    result = decpacket == packet
+
+    print(result)
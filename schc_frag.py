@@ -0,0 +1,180 @@
+### SCHC Fragmentation, ACK-on-Error mode  -fragment sender
+
+'''
+##        SCHC Packets longer than the LoRaWAN MTU of the Data Rate (no Rule applies, rule 3,
+##        or a payload too big) are cut into tiles and sent as SCHC Fragments [RFC 8724,
+##        8.4.3] with the LoRaWAN profile of RFC 9011: the fragmentation Rule ID is the FPort
+##        (20 for the uplink), so a fragment is a 1-byte header plus tiles:
+##
+##    +-- ... --+-- W --+---- FCN ----+------ ... ------+
+##    |  FPort  |  [2]  |     [6]     | tiles (10 bytes)|        Regular SCHC Fragment
+##    +-- ... --+-------+-------------+------ ... ------+
+##
+##    +-- ... --+-- W --+---- FCN ----+---- RCS ----+------ ... ------+
+##    |  FPort  |  [2]  |  [6] 111111 |    [32]     |    last tile    |     All-1 Fragment
+##    +-- ... --+-------+-------------+-------------+------ ... ------+
+##
+##        Tiles are numbered in windows of 63, FCN counting down from 62 in every window; a
+##        fragment carries consecutive tiles of one window, its FCN is the one of its first
+##        tile. The All-1 fragment carries the last tile and the RCS (CRC32 of the whole
+##        SCHC Packet). W is the window number, so a SCHC Packet has at most 4 windows.
+##
+##        ACK-on-Error: the receiver only answers (downlink, same FPort) with a SCHC ACK when
+##        a window has missing tiles, and after the All-1 fragment. The ACK bitmap has one
+##        bit per tile of the window (1 = received), trailing 1s are cut down to a byte
+##        boundary. The sender only retransmits the tiles the bitmap reports missing, never
+##        the whole packet, and the All-1 again after the tiles of the last window. When no
+##        ACK comes (class A: a downlink needs an uplink) the sender polls by sending the
+##        All-1 again, up to 8 times, then sends a Sender-Abort.
+##
+##        The sender has no I/O: it returns the fragments (bytes) to send on FPort 'fport'
+##        and is given the ACKs received, see lorawan-message-up.py.
+##
+#'''
+
+## Import statements
+
+import zlib
+
+## ACK-on-Error LoRaWAN profile, uplink [RFC 9011]
+
+fport = 20                      # FPort = fragmentation Rule ID
+wb = windowBits = 2
+fb = fcnBits = 6
+ws = windowSize = 63            # tiles per window, FCN 62..0
+ts = tileSize = 10              # bytes
+all1 = (1 << fb) - 1            # FCN of the All-1 fragment
+mw = maxWindows = 1 << wb
+mar = maxAckRequests = 8
+
+ackBits = wb + 1 + ws           # W - C - bitmap, uncompressed
+
+mtus = {0: 11, 1: 53, 2: 125, 3: 242, 4: 242}   # max application payload per DR, US915
+
+senderAbort = bytes(bytearray([0xff]))          # W and FCN all 1s, no payload
+receiverAbort = bytes(bytearray([0xff, 0xff]))  # W and C all 1s, padding 1s + a 1s byte
+
+
+def rcs(packet):
+    return zlib.crc32(packet) & 0xffffffff
+
+
+def header(w, fcn):
+    return bytes(bytearray([w << fb | fcn]))
+
+
+# W and FCN of a fragment
+
+def fragment_header(data):
+    return data[0] >> fb, data[0] & all1
+
+
+## SCHC ACK  -W, C (1 = RCS correct), compressed bitmap
+
+def ack(w, bitmap=None):
+    # bitmap: list of ws bools (tile received) of window w, None for C = 1
+    if bitmap is None:
+        return bytes(bytearray([w << (8 - wb) | 1 << (7 - wb)]))
+    a = w << (ackBits - wb)
+    for p, received in enumerate(bitmap):
+        if received:
+            a |= 1 << (ws - 1 - p)
+    for n in range(8, ackBits, 8):
+        cut = ackBits - n
+        if a & ((1 << cut) - 1) == (1 << cut) - 1:
+            return (a >> cut).to_bytes(n >> 3, 'big')   # trailing 1s removed
+    n = (ackBits + 7) & ~7
+    return (a << (n - ackBits)).to_bytes(n >> 3, 'big')
+
+
+# (W, bitmap) of a SCHC ACK, bitmap None when C = 1
+
+def parse_ack(data):
+    n = len(data)*8
+    a = int.from_bytes(data, 'big')
+    if n >= ackBits:
+        a >>= n - ackBits
+    else:
+        a = a << (ackBits - n) | ((1 << (ackBits - n)) - 1)
+    w = a >> (ackBits - wb)
+    if (a >> ws) & 1:
+        return w, None
+    return w, [bool((a >> (ws - 1 - p)) & 1) for p in range(ws)]
+
+
+## Sender
+
+class AckOnErrorSender(object):
+
+    def __init__(self, packet, mtu, tile=ts):
+        self.packet = bytes(packet)
+        self.tiles = [self.packet[k:k + tile] for k in range(0, len(self.packet), tile)]
+        self.per = (mtu - 1) // tile                    # tiles per regular fragment
+        if self.per < 1 or mtu < 5 + len(self.tiles[-1]):
+            raise ValueError("MTU too small for the tile size")
+        if len(self.tiles) > mw*ws:
+            raise ValueError("SCHC Packet too long for " + str(mw) + " windows")
+        self.last = len(self.tiles) - 1                 # tile carried by the All-1
+        self.rcs = rcs(self.packet)
+        self.requests = 0
+        self.done = False
+        self.aborted = False
+
+    # Every tile once: regular fragments, then the All-1
+
+    def fragments(self):
+        return self.regular(range(self.last)) + [self.all1()]
+
+    # Regular fragments carrying the given tiles (tile numbers, in order)
+
+    def regular(self, tiles):
+        frags = []
+        run = []
+        for t in tiles:
+            if run and (t != run[-1] + 1 or t // ws != run[0] // ws or len(run) == self.per):
+                frags.append(self.fragment(run))
+                run = []
+            run.append(t)
+        if run:
+            frags.append(self.fragment(run))
+        return frags
+
+    def fragment(self, run):
+        t = run[0]
+        return header(t // ws, ws - 1 - t % ws) + b''.join([self.tiles[k] for k in run])
+
+    def all1(self):
+        return header(self.last // ws, all1) + self.rcs.to_bytes(4, 'big') + self.tiles[self.last]
+
+    # Fragments to send after a SCHC ACK: the missing tiles of its window. For the last
+    # window the All-1 follows, the receiver checks the RCS again and answers
+
+    def on_ack(self, data):
+        if bytes(data[:1]) == receiverAbort[:1]:
+            self.aborted = True
+            return []
+        w, bitmap = parse_ack(data)
+        if bitmap is None:
+            self.done = True                            # RCS correct, packet delivered
+            return []
+        self.requests = 0
+        missing = [w*ws + p for p in range(ws) if not bitmap[p] and w*ws + p <= self.last]
+        if not missing:
+            self.aborted = True                         # all tiles in, RCS still wrong
+            return [senderAbort]
+        frags = self.regular([t for t in missing if t != self.last])
+        if w == self.last // ws:
+            frags.append(self.all1())
+        return frags
+
+    # ACK REQ when no ACK came: the All-1 again, Sender-Abort after mar attempts. A bare
+    # ACK REQ does not say which packet it is about (no DTag): when every fragment of a
+    # packet is lost the receiver would take it for the previous one and answer C = 1.
+    # The RCS of the All-1 tells them apart
+
+    def ack_request(self):
+        self.requests += 1
+        if self.requests > mar:
+            self.aborted = True
+            return senderAbort
+        return self.all1()
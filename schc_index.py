@@ -0,0 +1,137 @@
+### SCHC Rule selection index
+
+'''
+##        Compiles a set of SCHC Rules into an index used by the compressor to find the
+##        candidate Rules for a packet without scanning every Rule.
+##
+##        Rules are grouped by the set of fields they compare with the 'equal' Matching
+##        Operator (their signature). Inside a group, Rules are hashed on the tuple of
+##        Target Values of those fields. Looking a packet up costs one dict access per
+##        group, so it depends on the number of different signatures and not on the
+##        number of Rules. Most Rule sets have a handful of signatures even with hundreds
+##        of Rules.
+##
+##        Rules with MSB(x) fields (address prefixes) are not hashed on that field: the
+##        first MSB(x) field of the Rule is part of the signature, and inside the group the
+##        Rules are stored in a prefix trie keyed on its TV. A lookup walks one path of the
+##        trie and returns every Rule whose prefix the field value falls into, down to the
+##        longest matching prefix, without testing the Rules one by one.
+##
+##        The candidates found still go through the remaining Matching Operators
+##        (ignore / mmap / other MSB fields) before one is selected, see
+##        Compressor.select(). They are returned in the selection order given to the index
+##        (cheapest Rule first, so the longest prefix sending LSBs comes first).
+##
+#'''
+
+## Import statements
+
+from schc_rules import hfi, ncr, dfp, msb_length
+
+
+## Prefix trie  -path-compressed binary trie (radix tree) over the TVs of a MSB(x) field
+##
+##    Every node holds a prefix (value, bits) and the items stored with exactly that prefix.
+##    Nodes only exist where a prefix is stored or where two prefixes part ways, so a
+##    lookup visits at most one node per stored prefix the value falls into.
+
+class _Node(object):
+
+    __slots__ = ('prefix', 'length', 'children', 'items')
+
+    def __init__(self, prefix, length, items=None):
+        self.prefix = prefix
+        self.length = length
+        self.children = [None, None]        # next bit 0 / 1
+        self.items = items or []
+
+
+class PrefixTrie(object):
+
+    def __init__(self, fl):
+        self.fl = fl                        # field length, bits
+        self.root = _Node(0, 0)
+
+    def insert(self, prefix, x, item):
+        node = self.root
+        while node.length != x:
+            bit = (prefix >> (x - node.length - 1)) & 1
+            child = node.children[bit]
+            if child is None:
+                node.children[bit] = _Node(prefix, x, [item])
+                return
+            n = min(child.length, x)
+            common = n - ((child.prefix >> (child.length - n)) ^ (prefix >> (x - n))).bit_length()
+            if common < child.length:
+                # prefixes part ways inside the child's edge, split it
+                mid = _Node(prefix >> (x - common), common)
+                mid.children[(child.prefix >> (child.length - common - 1)) & 1] = child
+                node.children[bit] = mid
+                child = mid
+            node = child
+        node.items.append(item)
+
+    # Items of every stored prefix of 'value', shortest prefix first
+
+    def matches(self, value):
+        found = []
+        fl = self.fl
+        node = self.root
+        while node is not None and value >> (fl - node.length) == node.prefix:
+            found.extend(node.items)
+            if node.length == fl:
+                break
+            node = node.children[(value >> (fl - node.length - 1)) & 1]
+        return found
+
+
+class RuleIndex(object):
+
+    def __init__(self, rules, di, order=None):
+        self.rules = rules
+        self.di = di
+        if order is None:
+            order = [rid for rid in range(len(rules)) if rid != ncr]
+        self.rank = dict((rid, k) for k, rid in enumerate(order))
+        groups = {}             # signature -> { TVs tuple -> [Rule IDs] or PrefixTrie }
+        for rid in order:
+            rule = rules[rid]
+            sig = []
+            key = []
+            prefix = None       # (field index, TV, x, FL) of the first MSB(x) field
+            for fd in rule:
+                if fd["DI"]!="bi" and fd["DI"]!=di:
+                    continue
+                elif fd["FP"]!=dfp:
+                    continue
+                if fd["MO"]=='equal':
+                    sig.append(hfi[fd["FID"]])
+                    key.append(fd["TV"])
+                elif prefix is None and msb_length(fd["MO"]) is not None:
+                    prefix = (hfi[fd["FID"]], fd["TV"], msb_length(fd["MO"]), fd["FL"])
+            if prefix is None:
+                groups.setdefault((tuple(sig), None), {}).setdefault(tuple(key), []).append(rid)
+            else:
+                i, tv, x, fl = prefix
+                table = groups.setdefault((tuple(sig), i), {})
+                table.setdefault(tuple(key), PrefixTrie(fl)).insert(tv, x, rid)
+        self.groups = list(groups.items())
+        # a single group without trie already gives its Rules in selection order
+        self.ordered = len(self.groups) == 1 and self.groups[0][0][1] is None
+
+    # Rule IDs whose 'equal' fields and first MSB(x) field match the field values, in
+    # selection order
+
+    def candidates(self, fvs):
+        found = []
+        for (sig, i), table in self.groups:
+            entry = table.get(tuple([fvs[f] for f in sig]))
+            if entry is None:
+                continue
+            if i is None:
+                found.extend(entry)
+            else:
+                found.extend(entry.matches(fvs[i]))
+        if not self.ordered:
+            found.sort(key=self.rank.__getitem__)
+        return found
@@ -0,0 +1,222 @@
+### SCHC Reassembly, ACK-on-Error mode  -gateway side, in front of the decompressor
+
+'''
+##        Rebuilds the SCHC Packets sent as SCHC Fragments by schc_frag.py and answers with
+##        SCHC ACKs. One reassembly session per (device, fragmentation Rule ID), so thousands
+##        of devices can be fragmenting at the same time.
+##
+##        Memory is bounded:
+##
+##              -  tile slots are preallocated one window at a time (63 tiles), when the
+##                 first fragment of the window arrives; a tile is copied into its slot
+##                 and its bit set in the window bitmap, O(1) per tile
+##              -  'memory' caps the bytes held by all the sessions together. When a new
+##                 window does not fit, stale sessions are dropped first (no fragment for
+##                 'timeout' seconds), then the least recently active ones
+##              -  sessions are kept in activity order, so finding stale sessions only
+##                 looks at the oldest ones
+##
+##        A finished session frees its tiles and only remembers that the packet was
+##        delivered (its RCS and last window), to answer the sender again (C = 1) if the ACK
+##        was lost. There is no DTag in the profile: an All-1 with another RCS, an ACK REQ
+##        for another window or a regular fragment start the next packet of the device.
+##
+##        ACKs (ACK-on-Error): when the last fragment of a window leaves tiles missing, and
+##        for every All-1 or ACK REQ. The bitmap is the one of the first window with missing
+##        tiles. The receiver does not know where the last tile is, so every tile not
+##        received is reported, up to the end of the window: the sender ignores the bits
+##        past its last tile, and sends the All-1 again after the tiles of the last window
+##        (lost tail tiles only show up as a wrong RCS). A session whose RCS keeps failing
+##        without any new tile is aborted.
+##
+##        Usage, for every uplink on the fragmentation FPort:
+##
+##              packet, ack = reassembler.receive(deveui, data)
+##              if ack:     send ack as downlink on the same FPort
+##              if packet:  decompressor.decompress(packet)
+##
+#'''
+
+## Import statements
+
+import time
+from collections import OrderedDict as ordic
+
+from schc_frag import fport, ws, ts, all1, mw, mar, rcs, ack, fragment_header
+from schc_frag import senderAbort, receiverAbort
+
+full = (1 << ws) - 1            # bitmap of a complete window
+
+
+class _Session(object):
+
+    __slots__ = ('windows', 'bitmaps', 'high', 'last', 'rcs', 'fails', 'stamp', 'size', 'done')
+
+    def __init__(self, now):
+        self.windows = [None]*mw        # tile slots of every window, bytearray
+        self.bitmaps = [0]*mw           # bit p set = tile p of the window received
+        self.high = -1                  # highest tile number received
+        self.last = None                # last tile (All-1)
+        self.rcs = None
+        self.fails = 0                  # RCS checks failed since the last new tile
+        self.stamp = now                # last activity
+        self.size = 0                   # bytes held
+        self.done = False
+
+
+class Reassembler(object):
+
+    def __init__(self, memory=1 << 20, timeout=600, tile=ts, clock=time.time):
+        self.memory = memory            # bytes, all sessions together
+        self.timeout = timeout          # seconds without fragments before a session is stale
+        self.tile = tile
+        self.clock = clock
+        self.sessions = ordic()         # (device, rule) -> _Session, least recently active first
+        self.used = 0
+        self.evicted = 0
+        self.expired = 0
+
+    # A fragment received from 'device' on fragmentation Rule 'rule' (FPort). Returns the
+    # reassembled SCHC Packet (or None) and the SCHC ACK to send back (or None)
+
+    def receive(self, device, data, rule=fport, now=None):
+        now = self.clock() if now is None else now
+        self.expire(now)
+        key = (device, rule)
+        data = bytes(data)
+        if data == senderAbort:
+            self.drop(key)
+            return None, None
+        w, fcn = fragment_header(data)
+        s = self.sessions.get(key)
+        if s is not None and s.done:
+            if self.delivered(s, w, fcn, data):
+                s.stamp = now
+                return None, ack(w)         # the C = 1 ACK was lost
+            self.drop(key)                  # next packet
+            s = None
+        if s is None:
+            s = self.sessions[key] = _Session(now)
+        else:
+            self.sessions.move_to_end(key)
+            s.stamp = now
+
+        if fcn == all1:
+            if len(data) < 5:
+                return None, None           # malformed
+            s.rcs = int.from_bytes(data[1:5], 'big')
+            s.last = data[5:]
+            return self.check(key, s, w)
+        elif len(data) == 1:
+            return None, self.bitmap(s, w)  # ACK REQ
+        elif (len(data) - 1) % self.tile:
+            return None, None               # malformed
+        if not self.store(key, s, w, ws - 1 - fcn, data):
+            return None, receiverAbort      # does not fit in memory
+        if (len(data) - 1)//self.tile > fcn:
+            if s.bitmaps[w] != full:
+                return None, self.bitmap(s, w)      # window ended with missing tiles
+        return None, None
+
+    # All-1 or ACK REQ of the packet delivered by a finished session
+
+    def delivered(self, s, w, fcn, data):
+        if fcn == all1:
+            return len(data) >= 5 and int.from_bytes(data[1:5], 'big') == s.rcs
+        return len(data) == 1 and w == s.high // ws
+
+    # Copy the tiles of a regular fragment into their slots
+
+    def store(self, key, s, w, p, data):
+        n = self.tile
+        buf = s.windows[w]
+        if buf is None:
+            if not self.reserve(key, ws*n):
+                self.drop(key)
+                return False
+            buf = s.windows[w] = bytearray(ws*n)
+            s.size += ws*n
+        for k in range(1, len(data), n):
+            if p >= ws:
+                break                       # tiles past the window, malformed
+            buf[p*n:p*n + n] = data[k:k + n]
+            if not (s.bitmaps[w] >> p) & 1:
+                s.fails = 0                 # progress
+            s.bitmaps[w] |= 1 << p
+            s.high = max(s.high, w*ws + p)
+            p += 1
+        return True
+
+    # Bitmap list of window w, True = tile received
+
+    def bits(self, s, w):
+        return [bool((s.bitmaps[w] >> p) & 1) for p in range(ws)]
+
+    # ACK for the first window up to w with missing tiles, bitmap of w if none
+
+    def bitmap(self, s, w):
+        for k in range(w):
+            if s.bitmaps[k] != full:
+                return ack(k, self.bits(s, k))
+        return ack(w, self.bits(s, w))
+
+    # All-1 received: reassemble if every tile up to the last one is in and the RCS is right
+
+    def check(self, key, s, w):
+        hw, hp = divmod(s.high, ws) if s.high >= 0 else (0, -1)
+        for k in range(hw):
+            if s.bitmaps[k] != full:
+                return None, ack(k, self.bits(s, k))
+        mask = (1 << (hp + 1)) - 1
+        if s.bitmaps[hw] & mask != mask:
+            return None, ack(hw, self.bits(s, hw))
+        n = self.tile
+        packet = b''.join([bytes(s.windows[k]) for k in range(hw)])
+        if hp >= 0:
+            packet += bytes(s.windows[hw][:(hp + 1)*n])
+        packet += s.last
+        if rcs(packet) != s.rcs:
+            s.fails += 1
+            if s.fails > mar:
+                self.drop(key)
+                return None, receiverAbort
+            # tail tiles missing: the positions after the highest tile received
+            k = hw + 1 if hp == ws - 1 and hw < w else hw
+            return None, ack(k, self.bits(s, k))
+        self.release(s)
+        s.done = True
+        s.high = w*ws                       # window of the All-1, for delivered()
+        return packet, ack(w)
+
+    ## Memory
+
+    def reserve(self, key, size):
+        while self.used + size > self.memory:
+            oldest = next(iter(self.sessions), None)
+            if oldest is None or oldest == key:
+                return False
+            self.drop(oldest)
+            self.evicted += 1
+        self.used += size
+        return True
+
+    def release(self, s):
+        self.used -= s.size
+        s.size = 0
+        s.windows = [None]*mw
+
+    def drop(self, key):
+        s = self.sessions.pop(key, None)
+        if s is not None:
+            self.release(s)
+
+    # Drop the sessions without activity for 'timeout' seconds, oldest first
+
+    def expire(self, now):
+        while self.sessions:
+            key, s = next(iter(self.sessions.items()))
+            if now - s.stamp < self.timeout:
+                break
+            self.drop(key)
+            if not s.done:
+                self.expired += 1
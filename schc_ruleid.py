@@ -0,0 +1,174 @@
+### SCHC Rule ID codes - fixed or frequency-adaptive (Huffman) Rule IDs
+
+'''
+##        By default a Rule ID is sent with a fixed number of bits, rb = ceil(log(rn,2)).
+##        When a few Rules carry almost all the traffic, prefix-free variable-length Rule
+##        IDs send fewer bits on average: Rules are given Huffman codes from observed or
+##        configured frequencies, the most used Rules get the shortest IDs.
+##
+##        The codes are canonical: they only depend on the code length of every Rule, so
+##        the code table is part of the static context as a plain list of lengths (see
+##        RuleIDCode.lengths / RuleIDCode.from_lengths). Both ends must use the same table.
+##
+##        Decoding does not scan the Rules: the next 'maxlen' bits are used to index a
+##        lookup table when the longest code is short enough, otherwise canonical decoding
+##        walks the code lengths (one dict lookup per length).
+##
+##        FPortCode carries the Rule ID in the LoRaWAN FPort instead, as the SCHC over
+##        LoRaWAN profile does [RFC 9011]: no Rule ID bits in the payload at all. The
+##        Compressor then returns (FPort, SCHC Packet) and the Decompressor is given the
+##        FPort of the frame.
+##
+#'''
+
+## Import statements
+
+import heapq
+
+from schc_rules import rule_bits
+from schc_frag import fport as fragport
+from schc_aggr import dport, aport
+
+maxtable = 12       # longest code decoded with a lookup table, 2**12 entries
+
+fportMin = 1        # application FPorts
+fportMax = 223
+reserved = (dport, fragport, aport)     # plain SCHC Packet, fragments, aggregated frames
+
+
+class RuleIDCode(object):
+
+    ports = None        # Rule IDs in the payload, see FPortCode
+
+    def __init__(self, lengths):
+        self.lengths = list(lengths)            # code length of every Rule ID
+        self.codes = canonical_codes(self.lengths)
+        self.maxlen = max(self.lengths)
+        self.bylen = {}                         # (length, code) -> Rule ID
+        for rid, (code, n) in enumerate(self.codes):
+            self.bylen[(n, code)] = rid
+        self.table = None
+        if self.maxlen <= maxtable:
+            self.table = [None]*(1 << self.maxlen)
+            for rid, (code, n) in enumerate(self.codes):
+                free = self.maxlen - n
+                for tail in range(1 << free):
+                    self.table[(code << free) | tail] = (rid, n)
+
+    @classmethod
+    def fixed(cls, n):
+        rb = rule_bits(n)
+        return cls([rb]*n)
+
+    @classmethod
+    def from_lengths(cls, lengths):
+        return cls(lengths)
+
+    # Huffman code lengths from Rule frequencies (list indexed by Rule ID). Every Rule
+    # gets a code, unused Rules count as seen once
+
+    @classmethod
+    def from_frequencies(cls, freqs):
+        if len(freqs) == 1:
+            return cls([1])
+        heap = [(f + 1, rid, [rid]) for rid, f in enumerate(freqs)]
+        heapq.heapify(heap)
+        lengths = [0]*len(freqs)
+        while len(heap) > 1:
+            w1, t1, s1 = heapq.heappop(heap)
+            w2, t2, s2 = heapq.heappop(heap)
+            for rid in s1 + s2:
+                lengths[rid] += 1
+            heapq.heappush(heap, (w1 + w2, min(t1, t2), s1 + s2))
+        return cls(lengths)
+
+    def encode(self, rid):
+        return self.codes[rid]                  # (code, bits)
+
+    # Read a Rule ID from a BitReader
+
+    def decode(self, r):
+        if self.table is not None:
+            entry = self.table[r.peek(self.maxlen)]
+            if entry is None:
+                raise ValueError("unknown Rule ID")
+            r.skip(entry[1])
+            return entry[0]
+        for n in range(1, self.maxlen + 1):
+            rid = self.bylen.get((n, r.peek(n)))
+            if rid is not None:
+                r.skip(n)
+                return rid
+        raise ValueError("unknown Rule ID")
+
+    # Average Rule ID bits for the given frequencies
+
+    def average(self, freqs):
+        total = float(sum(freqs))
+        return sum(f*n for f, n in zip(freqs, self.lengths)) / total if total else 0.0
+
+
+# Canonical prefix codes: shorter codes first, Rule ID order between equal lengths
+
+def canonical_codes(lengths):
+    codes = [None]*len(lengths)
+    code = 0
+    prev = 0
+    for rid in sorted(range(len(lengths)), key=lambda rid: (lengths[rid], rid)):
+        n = lengths[rid]
+        code <<= n - prev
+        codes[rid] = (code, n)
+        code += 1
+        prev = n
+    if code > (1 << prev):
+        raise ValueError("code lengths do not form a prefix code")
+    return codes
+
+
+## FPort Rule IDs  -the Rule ID is the FPort of the LoRaWAN frame [RFC 9011]
+##
+##    Every Rule gets an FPort. The data, fragmentation and aggregation FPorts are left out,
+##    so an FPort never means both a Rule and one of them.
+##    Aggregation needs Rule IDs in the payload: with FPort Rule IDs every SCHC Packet is
+##    sent in its own frame. A fragmented SCHC Packet carries its FPort as first byte, so
+##    the reassembled packet still says which Rule compressed it.
+
+class FPortCode(object):
+
+    def __init__(self, ports):
+        self.ports = list(ports)                # FPort of every Rule ID
+        self.byport = dict((p, rid) for rid, p in enumerate(self.ports))
+        if len(self.byport) != len(self.ports):
+            raise ValueError("two Rules with the same FPort")
+        for p in self.ports:
+            if not fportMin <= p <= fportMax or p in reserved:
+                raise ValueError("FPort " + str(p) + " can not carry a Rule ID")
+        self.lengths = [0]*len(self.ports)      # no Rule ID bits in the payload
+        self.maxlen = 0
+        self.table = None
+
+    # First n free FPorts
+
+    @classmethod
+    def fixed(cls, n):
+        free = [p for p in range(fportMin, fportMax + 1) if p not in reserved]
+        if n > len(free):
+            raise ValueError("more Rules than FPorts")
+        return cls(free[:n])
+
+    def encode(self, rid):
+        return 0, 0
+
+    # Rule ID of the FPort of a frame
+
+    def rule(self, port):
+        try:
+            return self.byport[int(port)]
+        except KeyError:
+            raise ValueError("no Rule for FPort " + str(port))
+
+    def decode(self, r):
+        raise ValueError("the Rule ID is the FPort of the frame, see FPortCode.rule")
+
+    def average(self, freqs):
+        return 0.0
@@ -0,0 +1,453 @@
+### SCHC static context (Rules) shared by compressor and decompressor
+
+'''
+##        Builds the set of SCHC Rules used by both ends of the LoRaWAN link.
+##
+##        The Rules are the static context of SCHC: they must be known beforehand by the
+##        end-device and by the gateway. Both the compressor (schc_comp.py) and the
+##        decompressor (schc_decomp.py) import them from here, so the context is built
+##        once per process and both sides are guaranteed to use exactly the same values.
+##
+##        A Rule is a list of Field Descriptions (FD). Each FD is an ordered dictionary
+##        with the keys FID/FL/FP/DI/TV/MO/CDA (see schc_comp.py for the full tables).
+##
+#'''
+
+## Import statements
+
+from collections import OrderedDict as ordic
+
+## Defaults
+
+dpl = 40                        # default payload length, bytes
+dsa = int('01'*64, 2)           # default source address      0101...01
+dda = int('10'*64, 2)           # default destination address 1010...10
+
+udp = 17
+nonh = 59
+tcp = 6
+
+## IPv6 fixed header
+
+hs  = headerSize = 40           # bytes
+
+hfid = headerFID = ["v","tc","fl","pl","nh","hl","sa","da"]
+hfl = headerFieldLength = [4, 8, 20, 16, 8, 8, 128, 128]        # all lengths are known
+hfo = headerFieldOffset = [0, 4, 12, 32, 48, 56, 64, 192]       # bit position in header
+
+## UDP header  -right after the IPv6 fixed header when nh = 17 (no extension headers)
+##
+##    Its fields follow the IPv6 ones in the header field tables, with their bit position
+##    counted from the start of the IPv6 header. A Rule with UDP Field Descriptions
+##    compresses both headers (hs + us bytes) and only applies to UDP packets, the other
+##    Rules leave the UDP header in the payload.
+
+us  = udpHeaderSize = 8         # bytes
+
+ufid = udpFID = ["sp","dp","ul","uc"]           # ports, length, checksum
+ufl = udpFieldLength = [16, 16, 16, 16]
+ufo = udpFieldOffset = [320, 336, 352, 368]
+
+hfid = hfid + ufid
+hfl = hfl + ufl
+hfo = hfo + ufo
+
+#easy header field indexes
+
+V  = 0
+TC = 1
+FL = 2
+PL = 3
+NH = 4
+HL = 5
+SA = 6
+DA = 7
+SP = 8
+DP = 9
+UL = 10
+UC = 11
+CM = 12     # parsed CoAP message (schc_coap.parse), after the header field values
+
+hfi = headerFieldIndex = dict(zip(hfid, range(len(hfid))))     # "v" -> V, "tc" -> TC, ...
+
+## CoAP header and options  -UDP payload of CoAP messages [RFC 7252], see schc_coap.py
+##
+##    CoAP fields have no fixed position: the token is TKL bytes long and the options are
+##    delta-encoded, so they are not in the header field tables above. They are described
+##    with the same FDs, after the UDP ones. Token and option values are byte strings of
+##    variable length: FL 'var', TV as bytes. An option FID is the option name, or
+##    'opt<number>' for the options not in the table. A repeated option (the segments of
+##    a Uri-Path...) has one FD per occurrence, FP being the occurrence (1 = first).
+
+cs  = coapHeaderSize = 4        # bytes, before the token
+
+cfid = coapFID = ["cver","ctype","ctkl","ccode","cmid","ctok"]
+cfl = coapFieldLength = [2, 2, 4, 8, 16, "var"]
+
+var = "var"                     # FL of a variable-length field, in bytes
+
+coapOptions = {"if-match": 1, "uri-host": 3, "etag": 4, "if-none-match": 5, "observe": 6,
+               "uri-port": 7, "location-path": 8, "uri-path": 11, "content-format": 12,
+               "max-age": 14, "uri-query": 15, "accept": 17, "location-query": 20,
+               "block2": 23, "block1": 27, "size2": 28, "proxy-uri": 35, "proxy-scheme": 39,
+               "size1": 60}
+coapOptionFID = dict((n, fid) for fid, n in coapOptions.items())
+
+
+def option_number(fid):
+    # option number of an option FID, None for any other field
+    n = coapOptions.get(fid)
+    if n is None and fid.startswith("opt") and fid[3:].isdigit():
+        n = int(fid[3:])
+    return n
+
+
+def option_fid(number):
+    return coapOptionFID.get(number) or "opt" + str(number)
+
+
+# Field Descriptions of the fixed-position headers (IPv6, UDP) and of the CoAP message
+
+def split_rule(rule):
+    return ([fd for fd in rule if fd["FID"] in hfi],
+            [fd for fd in rule if fd["FID"] not in hfi])
+
+
+## Common case
+
+htv = headerTargetValue = [6, 0, 0, dpl, udp, 200, [dsa], [dda]]
+hmo = headerMatchingOperator = ["equal"]*3 + ["ignore"] + ["equal"]*2 + ["mmap"]*2
+hcda = headerCompDecompAct = ["not-s"]*3 + ["comp-l"] + ["not-s"]*2 + ["index"]*2
+
+utv = udpTargetValue = [0, 0, 0, 0]
+umo = udpMatchingOperator = ["ignore"]*4
+ucda = udpCompDecompAct = ["val-s"]*2 + ["comp-l", "comp-c"]
+
+#*NOTE: TVs CAN NOT be based on ANY packet-to-send field, they are fixed and must be known
+# (included in a static shared Rule) by both ends beforehand
+
+## Rules
+
+rn = rulesNumber  = 4
+fn = fieldsNumber = 8   # lines per Rule, 8 fields in IPv6 header
+ufn = udpFieldsNumber = 4       # + 4 lines for the UDP header
+
+ncr = noCompressionRule = 3     # Rule ID sent when no other Rule applies
+
+dfp = defaultFieldPosition = 1
+
+
+def rule_bits(n):
+    # bits needed to represent n Rule IDs, same as ceil(log(n,2)) without float rounding
+    return (n - 1).bit_length()
+
+rb = ruleBits = rule_bits(rn)
+
+
+## Mapping tables  -TV of match-mapping (mmap) fields
+##
+##    The TV list is compiled once into a value -> index dict, so matching a field and
+##    finding its index costs one hash lookup whatever the size of the list (thousands of
+##    known peer addresses). The table is still an indexed sequence: decompression gets
+##    TV[index] directly. The index is sent with ceil(log(n,2)) bits.
+
+class MappingTable(tuple):
+
+    def __new__(cls, values):
+        self = tuple.__new__(cls, values)
+        self.lookup = {}
+        for i, v in enumerate(self):
+            self.lookup.setdefault(v, i)        # first occurrence wins, as list.index
+        self.bits = rule_bits(len(self))
+        return self
+
+    def __contains__(self, value):
+        return value in self.lookup
+
+    def index(self, value):
+        try:
+            return self.lookup[value]
+        except KeyError:
+            raise ValueError(str(value) + " is not in the mapping table")
+
+
+def mapping_table(tv):
+    return tv if isinstance(tv, MappingTable) else MappingTable(tv)
+
+
+# bits used to send an index into the TV list
+
+def index_bits(tv):
+    return tv.bits if isinstance(tv, MappingTable) else rule_bits(len(tv))
+
+
+# Replace the TV list of every mapping field by its MappingTable. Done when Rules are
+# loaded, calling it again does nothing
+
+def compile_mappings(rules):
+    for rule in rules:
+        for fd in rule:
+            if fd["MO"]=='mmap' or fd["CDA"]=='index':
+                fd["TV"] = mapping_table(fd["TV"])
+    return rules
+
+
+## Computed fields
+##
+##    'comp-l' (compute-length) and 'comp-c' (compute-checksum) fields are elided by the
+##    compressor and computed by the decompressor once the rest of the packet is rebuilt.
+##    The payload length comes from the size of the received SCHC Packet: the payload is
+##    all the whole bytes after the residue (padding is less than a byte), so a packet
+##    must be alone in its frame. The UDP length is the IPv6 payload length, the UDP
+##    checksum is computed over the rebuilt datagram (see schc_checksum.py).
+##
+##    The compressor only elides them when the decompressor will get the same value back:
+##    UDP length equal to the IPv6 payload length and a valid UDP checksum.
+
+computeCDAs = ('comp-l', 'comp-c')
+lengthFIDs = ("pl", "ul")       # header fields a length can be computed for
+checksumFIDs = ("uc",)          # header fields a checksum can be computed for
+
+
+def computed_fields(rule, di):
+    # (field index, CDA) of the fields the decompressor has to compute
+    return [(hfi[fd["FID"]], fd["CDA"]) for fd in rule
+            if applies(fd, di) and fd["CDA"] in computeCDAs]
+
+
+## DevIID / AppIID  -interface IDs built from the LoRaWAN identifiers
+##
+##    The 64 LSBs (IID) of an address can be elided when both ends know the LoRaWAN
+##    identifiers of the device: DevIID comes from its DevEUI (or its DevAddr when the
+##    DevEUI is not known) and AppIID from the AppEUI of the application. They are given
+##    to the Compressor/Decompressor of a device as a dict, see device_iids(). The FD uses
+##    MO 'MSB(FL-64)' with the prefix as TV, e.g. 'MSB(64)' for an address; the Rule only
+##    applies when the IID of the packet is the one built from the identifiers.
+
+iidCDAs = ('DevIID', 'AppIID')
+iidBits = 64
+
+
+def eui_iid(eui):
+    # modified EUI-64 (RFC 4291): EUI-64 with the universal/local bit inverted
+    return eui ^ (1 << 57)
+
+
+def devaddr_iid(devaddr):
+    # 32-bit DevAddr in the low half, local scope
+    return devaddr
+
+
+# IIDs of a device. Identifiers are ints or hex strings, as returned by 'mac get deveui'
+# and the like (see cominit.py: mgdeve, mgdeva, mgape)
+
+def device_iids(deveui=None, devaddr=None, appeui=None):
+    def uint(v):
+        return int(v, 16) if isinstance(v, str) else v
+    iids = {}
+    if deveui is not None:
+        iids['DevIID'] = eui_iid(uint(deveui))
+    elif devaddr is not None:
+        iids['DevIID'] = devaddr_iid(uint(devaddr))
+    if appeui is not None:
+        iids['AppIID'] = eui_iid(uint(appeui))
+    return iids
+
+
+# IID a DevIID/AppIID field stands for, error if the identifiers were not given
+
+def iid_value(fd, iids):
+    if msb_length(fd["MO"]) != fd["FL"] - iidBits:
+        raise ValueError(fd["CDA"] + " needs the MO 'MSB(" + str(fd["FL"] - iidBits) + ")'")
+    if not iids or fd["CDA"] not in iids:
+        raise ValueError(fd["CDA"] + " needs the LoRaWAN identifiers of the device")
+    return iids[fd["CDA"]]
+
+
+## MSB(x) Matching Operator and LSB action  -prefix fields (addresses)
+##
+##    The MO of a prefix field is written 'MSB(x)', x being the number of most significant
+##    bits compared, e.g. 'MSB(64)' for a /64 prefix. TV holds only those x bits, as an
+##    x-bit uint. With the LSB CDA the other FL - x bits are sent (the interface ID of an
+##    address); not-sent is only possible when x covers the whole field.
+
+def msb_length(mo):
+    # x of an 'MSB(x)' MO, None for any other MO
+    if not mo.startswith('MSB('):
+        return None
+    return int(mo[4:-1])
+
+
+def msb(x, fl, fv, tv):
+    # True if the x MSBs of FV (FL bits long) are TV
+    return fv >> (fl - x) == tv
+
+
+def lsb(n, fv):
+    # n LSBs of FV
+    return fv & ((1 << n) - 1)
+
+
+def field_description(fid, fl, tv, mo="ignore", cda="not-s", fp=dfp, di="up"):
+    return ordic([
+        ("FID", fid),       # identifies header field
+        ("FL" , fl),        # length of the field
+        ("FP" , fp),        # position of the field occurence within the header
+        ("DI" , di),        # direction of communication  up/dw/bi
+        ("TV" , tv),        # value used for comparison with FV
+        ("MO" , mo),        # method of comparison
+        ("CDA", cda),       # action taken if Rule is selected
+    ])
+
+
+def build_rules():
+    rules = []
+
+    #rule 0     *ideal* = all context is fully known
+
+    #known:     v - tc - fl - pl - nh - hl - sa - da
+
+    rules.append([field_description(hfid[i], hfl[i], htv[i]) for i in range(fn)])
+    rules[0][PL].update(TV= dpl , MO='equal', CDA='not-s')      # default payload size
+    rules[0][NH].update(TV= nonh, MO='equal', CDA='not-s')      # not UDP
+    rules[0][HL].update(TV= 200 , MO='equal', CDA='not-s')
+    rules[0][SA].update(TV= dsa , MO='equal', CDA='not-s')      # default source address
+    rules[0][DA].update(TV= dda , MO='equal', CDA='not-s')      # default destin address
+
+    #rule 1     -ready == common case, UDP
+
+    #known:     v - tc - fl - nh - hl
+    #fromset:   sa - da
+    #computed:  pl - udp length - udp checksum
+    #unknown:   udp ports
+
+    rules.append([field_description(hfid[i], hfl[i], htv[i], hmo[i], hcda[i])
+                  for i in range(fn)])
+    rules[1] += [field_description(ufid[i], ufl[i], utv[i], umo[i], ucda[i])
+                 for i in range(ufn)]
+
+    #rule 2     -allow unknown addresses + unknown hop limits + known set of next headers
+
+    #known:     v - tc - fl
+    #fromset:   nh
+    #computed:  pl
+    #unknown:   hl - sa - da
+
+    rules.append([field_description(hfid[i], hfl[i], htv[i], hmo[i], hcda[i])
+                  for i in range(fn)])
+    rules[2][NH].update(TV= [udp,nonh,tcp], MO='mmap',   CDA='index')
+    rules[2][HL].update(TV= 200           , MO='ignore', CDA='val-s')
+    rules[2][SA].update(TV= dsa           , MO='ignore', CDA='val-s')
+    rules[2][DA].update(TV= dda           , MO='ignore', CDA='val-s')
+
+    #rule 3     -no compression possible
+
+    rules.append([field_description(hfid[i], hfl[i], htv[i], hmo[i], hcda[i], di='dw')
+                  for i in range(fn)])      # force failure
+
+    return compile_mappings(rules)
+
+
+def applies(fd, di):
+    # FD is used for this direction and field position
+    return (fd["DI"]=="bi" or fd["DI"]==di) and fd["FP"]==dfp
+
+
+# Bytes of header compressed by a Rule: IPv6 fixed header, + UDP header if the Rule has
+# UDP Field Descriptions
+
+def header_size(rule, di):
+    for fd in rule:
+        if applies(fd, di) and fd["FID"] in ufid:
+            return hs + us
+    return hs
+
+
+# Indexes of the header fields in the first 'size' bytes
+
+def header_fields(size):
+    return [i for i in range(len(hfid)) if hfo[i] < size*8]
+
+
+# Decompression template of a Rule: the header (header_size bytes) as an integer with
+# every not-sent field already in place, and the size in bits of the residue the Rule
+# expects. 'iids' are the device IIDs for DevIID/AppIID fields (device_iids)
+
+def header_template(rule, di, iids=None):
+    size = header_size(rule, di)
+    template = 0
+    width = 0
+    done = set()
+    for fd in rule:
+        if not applies(fd, di):
+            continue
+        i = hfi[fd["FID"]]
+        done.add(i)
+        shift = size*8 - hfo[i] - hfl[i]
+        x = msb_length(fd["MO"])
+        if fd["CDA"]=='not-s':
+            if x is not None and x != fd["FL"]:
+                raise ValueError("not-sent with " + fd["MO"] + " leaves LSBs unknown")
+            template |= fd["TV"] << shift
+        elif fd["CDA"]=='val-s':
+            width += fd["FL"]
+        elif fd["CDA"]=='index':
+            width += index_bits(fd["TV"])
+        elif fd["CDA"]=='LSB':
+            if x is None:
+                raise ValueError("LSB needs an MSB(x) Matching Operator")
+            template |= fd["TV"] << (shift + fd["FL"] - x)    # prefix, LSBs come from residue
+            width += fd["FL"] - x
+        elif fd["CDA"] in iidCDAs:
+            template |= (fd["TV"] << iidBits | iid_value(fd, iids)) << shift
+        elif fd["CDA"]=='comp-l':
+            if fd["FID"] not in lengthFIDs:
+                raise ValueError("compute-length only applies to a length field")
+        elif fd["CDA"]=='comp-c':
+            if fd["FID"] not in checksumFIDs:
+                raise ValueError("compute-checksum only applies to a checksum field")
+        else:
+            raise ValueError("CDA " + str(fd["CDA"]) + " not supported")
+    if done != set(header_fields(size)):
+        raise ValueError("Rule does not rebuild every header field")
+    return template, width
+
+
+# Residue bits of the CoAP Field Descriptions of a Rule. Variable-length values count
+# only their length prefix (token: nothing, its length is TKL)
+
+def coap_residue_bits(fds, di):
+    bits = 0
+    for fd in fds:
+        if fd["DI"]!="bi" and fd["DI"]!=di:
+            continue
+        x = msb_length(fd["MO"])
+        if fd["CDA"]=='val-s':
+            if fd["FL"]!=var:
+                bits += fd["FL"]
+            elif fd["FID"]!="ctok":
+                bits += 4
+        elif fd["CDA"]=='index':
+            bits += index_bits(fd["TV"])
+        elif fd["CDA"]=='LSB' and x is not None:
+            bits += 4 if fd["FL"]==var else fd["FL"] - x
+    return bits
+
+
+# Rule IDs in selection order: smallest Rule ID + residue first, Rule order between equal
+# sizes. The headers a Rule does not compress stay in the payload and count as residue
+# (UDP header, the 4 fixed bytes of a CoAP header), so Rules covering more layers are
+# compared fairly; CoAP residues of variable-length values are estimated (see
+# coap_residue_bits). 'idlen' gives the Rule ID bits of every Rule (variable-length Rule
+# IDs), by default they all have the same size. The no-compression Rule is left out
+
+def selection_order(rules, di, idlen=None, iids=None):
+    cost = {}
+    for rid, rule in enumerate(rules):
+        if rid == ncr:
+            continue
+        fixed, coap = split_rule(rule)
+        bits = header_template(fixed, di, iids)[1] + (hs + us - header_size(fixed, di))*8
+        bits += coap_residue_bits(coap, di) if coap else cs*8
+        cost[rid] = bits + (idlen[rid] if idlen else 0)
+    return sorted(cost, key=lambda rid: (cost[rid], rid))
@@ -0,0 +1,300 @@
+### SCHC library tests  -round trips through every stage of the SCHC library
+
+'''
+##        Every test sends synthetic packets through the library (compressor / decompressor,
+##        Rule ID codes, fragment sender / reassembler, aggregation) and checks that the
+##        original comes back. Runs with pytest, or on its own:
+##
+##        Usage:   python test_schc.py
+##
+#'''
+
+## Import statements
+
+import os
+import random
+import struct
+
+from schc_rules import build_rules, field_description, hfid, hfl, htv, hmo, hcda
+from schc_rules import dsa, dda, udp, us, NH, SA, DA, fn, device_iids
+from schc_checksum import udp_checksum
+from schc_comp import Compressor
+from schc_decomp import Decompressor
+from schc_ruleid import RuleIDCode, FPortCode
+from schc_bits import BitReader
+from schc_frag import AckOnErrorSender, mtus, mw, ws, ts, mar, ack, receiverAbort, fport
+from schc_reasm import Reassembler
+from schc_aggr import aggregate, split, aport, dport
+from devmanager import DeviceManager
+
+icmp = 58
+
+## Synthetic packets and Rules
+
+
+def ipv6_packet(pl=40, nh=udp, hl=200, sa=dsa, da=dda):
+    hdr = struct.pack('>IHBB', 6 << 28, pl, nh, hl)
+    payload = os.urandom(pl)
+    if nh == udp:
+        udph = struct.pack('>HHH', 5683, 5683, pl)
+        c = udp_checksum(sa, da, udph, payload[us:])
+        payload = udph + struct.pack('>H', c) + payload[us:]
+    return hdr + sa.to_bytes(16, 'big') + da.to_bytes(16, 'big') + payload
+
+
+# Default Rules + one Rule per device for ICMPv6, source address known (equal / not-sent)
+
+def device_rules(n):
+    rules = build_rules()
+    for k in range(len(rules), n):
+        rules.append([field_description(hfid[i], hfl[i], htv[i], hmo[i], hcda[i])
+                      for i in range(fn)])
+        rules[k][NH].update(TV= icmp)
+        rules[k][SA].update(TV= dsa + k, MO='equal', CDA='not-s')
+    return rules
+
+
+def round_trip(compressor, decompressor, packets):
+    for packet in packets:
+        assert decompressor.decompress(compressor.compress(packet)) == packet
+
+
+## Rule IDs  -Huffman codes from the Rule counts (schc_ruleid.py)
+
+def test_huffman_ruleids():
+    rules = device_rules(40)
+    hot = 39
+    packets = [ipv6_packet(nh=icmp, sa=dsa + hot) for k in range(90)]
+    packets += [ipv6_packet(nh=icmp, sa=dsa + 4 + k) for k in range(35)]
+    packets += [ipv6_packet(), ipv6_packet(hl=7, sa=dsa + 1)]
+    fixed = Compressor(rules)
+    for packet in packets:
+        fixed.compress(packet)
+    assert fixed.counts[hot] == 90
+    code = RuleIDCode.from_frequencies(fixed.counts)
+    assert code.lengths[hot] == min(code.lengths)
+    assert code.average(fixed.counts) < fixed.ruleids.average(fixed.counts)
+    assert code.table is not None
+    round_trip(Compressor(rules, ruleids=code), Decompressor(rules, ruleids=code), packets)
+    round_trip(Compressor(rules, ruleids=code, codegen=False),
+               Decompressor(rules, ruleids=code, codegen=False), packets)
+
+
+# More Rules than the lookup table holds (codes longer than maxtable bits): canonical
+# decoding
+
+def test_huffman_ruleids_canonical():
+    n = 5000
+    rules = device_rules(n)
+    counts = [0]*n
+    counts[n - 1] = 10*n
+    code = RuleIDCode.from_frequencies(counts)
+    assert code.table is None and code.lengths[n - 1] == 1
+    packets = [ipv6_packet(nh=icmp, sa=dsa + k) for k in (4, 5, 2500, n - 2, n - 1)]
+    packets += [ipv6_packet()]
+    compressor = Compressor(rules, ruleids=code)
+    round_trip(compressor, Decompressor(rules, ruleids=code), packets)
+    assert compressor.counts[2500] == 1 and compressor.counts[n - 1] == 1
+
+
+def test_ruleid_prefix_code():
+    try:
+        RuleIDCode.from_lengths([1, 1, 2])
+        assert False, "lengths that are not a prefix code accepted"
+    except ValueError:
+        pass
+    for lengths in ([1, 2], [1, 2, 13]):        # lookup table, canonical decoding
+        code = RuleIDCode.from_lengths(lengths)
+        assert code.decode(BitReader(b'\x80\x00')) == 1
+        try:
+            code.decode(BitReader(b'\xff\xff'))
+            assert False, "unknown Rule ID decoded"
+        except ValueError:
+            pass
+
+
+# Rule ID in the FPort (FPortCode): compress() gives (FPort, SCHC Packet), the gateway
+# decompresses with the FPort of the frame. A fragmented packet carries its FPort as first
+# byte (DeviceManager.framed), stripped after reassembly
+
+def test_fport_ruleids():
+    rules = build_rules()
+    code = FPortCode.fixed(len(rules))
+    assert not set(code.ports) & set([dport, fport, aport])
+    compressor = Compressor(rules, ruleids=code)
+    decompressor = Decompressor(rules, ruleids=code)
+    packets = [ipv6_packet(), ipv6_packet(hl=7, sa=dsa + 1), ipv6_packet(nh=icmp)]
+    for packet in packets:
+        port, schc = compressor.compress(packet)
+        assert port == code.ports[compressor.rid]
+        assert decompressor.decompress(schc, port) == packet
+    assert len(set(code.ports[rid] for rid, n in enumerate(compressor.counts) if n)) == 3
+
+    packet = ipv6_packet(pl=400)
+    port, schc = compressor.compress(packet)
+    assert len(schc) > mtus[3]
+    manager = DeviceManager([], log={})
+    frag, received = transfer(manager.framed(port, schc), mtus[3], Reassembler(), 0,
+                              random.Random(1))
+    assert frag.done and received[0] == port
+    assert decompressor.decompress(received[1:], received[0]) == packet
+    try:
+        FPortCode([2, dport])
+        assert False, "data FPort taken for a Rule ID"
+    except ValueError:
+        pass
+
+
+## DevIID / AppIID  -address IIDs rebuilt from the LoRaWAN identifiers
+
+deveui = '0004A30B001C0530'
+appeui = '70B3D57ED0000001'
+
+
+# Rule 1 with the source and destination IIDs elided: DevIID / AppIID, /64 prefixes known
+
+def iid_rules():
+    rules = build_rules()
+    rule = build_rules()[1]
+    rule[SA].update(TV= dsa >> 64, MO='MSB(64)', CDA='DevIID')
+    rule[DA].update(TV= dda >> 64, MO='MSB(64)', CDA='AppIID')
+    return rules + [rule]
+
+
+def test_device_iids():
+    rules = iid_rules()
+    rid = len(rules) - 1
+    for iids in (device_iids(deveui=deveui, appeui=appeui),
+                 device_iids(devaddr='26011BDA', appeui=appeui)):
+        sa = dsa >> 64 << 64 | iids['DevIID']
+        da = dda >> 64 << 64 | iids['AppIID']
+        packets = [ipv6_packet(sa=sa, da=da) for k in range(10)]
+        for codegen in (True, False):
+            compressor = Compressor(rules, codegen=codegen, iids=iids)
+            round_trip(compressor, Decompressor(rules, codegen=codegen, iids=iids), packets)
+            assert compressor.counts[rid] == len(packets)
+        compressor.compress(ipv6_packet(sa=dsa >> 64 << 64 | 1, da=da))
+        assert compressor.rid != rid                # another device
+    try:
+        Compressor(rules)
+        assert False, "DevIID Rule without the identifiers of the device"
+    except ValueError:
+        pass
+
+
+## Fragmentation  -ACK-on-Error sender (schc_frag.py) to reassembler (schc_reasm.py)
+
+# SCHC Fragments of 'packet' from the sender to the reassembler over a link losing a
+# fraction 'loss' of the frames, both ways. Returns the sender and the packet reassembled
+
+def transfer(packet, mtu, reassembler, loss, rnd, device=b'dev'):
+    frag = AckOnErrorSender(packet, mtu)
+    fragments = frag.fragments()
+    received = None
+    while not (frag.done or frag.aborted):
+        if not fragments:
+            fragments.append(frag.ack_request())
+        data = fragments.pop(0)
+        if rnd.random() < loss:
+            continue
+        packet, ack = reassembler.receive(device, data)
+        if packet is not None:
+            received = packet
+        if ack is not None and rnd.random() >= loss:
+            fragments.extend(frag.on_ack(ack))
+    return frag, received
+
+
+# Every packet through at 10% loss. At 30% the sender may abort, but never believes a
+# packet delivered when it is not. Packets follow each other on the same device; the
+# lossy one is another device, a Sender-Abort lost on the way leaves its session until
+# the reassembler timeout (no DTag)
+
+def test_fragmentation():
+    rnd = random.Random(1)
+    sizes = [1, 9, 10, 11, 242, ws*ts, ws*ts + 1, mw*ws*ts]
+    sizes += [rnd.randrange(1, mw*ws*ts) for k in range(40)]
+    for dr in (1, 2, 3):
+        reassembler = Reassembler()
+        for size in sizes:
+            packet = os.urandom(size)
+            frag, received = transfer(packet, mtus[dr], reassembler, 0.1, rnd)
+            assert frag.done and received == packet, (dr, size)
+            packet = os.urandom(size)
+            frag, received = transfer(packet, mtus[dr], reassembler, 0.3, rnd, b'lossy')
+            assert not frag.done or received == packet, (dr, size)
+
+
+# Devices fragmenting at the same time within the memory cap, least recently active
+# session evicted past it, stale sessions expired, a session whose RCS keeps failing
+# aborted, the C = 1 ACK sent again when it was lost
+
+def test_reassembly():
+    window = ws*ts
+    reassembler = Reassembler(memory=100*window, timeout=600, clock=lambda: 0)
+    packets = [os.urandom(window + 1) for k in range(100)]
+    senders = [AckOnErrorSender(p, mtus[3]).fragments() for p in packets]
+    received = {}
+    for k in range(max(len(f) for f in senders)):
+        for device, fragments in enumerate(senders):
+            if k < len(fragments):
+                packet, ack_ = reassembler.receive(device, fragments[k], now=k)
+                if packet is not None:
+                    received[device] = packet
+    assert received == dict(enumerate(packets)) and reassembler.evicted == 0
+    assert reassembler.used == 0
+
+    reassembler = Reassembler(memory=3*window, timeout=600, clock=lambda: 0)
+    firsts = [AckOnErrorSender(os.urandom(window), mtus[3]).fragments()[0] for k in range(4)]
+    for device, fragment in enumerate(firsts):
+        reassembler.receive(device, fragment, now=device)
+    assert reassembler.evicted == 1 and 0 not in [d for d, r in reassembler.sessions]
+    assert reassembler.used == 3*window
+    reassembler.receive(9, firsts[0], now=700)
+    assert reassembler.expired == 3 and list(reassembler.sessions) == [(9, 20)]
+
+    reassembler = Reassembler(clock=lambda: 0)
+    fragments = AckOnErrorSender(os.urandom(100), mtus[3]).fragments()
+    reassembler.receive(1, fragments[0])
+    wrong = fragments[-1][:1] + bytes(4) + fragments[-1][5:]        # All-1, wrong RCS
+    answers = [reassembler.receive(1, wrong)[1] for k in range(mar + 1)]
+    assert answers[-1] == receiverAbort and receiverAbort not in answers[:-1]
+    assert not reassembler.sessions and reassembler.used == 0
+    for fragment in fragments:
+        packet, ack_ = reassembler.receive(1, fragment)
+    assert packet is not None and ack_ == ack(0)
+    assert reassembler.receive(1, fragments[-1]) == (None, ack(0))    # C = 1 ACK lost
+
+
+## Aggregation  -several SCHC Packets per LoRaWAN frame (schc_aggr.py)
+
+# split(aggregate(packets)) gives the packets back in order, aggregated frames within the
+# MTU, a frame cut inside a packet refused
+
+def test_aggregation():
+    rnd = random.Random(1)
+    packets = [os.urandom(rnd.choice([1, 2, 5, 10, 20, 60, 130, 250, 256, 300]))
+               for k in range(2000)]
+    for mtu in sorted(set(mtus.values())):
+        frames = aggregate(packets, mtu)
+        back = []
+        for port, data in frames:
+            if port == aport:
+                assert len(data) <= mtu and len(split(data)) > 1
+                back.extend([bytes(p) for p in split(data)])
+            else:
+                back.append(data)
+        assert back == packets, mtu
+        try:
+            split([data for port, data in frames if port == aport][0][:-1])
+            assert False, "frame cut inside a packet not detected"
+        except ValueError:
+            pass
+
+
+if __name__ == '__main__':
+
+    for name, test in sorted(globals().items()):
+        if name.startswith('test_'):
+            test()
+            print(name + "  ok")
@@ -0,0 +1,196 @@
+### LoRaWAN transmit queue  -priorities, time-on-air, duty cycle and airtime budgets
+
+'''
+##        Uplinks go through one queue in front of the RN2903 driver (rn2903.py). The queue
+##        sends the most urgent frame first (lowest priority number, then in order) and
+##        paces 'mac tx' so the module never has to refuse a frame:
+##
+##              -  time-on-air of every frame from its size and the spreading factor /
+##                 bandwidth of the data rate [Semtech AN1200.13]
+##              -  regional limits: duty cycle (off time = airtime * (1/duty - 1) after
+##                 every uplink, EU868) or dwell time (max airtime of one frame, US915)
+##              -  daily airtime budget of the device over a sliding 24 h window (network
+##                 fair-use policies), None for no budget
+##
+##        A frame the module refuses anyway (busy, no_free_ch) goes back in the queue and
+##        is tried again after 'retry' seconds.
+##
+##        The pacing state (end of the duty-cycle off time, airtime of the last day) is kept
+##        per device in a local file when the queue is given a StateCache ('log') and the
+##        hardware EUI of the module ('key'), so it carries over from one run of the scripts
+##        to the next. Without it the budget only counts the uplinks of the process. Times
+##        are wall-clock (time.time) for that reason.
+##
+##        Usage:
+##
+##              queue = TxQueue(radio, dr=3, budget=30, log=StateCache(airtimefile), key=eui)
+##              task = asyncio.ensure_future(queue.run())
+##              status, port, data = await queue.send(1, schcbytes, priority=high)
+##
+#'''
+
+## Import statements
+
+import asyncio
+import heapq
+import math
+import os
+import time
+from collections import deque
+
+from rn2903 import busy, txok, rx, macerr
+
+## Radio parameters
+
+overhead = 13           # MHDR, FHDR (no FOpts), FPort, MIC: bytes on air besides the payload
+preamble = 8            # symbols
+cr = 1                  # coding rate 4/5
+
+datarates = {           # US915 uplink: DR -> (SF, bandwidth Hz)
+    0: (10, 125000),
+    1: (9, 125000),
+    2: (8, 125000),
+    3: (7, 125000),
+    4: (8, 500000),
+}
+
+regions = {             # (duty cycle, dwell time s), None = no limit
+    'US915': (None, 0.4),
+    'EU868': (0.01, None),
+}
+region = 'US915'
+
+day = 86400
+airtimefile = os.path.join(os.path.expanduser('~'), '.rn2903-airtime.json')
+retry = 1               # seconds before a refused frame is tried again
+refused = (busy, 'no_free_ch')
+transmitted = (txok, rx, macerr)       # mac_err: sent, no ACK received
+
+high = 0                # priorities, lower goes first
+normal = 1
+low = 2
+
+
+# Time-on-air (seconds) of a frame with 'size' bytes of FRMPayload at data rate 'dr'
+
+def airtime(size, dr):
+    sf, bw = datarates[dr]
+    tsym = float(1 << sf)/bw
+    de = 1 if tsym > 0.016 else 0                   # low data rate optimisation
+    pl = size + overhead
+    n = math.ceil(float(8*pl - 4*sf + 28 + 16)/(4*(sf - 2*de)))
+    symbols = 8 + max(n*(cr + 4), 0)
+    return (preamble + 4.25)*tsym + symbols*tsym
+
+
+# Airtime of a frame of 'size' bytes, ValueError if it can never be sent at data rate 'dr'
+
+def frame_airtime(size, dr, region=region, budget=None):
+    t = airtime(size, dr)
+    dwell = regions[region][1]
+    if dwell is not None and t > dwell:
+        raise ValueError("frame longer than the dwell time at DR " + str(dr))
+    if budget is not None and t > budget:
+        raise ValueError("frame longer than the daily airtime budget")
+    return t
+
+
+class TxQueue(object):
+
+    def __init__(self, radio, dr=3, region=region, budget=None, clock=time.time, log=None,
+                 key=None):
+        self.radio = radio
+        self.dr = dr
+        self.region = region
+        self.duty, self.dwell = regions[region]
+        self.budget = budget                # seconds of airtime per day, None = no limit
+        self.clock = clock
+        self.queue = []                     # heap of (priority, seq, port, data, confirmed, future)
+        self.seq = 0
+        self.wake = asyncio.Event()
+        self.free = 0                       # clock time the duty cycle allows the next uplink
+        self.spent = deque()                # (clock time, airtime) of the last day
+        self.log = log                      # StateCache of the pacing state, by 'key'
+        self.key = key
+        state = None if log is None else log.get(key)
+        if state is not None:
+            self.free = state['free']
+            self.spent = deque(tuple(x) for x in state['spent'])
+        self.airtime = 0.0                  # total airtime of the queue
+        self.sent = 0
+
+    # Queue an uplink, returns the answer of the module (status, downlink FPort, data) as
+    # rn2903.RN2903.tx once it is transmitted
+
+    def send(self, port, data, confirmed=False, priority=normal):
+        frame_airtime(len(data), self.dr, self.region, self.budget)
+        future = asyncio.get_event_loop().create_future()
+        self.push((priority, self.seq, port, data, confirmed, future))
+        self.seq += 1
+        return future
+
+    def push(self, entry):
+        heapq.heappush(self.queue, entry)
+        self.wake.set()
+
+    # Seconds to wait before an uplink with airtime t may start
+
+    def delay(self, t, now):
+        wait = self.free - now
+        if self.budget is not None:
+            while self.spent and self.spent[0][0] <= now - day:
+                self.spent.popleft()
+            used = sum(a for stamp, a in self.spent)
+            for stamp, a in self.spent:
+                if used + t <= self.budget:
+                    break
+                used -= a
+                wait = max(wait, stamp + day - now)
+        return max(wait, 0)
+
+    def account(self, t, now):
+        self.airtime += t
+        self.sent += 1
+        if self.duty is not None:
+            self.free = now + t/self.duty               # airtime + off time
+        if self.budget is not None:
+            self.spent.append((now, t))
+            while self.spent[0][0] <= now - day:
+                self.spent.popleft()
+        if self.log is not None:
+            self.log.put(self.key, {'free': self.free, 'spent': [list(x) for x in self.spent]})
+
+    # Send the queued uplinks for ever, one at a time, when the limits allow the first one
+
+    async def run(self):
+        while True:
+            if not self.queue:
+                self.wake.clear()
+                await self.wake.wait()
+                continue
+            t = airtime(len(self.queue[0][3]), self.dr)
+            wait = self.delay(t, self.clock())
+            if wait > 0:
+                self.wake.clear()
+                try:
+                    await asyncio.wait_for(self.wake.wait(), wait)   # more urgent frame
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            entry = heapq.heappop(self.queue)
+            priority, seq, port, data, confirmed, future = entry
+            if future.cancelled():
+                continue
+            start = self.clock()
+            try:
+                answer = await self.radio.tx(port, data, confirmed)
+            except Exception as exc:
+                future.set_exception(exc)
+                continue
+            if answer[0] in refused:
+                self.free = max(self.free, self.clock() + retry)
+                self.push(entry)                        # keeps its place in the queue
+                continue
+            if answer[0] in transmitted:
+                self.account(t, start)
+            future.set_result(answer)